@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the analysis query, memory and rendering paths against the
+synthetic databases written by benchmarks.synthetic.
+
+Each scale is benchmarked in a fresh process with its own databases, so
+peak memory and connection state of one scale do not leak into the next.
+Every benchmark is run --repeat times with an empty result cache, and once
+more under tracemalloc to record the peak memory allocated in this process
+(figures rendered in worker processes are not included). Results are
+printed as a table and can be written to JSON and compared against the JSON
+of a previous run. The exit status is 1 if a benchmark failed, or became
+slower or larger than the tolerance allows.
+
+    python -m benchmarks.run --scale small --scale medium \
+        --output results.json --baseline baseline.json
+
+@author: r24mille
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+# Windows of the pre- and post-TOU summers compared by the aggregate analyses
+PRE_TOU = ("2011-05-01 00:00:00", "2011-10-31 23:59:59")
+POST_TOU = ("2012-05-01 00:00:00", "2012-10-31 23:59:59")
+LOCATION_ID = 13
+
+
+def benchmarks(processes=1):
+    """
+    Returns a list of (name, setup, run) tuples. setup() is called untimed
+    before every run() and returns the arguments passed to run. Imports are
+    deferred until Django is configured.
+
+    Arguments:
+    processes -- (Optional) Number of processes rendering heatmaps. Defaults
+                 to 1.
+    """
+    import pylab
+
+    from data_cleaning import univariate
+    from ldc_analysis import aggregate
+    from ldc_analysis.cache import RESULT_CACHE
+    from ldc_analysis.clustering import cluster_profiles
+    from ldc_analysis.feeders import FeederTree, transformer_feeder_heatmaps
+    from ldc_analysis.models import Transformer
+    from ldc_analysis.quantize import build_quantized_readings
+    from ldc_analysis.render import render_heatmaps
+    from ldc_analysis.tou import SUMMER_EVENING_MID_PEAK, \
+        SUMMER_MORNING_MID_PEAK, SUMMER_MORNING_OFF_PEAK, \
+        SUMMER_NIGHT_OFF_PEAK, SUMMER_ON_PEAK
+    from ldc_analysis.weather import clear_weather_stores
+    from transformer_demand import run as transformer_run
+    from transformer_demand.loads import iter_transformer_heatmaps
+    from transformer_demand.utilization import utilization_scan
+    from zonal_demand import run as zonal_run
+    from zonal_demand.heatmaps import TOTAL_COLUMNS, ZONE_COLUMNS, \
+        zonal_heatmaps
+
+    periods = [SUMMER_MORNING_OFF_PEAK, SUMMER_MORNING_MID_PEAK,
+               SUMMER_ON_PEAK, SUMMER_EVENING_MID_PEAK, SUMMER_NIGHT_OFF_PEAK]
+    columns = TOTAL_COLUMNS + ZONE_COLUMNS
+
+    def cold():
+        RESULT_CACHE.invalidate()
+        clear_weather_stores()
+        pylab.close("all")
+        return ()
+
+    def transformers():
+        return Transformer.objects.using("ldc").filter(Enabled=True)
+
+    def transformer_jobs():
+        cold()
+        return (list(transformer_run.heatmap_jobs(transformers(), "all",
+                                                  "all")),)
+
+    def zonal_jobs():
+        cold()
+        return (zonal_run.heatmap_jobs(columns, *zonal_heatmaps(columns)),)
+
+    return [
+        ("partition_by_temperature", cold,
+         lambda: [aggregate.partition_by_temperature(LOCATION_ID, *window)
+                  for window in (PRE_TOU, POST_TOU)]),
+        ("stream_partition_by_temperature", cold,
+         lambda: [aggregate.stream_partition_by_temperature(LOCATION_ID,
+                                                            *window)
+                  for window in (PRE_TOU, POST_TOU)]),
+        ("build_quantized_readings", cold,
+         lambda: build_quantized_readings(LOCATION_ID, rebuild=True)),
+        ("quantize_by_period", cold,
+         lambda: [aggregate.quantize_by_period(period)
+                  for period in periods]),
+        ("quantize_by_periods", cold,
+         lambda: aggregate.quantize_by_periods(periods)),
+        ("hourly_sm_reading_histogram", cold,
+         lambda: univariate.hourly_sm_reading_histogram(meter_range=None)),
+        ("reading_count_histogram", cold,
+         lambda: univariate.reading_count_histogram(meter_range=None)),
+        ("sm_reading_exception_count_histogram", cold,
+         univariate.sm_reading_exception_count_histogram),
+        ("cluster_profiles", cold,
+         lambda: cluster_profiles(PRE_TOU[0], POST_TOU[1])),
+        ("transformer_heatmaps.build", cold,
+         lambda: sum(1 for _ in iter_transformer_heatmaps(transformers()))),
+        ("transformer_utilization", cold,
+         lambda: utilization_scan(transformers())),
+        ("transformer_heatmaps.render", transformer_jobs,
+         lambda jobs: render_heatmaps(jobs, processes=processes, force=True)),
+        ("feeder_heatmaps.build", cold,
+         lambda: transformer_feeder_heatmaps(FeederTree.load(), *PRE_TOU)),
+        ("zonal_heatmaps.build", cold,
+         lambda: zonal_heatmaps(columns)),
+        ("zonal_heatmaps.render", zonal_jobs,
+         lambda jobs: render_heatmaps(jobs, processes=processes, force=True)),
+    ]
+
+
+def measure(setup, run, repeat):
+    """
+    Returns a dictionary of the wall clock "times" of repeat runs and the
+    "peak_bytes" traced by tracemalloc during one more run.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        run(*args)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"times": times, "peak_bytes": peak_bytes}
+
+
+def run_scale(repeat, processes):
+    """
+    Runs every benchmark against the databases configured by
+    benchmarks.settings and returns a dictionary of results by name. Figures,
+    histograms and cached results are written to a temporary directory.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import django
+    if hasattr(django, "setup"):
+        django.setup()
+    from django.db.backends.signals import connection_created
+
+    from benchmarks.synthetic import prepare_connection
+
+    connection_created.connect(prepare_connection)
+
+    results = {}
+    working_dir = tempfile.mkdtemp(prefix="ldc-benchmarks-")
+    cwd = os.getcwd()
+    os.chdir(working_dir)
+    try:
+        for name, setup, run in benchmarks(processes):
+            try:
+                # The analyses print progress, keep the report readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[name] = measure(setup, run, repeat)
+            except Exception as e:
+                results[name] = {"error": repr(e)}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(working_dir, ignore_errors=True)
+    return results
+
+
+def run_scales(scales, data_dir, repeat, processes):
+    """
+    Benchmarks each scale in a subprocess, generating its databases first if
+    they do not exist, and returns a dictionary of results by scale.
+    """
+    from benchmarks.synthetic import create_databases, database_path
+
+    results = {}
+    for scale in scales:
+        directory = os.path.abspath(os.path.join(data_dir, scale))
+        if not os.path.exists(database_path(directory, "zonal")):
+            print("generating", scale, "databases in", directory)
+            create_databases(directory, scale)
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE="benchmarks.settings",
+                   LDC_BENCHMARK_DIR=directory,
+                   MPLBACKEND="Agg")
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            subprocess.check_call([sys.executable, "-m", "benchmarks.run",
+                                   "--worker", output.name,
+                                   "--repeat", str(repeat),
+                                   "--processes", str(processes)],
+                                  env=env)
+            with open(output.name) as f:
+                results[scale] = json.load(f)
+    return results
+
+
+def print_report(results):
+    """Prints a table of the best and median time and peak memory."""
+    print("%-8s %-38s %10s %10s %10s" % ("scale", "benchmark", "best (s)",
+                                         "median (s)", "peak (MiB)"))
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            if "error" in result:
+                print("%-8s %-38s %s" % (scale, name, result["error"]))
+                continue
+            times = sorted(result["times"])
+            print("%-8s %-38s %10.3f %10.3f %10.1f" %
+                  (scale, name, times[0], times[len(times) // 2],
+                   result["peak_bytes"] / 1024.0 ** 2))
+
+
+def failures(results):
+    """Returns a list of messages for benchmarks that raised an error."""
+    messages = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            if "error" in result:
+                messages.append(scale + " " + name + " failed: " +
+                                result["error"])
+    return messages
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Returns a list of messages for benchmarks whose best time or peak memory
+    exceeds the baseline by more than the tolerance (eg. 0.25 for 25%).
+    Benchmarks that failed in either run are left to failures().
+    """
+    messages = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            base = baseline.get(scale, {}).get(name)
+            if base is None or "error" in base or "error" in result:
+                continue
+            best, base_best = min(result["times"]), min(base["times"])
+            if best > base_best * (1 + tolerance):
+                messages.append("%s %s time %.3fs > baseline %.3fs" %
+                                (scale, name, best, base_best))
+            if result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+                messages.append("%s %s peak memory %d > baseline %d bytes" %
+                                (scale, name, result["peak_bytes"],
+                                 base["peak_bytes"]))
+    return messages
+
+
+def main():
+    """Parses command line arguments and runs the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", action="append",
+                        help="small, medium or large, may be repeated "
+                             "(default: small and medium)")
+    parser.add_argument("--data-dir", default="./benchmark_data/")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="heatmap rendering processes")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.worker, "w") as f:
+            json.dump(run_scale(args.repeat, args.processes), f)
+        return
+
+    results = run_scales(args.scale or ["small", "medium"], args.data_dir,
+                         args.repeat, args.processes)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    messages = failures(results)
+    for message in messages:
+        print("FAILURE", message)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for message in slower:
+            print("REGRESSION", message)
+        messages += slower
+    if messages:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Django settings pointing the ldc and zonal connections at the SQLite
+databases written by benchmarks.synthetic.
+
+The directory is read from the LDC_BENCHMARK_DIR environment variable so
+that each scale is benchmarked in its own process.
+
+@author: r24mille
+"""
+import os
+
+
+BENCHMARK_DIR = os.environ.get("LDC_BENCHMARK_DIR", "./benchmark_data/small/")
+
+SECRET_KEY = "benchmarks-only"
+DEBUG = False
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BENCHMARK_DIR, "ldc.sqlite3"),
+    },
+    "ldc": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BENCHMARK_DIR, "ldc.sqlite3"),
+    },
+    "zonal": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BENCHMARK_DIR, "zonal.sqlite3"),
+    },
+}
+
+INSTALLED_APPS = (
+    "ldc_analysis",
+    "transformer_demand",
+    "zonal_demand",
+    "data_cleaning",
+)
+
+USE_TZ = False
@@ -0,0 +1,496 @@
+"""
+Synthetic SQLite stand-in for the private ldc and zonal MySQL databases.
+
+create_databases writes ldc.sqlite3, essex_annotated.sqlite3,
+weathertables.sqlite3 and zonal.sqlite3 into a directory, with the tables and
+columns read by the analysis modules filled with generated but plausible
+demand: daily load shapes, a cooling load that follows the temperature and
+noise. prepare_connection attaches the essex_annotated and weathertables
+databases to every Django SQLite connection and registers Python versions of
+the MySQL date functions used in raw SQL, so the queries run unchanged.
+
+@author: r24mille
+"""
+import argparse
+import datetime
+import math
+import os
+import sqlite3
+
+import numpy
+
+
+# Number of transformers, meters and days of readings generated per scale
+SCALES = {
+    "small": {"transformers": 20, "meters": 100,
+              "meter_days": 31, "load_days": 92},
+    "medium": {"transformers": 200, "meters": 1000,
+               "meter_days": 92, "load_days": 365},
+    "large": {"transformers": 1000, "meters": 5000,
+              "meter_days": 184, "load_days": 730},
+}
+
+# Aggregate readings and weather span both summers compared by the TOU
+# analyses, whatever the scale
+START_DATE = datetime.date(2011, 5, 1)
+END_DATE = datetime.date(2012, 10, 31)
+LOCATION_IDS = [13, 14]
+FIRST_METER_ID = 20000
+AREAS = ["A1-TEC", "A2-LAS", "A3-AMH"]
+KVA_RATINGS = [25, 50, 75, 100, 167]
+
+# Attached databases, referenced as <schema>.<table> by the analyses
+ATTACHED = ["essex_annotated", "weathertables"]
+
+SCHEMAS = {
+    "ldc": [
+        "create table FeederMapping ("
+        "Feeder varchar(20) primary key, ParentFeeder_id varchar(20), "
+        "MeterType varchar(2))",
+        "create table Transformers ("
+        "TransformerID varchar(20) primary key, Type varchar(100), "
+        "KVA integer, Phasing varchar(6), CircuitNumber varchar(16), "
+        "PrimaryVoltage varchar(16), SecondaryVoltage varchar(20), "
+        "InstallationYear integer, DWGNumber varchar(30), "
+        "Phases varchar(24), Serial1 varchar(100), Serial2 varchar(100), "
+        "Serial3 varchar(100), Enabled bool, Quantity smallint, "
+        "Angle decimal, AreaTown varchar(40), Status varchar(100), "
+        "Owner varchar(100), Connect_Date datetime, "
+        "Disconnect_Date datetime)",
+        "create table TransformerLoads ("
+        "TransformerLoadID integer primary key, TransformerID varchar(20), "
+        "ReadDate date, reading_datetime_standard datetime, "
+        "Interval integer, TransformerLoad real)",
+        "create index transformer_loads_read_date "
+        "on TransformerLoads (TransformerID, ReadDate)",
+        "create table Meters ("
+        "MeterID integer primary key, MeterNumber varchar(30), "
+        "CustomerPremiseNumber integer, ConnectDate datetime, "
+        "DisconnectDate datetime, PeakKW real, Volts integer, "
+        "Phase integer, Enabled bool, Feeder varchar(20), "
+        "TransformerID varchar(20), PropertyTypeID integer, "
+        "fsa_code varchar(3), da_id_2006 integer, da_id_2011 integer)",
+        "create index meters_meter_number on Meters (MeterNumber)",
+        "create table meter_data_quality_flag ("
+        "meter_data_quality_flag_id integer primary key, MeterID integer, "
+        "data_quality_flag_id integer, applicability_start_date date, "
+        "applicability_end_date date)",
+        "create index mdqf_meter on meter_data_quality_flag (MeterID)",
+        "create table SmartMeterReadingsExceptions ("
+        "MeterNumber varchar(30), reading_datetime_standard datetime)",
+        "create index smre_meter_number "
+        "on SmartMeterReadingsExceptions (MeterNumber)",
+        "create table r24mille_aggregate_res_readings ("
+        "aggregate_reading_datetime_standard datetime primary key, "
+        "aggregate_reading real, number_of_meters integer)",
+    ],
+    "essex_annotated": [
+        "create table SmartMeterReadings ("
+        "SmartMeterReadings_id integer primary key, MeterID integer, "
+        "ReadDate date, ReadTime integer, read_datetime datetime, "
+        "UOMID integer, Reading real)",
+        "create index smr_meter_read_date "
+        "on SmartMeterReadings (MeterID, ReadDate)",
+        "create table r24mille_quantized_res_readings ("
+        "rounded_temp integer, tou_period_id integer, "
+        "tou_billing_active integer, sample_mean real, "
+        "sample_variance real, number_of_readings integer)",
+    ],
+    "weathertables": [
+        "create table wunderground_observation ("
+        "location_id integer, observation_datetime_standard datetime, "
+        "temp_metric real)",
+        "create index wu_location_datetime on wunderground_observation "
+        "(location_id, observation_datetime_standard)",
+    ],
+    "zonal": [
+        "create table zonal_demand ("
+        "zonal_demand_id integer primary key, demand_datetime_dst datetime, "
+        "demand_datetime_standard datetime, demand_timezone varchar(3), "
+        "hour integer, total_ontario decimal, total_zones decimal, "
+        "difference decimal, northwest decimal, northeast decimal, "
+        "ottawa decimal, east decimal, toronto decimal, essa decimal, "
+        "bruce decimal, southwest decimal, niagara decimal, west decimal)",
+    ],
+}
+
+# Share of Ontario demand in each transmission zone
+ZONE_SHARES = [("northwest", 0.03), ("northeast", 0.07), ("ottawa", 0.09),
+               ("east", 0.06), ("toronto", 0.35), ("essa", 0.06),
+               ("bruce", 0.01), ("southwest", 0.19), ("niagara", 0.04),
+               ("west", 0.10)]
+
+
+def database_path(directory, name):
+    """Returns the path of the SQLite file of a database or schema."""
+    return os.path.join(directory, name + ".sqlite3")
+
+
+def _datetime_text(value):
+    """Parses the date portion of a MySQL-formatted DATE or DATETIME."""
+    return datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def _date_function(extract):
+    """Wraps a function of a datetime.date as a NULL-safe SQL function."""
+    def function(value):
+        if value is None:
+            return None
+        return extract(_datetime_text(str(value)))
+    return function
+
+
+def _hour(value):
+    if value is None:
+        return None
+    value = str(value)
+    return int(value[11:13]) if len(value) > 10 else 0
+
+
+def _time_to_sec(value):
+    if value is None:
+        return None
+    value = str(value)
+    if len(value) <= 10:
+        return 0
+    return (int(value[11:13]) * 3600 + int(value[14:16]) * 60 +
+            int(value[17:19]))
+
+
+def _floor(value):
+    return None if value is None else math.floor(value)
+
+
+def register_mysql_functions(connection):
+    """
+    Registers the MySQL functions used by the analyses' raw SQL on a sqlite3
+    connection.
+
+    Arguments:
+    connection -- sqlite3.Connection.
+    """
+    connection.create_function("hour", 1, _hour)
+    connection.create_function("time_to_sec", 1, _time_to_sec)
+    connection.create_function("floor", 1, _floor)
+    connection.create_function("year", 1, _date_function(lambda d: d.year))
+    connection.create_function("month", 1, _date_function(lambda d: d.month))
+    connection.create_function("dayofmonth", 1,
+                               _date_function(lambda d: d.day))
+    connection.create_function("weekday", 1,
+                               _date_function(lambda d: d.weekday()))
+    connection.create_function("dayofweek", 1,
+                               _date_function(
+                                   lambda d: (d.weekday() + 1) % 7 + 1))
+    # MySQL TO_DAYS() counts days from year 0
+    connection.create_function("to_days", 1,
+                               _date_function(lambda d: d.toordinal() + 365))
+
+
+def prepare_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver attaching the essex_annotated and
+    weathertables databases next to a SQLite database and registering the
+    MySQL functions. Connect it before the first query is run.
+    """
+    if connection.vendor != "sqlite":
+        return
+    register_mysql_functions(connection.connection)
+    directory = os.path.dirname(connection.settings_dict["NAME"])
+    for schema in ATTACHED:
+        path = database_path(directory, schema)
+        if os.path.exists(path):
+            connection.connection.execute("attach database ? as " + schema,
+                                          [path])
+
+
+def _timestamps(start_date, num_days):
+    """Returns hourly datetime64[h] timestamps of num_days from start_date."""
+    return numpy.datetime64(start_date, "h") + numpy.arange(num_days * 24)
+
+
+def _datetime_strings(timestamps):
+    """Formats datetime64 values as MySQL DATETIME strings."""
+    return numpy.char.replace(
+        numpy.datetime_as_string(timestamps, unit="s"), "T", " ")
+
+
+def _date_strings(timestamps):
+    """Formats the date of datetime64 values as MySQL DATE strings."""
+    return numpy.datetime_as_string(timestamps.astype("datetime64[D]"))
+
+
+def _temperatures(timestamps, rng):
+    """
+    Returns hourly outdoor temperatures (Celsius) with a seasonal cycle
+    peaking in July, a daily cycle peaking mid-afternoon and noise.
+    """
+    days = (timestamps.astype("datetime64[D]") -
+            numpy.datetime64("2011-01-01")).astype(numpy.float64)
+    hours = (timestamps - timestamps.astype("datetime64[D]")) \
+        .astype(numpy.float64)
+    seasonal = 8.0 - 16.0 * numpy.cos(2 * numpy.pi * (days - 20) / 365.25)
+    daily = -5.0 * numpy.cos(2 * numpy.pi * (hours - 3) / 24)
+    return seasonal + daily + rng.normal(0, 2.0, len(timestamps))
+
+
+def _load_shape(timestamps):
+    """
+    Returns a relative household load shape with a morning and a larger
+    evening peak, lower on weekends.
+    """
+    hours = (timestamps - timestamps.astype("datetime64[D]")) \
+        .astype(numpy.float64)
+    weekdays = (timestamps.astype("datetime64[D]").astype(numpy.int64) + 3) % 7
+    shape = 0.6 + 0.3 * numpy.exp(-((hours - 8) ** 2) / 4) + \
+        0.7 * numpy.exp(-((hours - 19) ** 2) / 8)
+    return shape * numpy.where(weekdays >= 5, 0.9, 1.0)
+
+
+def _cooling(temperatures):
+    """Returns the relative cooling load at outdoor temperatures."""
+    return 1.0 + 0.06 * numpy.maximum(temperatures - 18.0, 0)
+
+
+def _insert(connection, table, columns, rows):
+    """Inserts rows (an iterable of tuples) with a single executemany."""
+    connection.executemany("insert into " + table + " (" +
+                           ", ".join(columns) + ") values (" +
+                           ", ".join(["?"] * len(columns)) + ")", rows)
+
+
+def _write_weather(connection, rng):
+    timestamps = _timestamps(START_DATE, (END_DATE - START_DATE).days + 1)
+    texts = _datetime_strings(timestamps).tolist()
+    weather = {}
+    for location_id in LOCATION_IDS:
+        temperatures = _temperatures(timestamps, rng) + \
+            rng.normal(0, 1.0)
+        weather[location_id] = temperatures
+        # Every hour has an observation, partition_by_temperature expects
+        # the weather join to always find a temperature
+        _insert(connection, "wunderground_observation",
+                ["location_id", "observation_datetime_standard",
+                 "temp_metric"],
+                zip([location_id] * len(texts), texts,
+                    numpy.round(temperatures, 1).tolist()))
+    return timestamps, weather[LOCATION_IDS[0]]
+
+
+def _write_aggregate(connection, timestamps, temperatures, rng):
+    num_meters = 20000 + rng.integers(-50, 50, len(timestamps))
+    average = _load_shape(timestamps) * _cooling(temperatures) * \
+        rng.lognormal(0, 0.05, len(timestamps))
+    _insert(connection, "r24mille_aggregate_res_readings",
+            ["aggregate_reading_datetime_standard", "aggregate_reading",
+             "number_of_meters"],
+            zip(_datetime_strings(timestamps).tolist(),
+                (average * num_meters).tolist(), num_meters.tolist()))
+
+
+def _write_feeders(connection, scale):
+    num_feeders = max(scale["meters"] // 250, 2)
+    feeders = [("SUB1", None, "S")] + \
+        [("F%03d" % i, "SUB1", "F") for i in range(num_feeders)]
+    _insert(connection, "FeederMapping",
+            ["Feeder", "ParentFeeder_id", "MeterType"], feeders)
+    return [feeder for feeder, _, _ in feeders[1:]]
+
+
+def _write_transformers(connection, scale, rng):
+    ids = ["T%05d" % i for i in range(scale["transformers"])]
+    kva = rng.choice(KVA_RATINGS, len(ids))
+    phases = numpy.where(rng.random(len(ids)) < 0.8, "1", "3")
+    areas = rng.choice(AREAS, len(ids))
+    enabled = rng.random(len(ids)) < 0.95
+    _insert(connection, "Transformers",
+            ["TransformerID", "Type", "KVA", "Phases", "Enabled",
+             "AreaTown", "Status", "Owner"],
+            zip(ids, ["Pole"] * len(ids), kva.tolist(), phases.tolist(),
+                enabled.tolist(), areas.tolist(), ["In Service"] * len(ids),
+                ["LDC"] * len(ids)))
+    return ids, kva
+
+
+def _write_transformer_loads(connection, scale, transformer_ids, kva,
+                             weather_timestamps, temperatures, rng):
+    timestamps = _timestamps(START_DATE, scale["load_days"])
+    # Reuse the first location's temperatures where they overlap
+    temps = numpy.interp(timestamps.astype(numpy.float64),
+                         weather_timestamps.astype(numpy.float64),
+                         temperatures)
+    shape = _load_shape(timestamps) * _cooling(temps)
+    dates = _date_strings(timestamps).tolist()
+    texts = _datetime_strings(timestamps).tolist()
+    intervals = (timestamps - timestamps.astype("datetime64[D]")) \
+        .astype(numpy.int64).tolist()
+    for i, transformer_id in enumerate(transformer_ids):
+        # Peak utilization varies between 40% and 120% of the rating (MW)
+        peak = kva[i] / 1000.0 * rng.uniform(0.4, 1.2)
+        loads = peak * shape / shape.max() * \
+            rng.lognormal(0, 0.1, len(timestamps))
+        # A few hours of each transformer's timeseries are missing
+        kept = numpy.flatnonzero(rng.random(len(timestamps)) >= 0.002)
+        _insert(connection, "TransformerLoads",
+                ["TransformerID", "ReadDate", "reading_datetime_standard",
+                 "Interval", "TransformerLoad"],
+                ((transformer_id, dates[j], texts[j], intervals[j],
+                  float(loads[j])) for j in kept))
+
+
+def _write_meters(connection, scale, transformer_ids, feeders, rng):
+    meter_ids = numpy.arange(FIRST_METER_ID,
+                             FIRST_METER_ID + scale["meters"])
+    numbers = ["M%07d" % meter_id for meter_id in meter_ids]
+    phases = numpy.where(rng.random(len(meter_ids)) < 0.95, 1, 3)
+    _insert(connection, "Meters",
+            ["MeterID", "MeterNumber", "PeakKW", "Volts", "Phase", "Enabled",
+             "Feeder", "TransformerID"],
+            zip(meter_ids.tolist(), numbers,
+                rng.uniform(2, 12, len(meter_ids)).tolist(),
+                [240] * len(meter_ids), phases.tolist(),
+                [True] * len(meter_ids),
+                rng.choice(feeders, len(meter_ids)).tolist(),
+                rng.choice(transformer_ids, len(meter_ids)).tolist()))
+
+    # About two percent of meters are flagged for the whole study and five
+    # percent for a few weeks, some more than once
+    flagged = meter_ids[rng.random(len(meter_ids)) < 0.02]
+    _insert(connection, "meter_data_quality_flag",
+            ["MeterID", "data_quality_flag_id", "applicability_start_date",
+             "applicability_end_date"],
+            ((int(meter_id), 1, "2011-01-01", "2013-01-01")
+             for meter_id in flagged))
+    partial = rng.choice(meter_ids, int(len(meter_ids) * 0.05) + 1)
+    starts = numpy.datetime64(START_DATE) + \
+        rng.integers(0, scale["meter_days"], len(partial))
+    ends = starts + rng.integers(0, 30, len(partial))
+    _insert(connection, "meter_data_quality_flag",
+            ["MeterID", "data_quality_flag_id", "applicability_start_date",
+             "applicability_end_date"],
+            zip(partial.tolist(), [2] * len(partial),
+                numpy.datetime_as_string(starts).tolist(),
+                numpy.datetime_as_string(ends).tolist()))
+
+    # Exceptions per meter follow a long-tailed distribution
+    exceptions = rng.geometric(0.05, len(meter_ids)) - 1
+    _insert(connection, "SmartMeterReadingsExceptions",
+            ["MeterNumber", "reading_datetime_standard"],
+            ((numbers[i], "2011-06-01 00:00:00")
+             for i in numpy.repeat(numpy.arange(len(meter_ids)), exceptions)))
+    return meter_ids
+
+
+def _write_meter_readings(connection, scale, meter_ids, weather_timestamps,
+                          temperatures, rng):
+    timestamps = _timestamps(START_DATE, scale["meter_days"])
+    temps = numpy.interp(timestamps.astype(numpy.float64),
+                         weather_timestamps.astype(numpy.float64),
+                         temperatures)
+    shape = _load_shape(timestamps) * _cooling(temps)
+    dates = _date_strings(timestamps).tolist()
+    texts = _datetime_strings(timestamps).tolist()
+    read_times = ((timestamps - timestamps.astype("datetime64[D]"))
+                  .astype(numpy.int64) * 100).tolist()
+    for meter_id in meter_ids.tolist():
+        readings = numpy.round(rng.lognormal(-0.4, 0.5) * shape *
+                               rng.lognormal(0, 0.3, len(timestamps)), 3)
+        # Meters miss readings in bursts of communication failures
+        missing = rng.random(len(timestamps)) < 0.01
+        kept = numpy.flatnonzero(~missing)
+        _insert(connection, "SmartMeterReadings",
+                ["MeterID", "ReadDate", "ReadTime", "read_datetime", "UOMID",
+                 "Reading"],
+                ((meter_id, dates[j], read_times[j], texts[j], 1,
+                  float(readings[j])) for j in kept))
+
+
+def _write_zonal(connection, scale, weather_timestamps, temperatures, rng):
+    timestamps = _timestamps(START_DATE, scale["load_days"])
+    temps = numpy.interp(timestamps.astype(numpy.float64),
+                         weather_timestamps.astype(numpy.float64),
+                         temperatures)
+    ontario = 15000.0 * _load_shape(timestamps) * _cooling(temps) * \
+        rng.lognormal(0, 0.02, len(timestamps))
+    zones = numpy.column_stack([ontario * share *
+                                rng.lognormal(0, 0.03, len(timestamps))
+                                for _, share in ZONE_SHARES])
+    total_zones = zones.sum(axis=1)
+    hours = (timestamps - timestamps.astype("datetime64[D]")) \
+        .astype(numpy.int64) + 1
+    columns = numpy.column_stack([ontario, total_zones,
+                                  ontario - total_zones, zones])
+    texts = _datetime_strings(timestamps).tolist()
+    _insert(connection, "zonal_demand",
+            ["demand_datetime_dst", "demand_datetime_standard",
+             "demand_timezone", "hour", "total_ontario", "total_zones",
+             "difference"] + [zone for zone, _ in ZONE_SHARES],
+            (((texts[i], texts[i], "EST", int(hours[i])) +
+              tuple(numpy.round(columns[i], 2).tolist()))
+             for i in range(len(timestamps))))
+
+
+def create_databases(directory, scale="small", seed=0):
+    """
+    Writes the synthetic ldc, essex_annotated, weathertables and zonal SQLite
+    databases into directory, replacing existing ones.
+
+    Arguments:
+    directory -- Directory of the database files, created on demand.
+    scale -- (Optional) Name of an entry in SCALES or a dictionary with the
+             same keys. Defaults to "small".
+    seed -- (Optional) Seed of the random generator. Defaults to 0.
+    """
+    if not isinstance(scale, dict):
+        scale = SCALES[scale]
+    rng = numpy.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    for name in ["ldc", "zonal"] + ATTACHED:
+        path = database_path(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    connection = sqlite3.connect(database_path(directory, "ldc"))
+    connection.execute("pragma synchronous = off")
+    for schema in ATTACHED:
+        connection.execute("attach database ? as " + schema,
+                           [database_path(directory, schema)])
+    for schema in ["ldc"] + ATTACHED:
+        prefix = "" if schema == "ldc" else schema + "."
+        for statement in SCHEMAS[schema]:
+            connection.execute(statement
+                               .replace("create table ",
+                                        "create table " + prefix)
+                               .replace("create index ",
+                                        "create index " + prefix))
+
+    timestamps, temperatures = _write_weather(connection, rng)
+    _write_aggregate(connection, timestamps, temperatures, rng)
+    feeders = _write_feeders(connection, scale)
+    transformer_ids, kva = _write_transformers(connection, scale, rng)
+    _write_transformer_loads(connection, scale, transformer_ids, kva,
+                             timestamps, temperatures, rng)
+    meter_ids = _write_meters(connection, scale, transformer_ids, feeders,
+                              rng)
+    _write_meter_readings(connection, scale, meter_ids, timestamps,
+                          temperatures, rng)
+    connection.commit()
+    connection.close()
+
+    connection = sqlite3.connect(database_path(directory, "zonal"))
+    for statement in SCHEMAS["zonal"]:
+        connection.execute(statement)
+    _write_zonal(connection, scale, timestamps, temperatures, rng)
+    connection.commit()
+    connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--directory", default=None,
+                        help="defaults to ./benchmark_data/<scale>/")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    create_databases(args.directory or
+                     os.path.join("./benchmark_data/", args.scale),
+                     args.scale, args.seed)
@@ -0,0 +1,81 @@
+"""
+Test case running against synthetic databases written by
+benchmarks.synthetic.
+
+The databases are generated once per test class into a temporary directory
+and the ldc and zonal connections are pointed at them, so tests of the raw
+SQL paths run without a MySQL server. Run the tests with the settings of
+benchmarks.settings (or any settings with SQLite ldc and zonal connections);
+the test class is skipped otherwise.
+
+@author: r24mille
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import SimpleTestCase
+
+from benchmarks.synthetic import create_databases, database_path, \
+    prepare_connection
+from ldc_analysis.cache import RESULT_CACHE
+from ldc_analysis.weather import clear_weather_stores
+
+
+# A few meters, transformers and days, enough to exercise every query
+TEST_SCALE = {"transformers": 4, "meters": 12, "meter_days": 7,
+              "load_days": 14}
+
+ALIASES = ("ldc", "zonal")
+
+
+class SyntheticDatabaseTestCase(SimpleTestCase):
+    """
+    SimpleTestCase allowed to query the ldc and zonal connections, pointed at
+    synthetic databases of scale for the duration of the class. The result
+    cache is moved to the same temporary directory and the weather stores
+    are cleared, so nothing is shared with other test classes.
+    """
+    allow_database_queries = True
+    scale = TEST_SCALE
+
+    @classmethod
+    def setUpClass(cls):
+        for alias in ALIASES:
+            if connections[alias].vendor != "sqlite":
+                raise unittest.SkipTest("The " + alias + " connection is "
+                                        "not SQLite")
+        super(SyntheticDatabaseTestCase, cls).setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        create_databases(cls.directory, cls.scale)
+        # Threads open connections from the shared settings, the connection
+        # of this thread is replaced as close() keeps the test runner's
+        # in-memory SQLite databases open
+        cls._connections = {}
+        cls._names = {}
+        for alias in ALIASES:
+            settings_dict = connections.databases[alias]
+            cls._names[alias] = settings_dict["NAME"]
+            settings_dict["NAME"] = database_path(cls.directory, alias)
+            cls._connections[alias] = connections[alias]
+            connections[alias] = \
+                connections[alias].__class__(settings_dict, alias)
+        connection_created.connect(prepare_connection)
+        cls._cache_directory = RESULT_CACHE.directory
+        RESULT_CACHE.directory = os.path.join(cls.directory, "cache")
+        clear_weather_stores()
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in ALIASES:
+            connections[alias].close()
+            connections.databases[alias]["NAME"] = cls._names[alias]
+            connections[alias] = cls._connections[alias]
+        connection_created.disconnect(prepare_connection)
+        RESULT_CACHE.directory = cls._cache_directory
+        clear_weather_stores()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+        super(SyntheticDatabaseTestCase, cls).tearDownClass()
@@ -0,0 +1,285 @@
+"""
+Bounded-memory histograms of streamed readings.
+
+@author: r24mille
+"""
+import math
+
+import numpy
+
+from data_cleaning.sketch import TDigest
+from ldc_analysis.profiling import timer
+from ldc_analysis.query import SelectQuery
+from ldc_analysis.render import select_backend
+
+
+class StreamingHistogram(object):
+    """
+    Accumulates fixed-width bin counts and a TDigest of values chunk by
+    chunk. Base bins are anchored at zero with a width of bin_size, or of 1
+    for bin sizes above 1, so they can be regrouped into bins of bin_size
+    starting at any integer once the trimmed minimum is known. Only the
+    occupied base bins are stored and histograms of separate chunks or
+    shards can be merged.
+    """
+
+    def __init__(self, bin_size, compression=1000):
+        """
+        Arguments:
+        bin_size -- Size of histogram's value bins (float). Must divide 1 or
+                    be a whole number.
+        compression -- (Optional) Compression of the TDigest used to find
+                       trim percentiles. Defaults to 1000.
+        """
+        self.bin_size = bin_size
+        self.unit = min(bin_size, 1.0)
+        self.indices = numpy.empty(0, dtype=numpy.int64)
+        self.counts = numpy.empty(0, dtype=numpy.int64)
+        self.digest = TDigest(compression)
+
+    @property
+    def count(self):
+        """Number of values accumulated."""
+        return int(self.counts.sum())
+
+    def update(self, values):
+        """
+        Adds a chunk of values, NaN values are ignored.
+
+        Arguments:
+        values -- 1D array_like of numeric values.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        values = values[~numpy.isnan(values)]
+        if values.size == 0:
+            return
+        self.digest.update(values)
+        # Rounding guards against values such as 0.3 / 0.1 = 2.9999...
+        indices = numpy.floor(numpy.round(values / self.unit, 9))
+        indices, counts = numpy.unique(indices.astype(numpy.int64),
+                                       return_counts=True)
+        self._add(indices, counts)
+
+    def merge(self, other):
+        """
+        Adds the values accumulated by another StreamingHistogram with the
+        same bin_size.
+
+        Arguments:
+        other -- StreamingHistogram to merge in.
+        """
+        if other.unit != self.unit:
+            raise ValueError("Cannot merge histograms of different bin sizes")
+        self.digest.merge(other.digest)
+        self._add(other.indices, other.counts)
+
+    def _add(self, indices, counts):
+        indices, groups = numpy.unique(numpy.concatenate((self.indices,
+                                                          indices)),
+                                       return_inverse=True)
+        self.counts = numpy.bincount(
+            groups, weights=numpy.concatenate((self.counts, counts))) \
+            .astype(numpy.int64)
+        self.indices = indices
+
+    def trim_bounds(self, trim_p, trim_type="both"):
+        """
+        Returns the estimated (lowest, highest) values kept after trimming
+        trim_p of the values from the tails given by trim_type, see
+        create_histogram.
+        """
+        low = self.digest.min
+        high = self.digest.max
+        if trim_p > 0 and trim_type in ("left", "both"):
+            low = float(self.digest.quantile(trim_p))
+        if trim_p > 0 and trim_type in ("right", "both"):
+            high = float(self.digest.quantile(1.0 - trim_p))
+        return low, high
+
+    def bins(self, trim_p, dec_prec=0, trim_type="both"):
+        """
+        Returns (edges, counts) arrays of the trimmed histogram, with the
+        same bin edges create_histogram would use for the full list of
+        values.
+
+        Arguments:
+        trim_p -- Percentile (range 0 to 1) of values to trim (float)
+        dec_prec -- (Optional) Decimal precision of bins. Defaults to 0.
+        trim_type -- (Optional) "both", "left" or "right". Defaults to "both".
+        """
+        low, high = self.trim_bounds(trim_p, trim_type)
+        bin_min = math.floor(low)
+        bin_max = round(high, dec_prec)
+        num_bins = int(round((bin_max - bin_min) / self.bin_size))
+        edges = bin_min + self.bin_size * numpy.arange(num_bins + 1)
+
+        lower_edges = self.indices * self.unit
+        kept = (lower_edges + self.unit > low) & (lower_edges <= high)
+        counts, _ = numpy.histogram(lower_edges[kept] + self.unit / 2.0,
+                                    bins=edges, weights=self.counts[kept])
+        return edges, counts.astype(numpy.int64)
+
+
+def server_binned_query(query, bin_size):
+    """
+    Returns a SelectQuery that bins the "value" column of query inside the
+    database. Each result row is (bin, count, min, max), where bin is
+    floor(value / bin_size) and min and max are the extreme values within
+    the bin, so only one row per occupied bin crosses the wire.
+
+    Arguments:
+    query -- SelectQuery with a numeric column aliased "value" (eg.
+             "count(smr.read_datetime) as value").
+    bin_size -- Size of histogram's value bins (float)
+    """
+    binned = SelectQuery(["floor(binned.value / %s) as value_bin",
+                          "count(*)",
+                          "min(binned.value)",
+                          "max(binned.value)"],
+                         query, column_params=[bin_size], alias="binned")
+    binned.group("value_bin")
+    binned.order("value_bin asc")
+    return binned
+
+
+def bin_values(values, bin_size):
+    """
+    Returns (bin, count, min, max) rows of values binned in Python the way
+    server_binned_query bins them in the database, so both can be merged
+    with merge_binned.
+
+    Arguments:
+    values -- array_like of numeric values.
+    bin_size -- Size of histogram's value bins (float)
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    rows = numpy.column_stack((numpy.floor(values / bin_size),
+                               numpy.ones(len(values)), values, values))
+    return merge_binned(rows, numpy.empty((0, 4)))
+
+
+def merge_binned(rows, other):
+    """
+    Combines two arrays of (bin, count, min, max) rows, eg. from separate
+    shards of a server_binned_query, into one array ordered by bin.
+
+    Arguments:
+    rows -- 2D array of (bin, count, min, max) rows.
+    other -- 2D array of (bin, count, min, max) rows.
+    """
+    combined = numpy.concatenate((rows, other))
+    bins, groups = numpy.unique(combined[:, 0], return_inverse=True)
+    counts = numpy.bincount(groups, weights=combined[:, 1],
+                            minlength=len(bins))
+    minima = numpy.full(len(bins), numpy.inf)
+    maxima = numpy.full(len(bins), -numpy.inf)
+    numpy.minimum.at(minima, groups, combined[:, 2])
+    numpy.maximum.at(maxima, groups, combined[:, 3])
+    return numpy.column_stack((bins, counts, minima, maxima))
+
+
+def _trim_lowest(counts, num_values):
+    """Removes num_values from the lowest bins of a counts array."""
+    removed = numpy.minimum(numpy.cumsum(counts), num_values)
+    return counts - numpy.diff(numpy.concatenate(([0], removed)))
+
+
+def trim_binned(rows, bin_size, trim_p, trim_type="both"):
+    """
+    Trims pre-binned counts the way create_histogram trims a sorted list,
+    removing int(trim_p * n) values from the tails given by trim_type, at
+    the resolution of one bin. Returns (edges, counts) arrays spanning the
+    first to the last bin left occupied, both empty if no value is left.
+    Edges are multiples of bin_size.
+
+    Arguments:
+    rows -- 2D array of (bin, count, min, max) rows from
+            server_binned_query, ordered by bin.
+    bin_size -- Size of histogram's value bins (float)
+    trim_p -- Percentile (range 0 to 1) of values to trim (float)
+    trim_type -- (Optional) "both", "left" or "right". Defaults to "both".
+    """
+    empty = (numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64))
+    if not len(rows):
+        return empty
+    bins = rows[:, 0].astype(numpy.int64)
+    counts = numpy.zeros(bins[-1] - bins[0] + 1, dtype=numpy.int64)
+    counts[bins - bins[0]] = rows[:, 1]
+
+    num_trimmed = int(trim_p * counts.sum())
+    if trim_type in ("left", "both"):
+        counts = _trim_lowest(counts, num_trimmed)
+    if trim_type in ("right", "both"):
+        counts = _trim_lowest(counts[::-1], num_trimmed)[::-1]
+
+    occupied = numpy.flatnonzero(counts)
+    if not len(occupied):
+        return empty
+    first, last = occupied[0], occupied[-1]
+    edges = (bins[0] + numpy.arange(first, last + 2)) * bin_size
+    return edges, counts[first:last + 1]
+
+
+def plot_binned_histogram(edges, counts, trim_p, p_title, p_ylabel, p_xlabel,
+                          file_prefix):
+    """
+    Interacts with pylab to draw and save a histogram plot from pre-binned
+    counts, styled like create_histogram.
+
+    Arguments:
+    edges -- array_like of bin edges, one longer than counts.
+    counts -- array_like of the number of values in each bin.
+    trim_p -- Percentile (range 0 to 1) of values that were trimmed (float)
+    p_title -- Title of plot
+    p_ylabel -- ylabel of plot
+    p_xlabel -- xlabel of plot
+    file_prefix -- Filename prefix
+    """
+    select_backend()
+    import pylab
+
+    edges = numpy.asarray(edges, dtype=numpy.float64)
+    print("bin size=" + str(edges[1] - edges[0]) +
+          ", bin min=" + str(edges[0]) +
+          ", bin max=" + str(edges[-1]))
+    n, bins, patches = pylab.hist(edges[:-1],
+                                  bins=edges,
+                                  weights=counts,
+                                  histtype="stepfilled")
+    pylab.setp(patches, "facecolor", "g", "alpha", 0.75)
+    pylab.title(p_title)
+    pylab.xlabel(p_xlabel)
+    pylab.ylabel(p_ylabel)
+
+    with timer("savefig"):
+        if trim_p > 0:
+            pylab.savefig(file_prefix + "_trimmed.png")
+        else:
+            pylab.savefig(file_prefix + ".png")
+    pylab.show()
+
+
+def create_streaming_histogram(histogram, trim_p, p_title, p_ylabel,
+                               p_xlabel, file_prefix, dec_prec=0,
+                               trim_type="both"):
+    """
+    Trims, bins and plots a StreamingHistogram, the bounded-memory
+    counterpart of create_histogram.
+
+    Arguments:
+    histogram -- StreamingHistogram holding the values to plot
+    trim_p -- Percentile (range 0 to 1) of values to trim (float)
+    p_title -- Title of plot
+    p_ylabel -- ylabel of plot
+    p_xlabel -- xlabel of plot
+    file_prefix -- Filename prefix
+    dec_prec -- (Optional) Decimal precision of bins. Defaults to 0. (int)
+    trim_type -- (Optional) Controls the tail of distribution that percentile
+                 trim_p is applied. Values include "both", "left", and "right".
+                 Defaults to "both".
+    """
+    print("a length pre-trim_p", histogram.count)
+    edges, counts = histogram.bins(trim_p, dec_prec, trim_type)
+    print("a length post-trim_p", counts.sum())
+    plot_binned_histogram(edges, counts, trim_p, p_title, p_ylabel, p_xlabel,
+                          file_prefix)
@@ -0,0 +1,66 @@
+"""
+Plots histograms of smart meter readings to find outliers.
+
+    python manage.py histogram readings --meters 20000-20100
+    python manage.py histogram counts --start 2012-05-01 --end 2012-10-31
+    python manage.py histogram exceptions
+
+@author: r24mille
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from data_cleaning.univariate import SUMMER_2011_END, SUMMER_2011_START, \
+    hourly_sm_reading_histogram, reading_count_histogram, \
+    sm_reading_exception_count_histogram
+from ldc_analysis.management.base import AnalysisCommand, parse_date, \
+    parse_range
+
+
+KINDS = ("readings", "counts", "exceptions")
+
+
+class Command(AnalysisCommand):
+    args = "<" + "|".join(KINDS) + ">"
+    help = "Plots a histogram of hourly readings, of reading counts per " \
+        "meter or of exception counts per meter."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--meters", default=None,
+                    help="FIRST-LAST MeterID range, LAST is exclusive "
+                         "(readings, counts). Defaults to a sample."),
+        make_option("--all-meters", action="store_true", default=False,
+                    dest="all_meters",
+                    help="Read every meter (readings, counts)."),
+        make_option("--start", default=SUMMER_2011_START,
+                    help="First ReadDate (readings, counts). Defaults to " +
+                         SUMMER_2011_START + "."),
+        make_option("--end", default=SUMMER_2011_END,
+                    help="Last ReadDate (readings, counts). Defaults to " +
+                         SUMMER_2011_END + "."),
+        make_option("--workers", type="int", default=4,
+                    help="Number of MeterID shards scanned concurrently. "
+                         "Defaults to 4."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in KINDS:
+            raise CommandError("Expected one of " + ", ".join(KINDS))
+        if args[0] == "exceptions":
+            sm_reading_exception_count_histogram()
+            return
+
+        kwargs = {"start_date": str(parse_date(options["start"], "--start")),
+                  "end_date": str(parse_date(options["end"], "--end")),
+                  "workers": options["workers"]}
+        meter_range = parse_range(options["meters"], "--meters")
+        if options["all_meters"]:
+            if meter_range is not None:
+                raise CommandError("--meters and --all-meters are exclusive")
+            kwargs["meter_range"] = None
+        elif meter_range is not None:
+            kwargs["meter_range"] = meter_range
+        if args[0] == "readings":
+            hourly_sm_reading_histogram(**kwargs)
+        else:
+            reading_count_histogram(**kwargs)
@@ -0,0 +1,99 @@
+"""
+Mergeable quantile sketch for estimating percentiles of streamed readings.
+
+@author: r24mille
+"""
+import math
+
+import numpy
+
+
+class TDigest(object):
+    """
+    A t-digest quantile sketch. Values are summarized by weighted centroids
+    whose size is bounded by the arcsine scale function, so centroids are
+    small near the tails and the extreme percentiles used for trimming are
+    estimated accurately. Digests of separate chunks or shards can be merged.
+    Memory is proportional to the compression, not to the number of values.
+    """
+
+    def __init__(self, compression=1000):
+        """
+        Arguments:
+        compression -- (Optional) Scale factor controlling the number of
+                       centroids (about compression / 2). Defaults to 1000.
+        """
+        self.compression = compression
+        self.means = numpy.empty(0)
+        self.weights = numpy.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self):
+        """Total weight (number of values) summarized by the digest."""
+        return self.weights.sum()
+
+    def update(self, values):
+        """
+        Adds a chunk of values to the digest.
+
+        Arguments:
+        values -- 1D array_like of numeric values.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.size == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(numpy.concatenate((self.means, values)),
+                       numpy.concatenate((self.weights,
+                                          numpy.ones(values.size))))
+
+    def merge(self, other):
+        """
+        Adds the values summarized by another TDigest to this digest.
+
+        Arguments:
+        other -- TDigest to merge in.
+        """
+        if other.weights.size == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(numpy.concatenate((self.means, other.means)),
+                       numpy.concatenate((self.weights, other.weights)))
+
+    def _compress(self, means, weights):
+        """
+        Sorts centroids and merges neighbours that fall within the same unit
+        of the scale function k(q) = compression / (2 pi) * asin(2q - 1).
+        """
+        order = numpy.argsort(means, kind="mergesort")
+        means = means[order]
+        weights = weights[order]
+        cumulative = numpy.cumsum(weights)
+        centres = (cumulative - weights / 2.0) / cumulative[-1]
+        k = self.compression / (2.0 * math.pi) * \
+            numpy.arcsin(2.0 * centres - 1.0)
+        groups = numpy.floor(k - k[0]).astype(numpy.int64)
+        _, groups = numpy.unique(groups, return_inverse=True)
+        self.weights = numpy.bincount(groups, weights=weights)
+        self.means = numpy.bincount(groups, weights=means * weights) / \
+            self.weights
+
+    def quantile(self, q):
+        """
+        Returns the estimated value at quantile q (range 0 to 1), linearly
+        interpolated between centroids and the exact minimum and maximum.
+
+        Arguments:
+        q -- Quantile (float) or array_like of quantiles.
+        """
+        if self.weights.size == 0:
+            raise ValueError("Cannot estimate a quantile of an empty digest")
+        total = self.weights.sum()
+        centres = (numpy.cumsum(self.weights) - self.weights / 2.0) / total
+        positions = numpy.concatenate(([0.0], centres, [1.0]))
+        values = numpy.concatenate(([self.min], self.means, [self.max]))
+        return numpy.interp(q, positions, values)
@@ -1,3 +1,94 @@
-from django.test import TestCase
+import contextlib
+import io
 
-# Create your tests here.
+from django.test import SimpleTestCase
+import numpy
+
+from benchmarks.testcases import SyntheticDatabaseTestCase
+from data_cleaning.histogram import StreamingHistogram, trim_binned
+from data_cleaning.sketch import TDigest
+from data_cleaning.univariate import hourly_sm_reading_histogram, \
+    reading_count_histogram
+
+
+class TDigestTest(SimpleTestCase):
+
+    def test_quantiles_of_merged_digests(self):
+        rng = numpy.random.RandomState(0)
+        values = rng.exponential(2.0, 20000)
+        digest = TDigest(200)
+        other = TDigest(200)
+        digest.update(values[:5000])
+        other.update(values[5000:])
+        digest.merge(other)
+        self.assertEqual(digest.count, len(values))
+        self.assertEqual(digest.quantile(0.0), values.min())
+        self.assertEqual(digest.quantile(1.0), values.max())
+        # The estimates are accurate in rank, most of all in the tails
+        for q in (0.001, 0.01, 0.5, 0.99, 0.999):
+            rank = (values <= digest.quantile(q)).mean()
+            self.assertAlmostEqual(rank, q, delta=0.001)
+
+    def test_empty_digest(self):
+        digest = TDigest()
+        digest.update([])
+        digest.merge(TDigest())
+        self.assertEqual(digest.count, 0)
+        with self.assertRaises(ValueError):
+            digest.quantile(0.5)
+
+
+class StreamingHistogramTest(SimpleTestCase):
+
+    def test_matches_numpy_histogram(self):
+        rng = numpy.random.RandomState(0)
+        values = rng.lognormal(0, 0.8, 5000)
+        histogram = StreamingHistogram(0.1)
+        other = StreamingHistogram(0.1)
+        histogram.update(values[:2000])
+        other.update(numpy.append(values[2000:], numpy.nan))
+        histogram.merge(other)
+        self.assertEqual(histogram.count, len(values))
+        edges, counts = histogram.bins(0.0, dec_prec=1)
+        expected, _ = numpy.histogram(values, bins=edges)
+        numpy.testing.assert_array_equal(counts, expected)
+
+    def test_rejects_other_bin_sizes(self):
+        with self.assertRaises(ValueError):
+            StreamingHistogram(0.1).merge(StreamingHistogram(0.5))
+
+
+class TrimBinnedTest(SimpleTestCase):
+
+    def test_trims_both_tails(self):
+        rows = numpy.array([[-2, 1, 0, 0], [0, 10, 0, 0], [1, 10, 0, 0],
+                            [4, 1, 0, 0]], dtype=float)
+        edges, counts = trim_binned(rows, 0.5, 0.05)
+        numpy.testing.assert_array_equal(edges, [0.0, 0.5, 1.0])
+        numpy.testing.assert_array_equal(counts, [10, 10])
+        edges, counts = trim_binned(rows, 0.5, 0.05, "left")
+        numpy.testing.assert_array_equal(edges, numpy.arange(0, 5.5) * 0.5)
+        numpy.testing.assert_array_equal(counts, [10, 10, 0, 0, 1])
+
+    def test_empty_input(self):
+        edges, counts = trim_binned(numpy.empty((0, 2)), 0.5, 0.1)
+        self.assertEqual(len(edges), 0)
+        self.assertEqual(len(counts), 0)
+
+
+class EmptyHistogramTest(SyntheticDatabaseTestCase):
+
+    def test_no_readings(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = hourly_sm_reading_histogram(meter_range=(1, 100),
+                                                 workers=1)
+        self.assertIsNone(result)
+        self.assertIn("No readings", output.getvalue())
+
+    def test_no_reading_counts(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = reading_count_histogram(meter_range=(1, 100), workers=1)
+        self.assertIsNone(result)
+        self.assertIn("No readings", output.getvalue())
@@ -6,8 +6,73 @@ import os
 from django.db import connections
 from numpy import arange
 import numpy
-import pylab
-from scipy import stats
+
+from data_cleaning.histogram import StreamingHistogram, bin_values, \
+    create_streaming_histogram, merge_binned, plot_binned_histogram, \
+    server_binned_query, trim_binned
+from ldc_analysis.cache import cached_rows
+from ldc_analysis.quality import QualityFlagIndex
+from ldc_analysis.query import SelectQuery, to_days_dates
+from ldc_analysis.render import select_backend
+from ldc_analysis.shards import scan_shards, shard_ranges
+
+
+# Window of summer 2011 readings examined by the histograms
+SUMMER_2011_START = "2011-05-01"
+SUMMER_2011_END = "2011-10-31"
+
+# Source tables of each histogram, used to key cached query results
+READINGS_SOURCES = [("essex_annotated.SmartMeterReadings",
+                     "max(SmartMeterReadings_id)")]
+EXCEPTIONS_SOURCES = [("SmartMeterReadingsExceptions", "count(*)"),
+                      ("Meters", "count(*)")]
+
+
+def _phase1_readings_query(columns, meter_range, start_date, end_date):
+    """
+    Returns a SelectQuery over SmartMeterReadings of single phase meters. 
+    Every predicate is a plain comparison on MeterID or ReadDate with bound 
+    parameters. Readings with a data quality flag are not excluded, mask 
+    them with a QualityFlagIndex.
+    
+    Arguments:
+    columns -- List of select expressions.
+    meter_range -- (first, last) MeterID range, last is exclusive, or None 
+                   for all meters.
+    start_date -- First ReadDate (inclusive) in MySQL DATE format.
+    end_date -- Last ReadDate (inclusive) in MySQL DATE format.
+    """
+    query = SelectQuery(columns, "essex_annotated.SmartMeterReadings smr")
+    query.join("inner join Meters m "
+               "on m.MeterID = smr.MeterID and m.`Phase` = 1")
+    if meter_range is not None:
+        query.where("smr.MeterID >= %s", meter_range[0])
+        query.where("smr.MeterID < %s", meter_range[1])
+    query.where("smr.ReadDate >= %s", start_date)
+    query.where("smr.ReadDate <= %s", end_date)
+    return query
+
+
+def _meter_shards(meter_range, shard_size):
+    """
+    Returns MeterID shards of at most shard_size meters covering 
+    meter_range, or every meter if meter_range is None. There are no shards
+    if Meters is empty.
+    """
+    if meter_range is None:
+        cursor = connections["ldc"].cursor()
+        cursor.execute("select min(MeterID), max(MeterID) from Meters")
+        first, last = cursor.fetchone()
+        if first is None:
+            return []
+        meter_range = (first, last + 1)
+    return shard_ranges(meter_range[0], meter_range[1], shard_size)
+
+
+def _merge_histograms(histogram, other):
+    """Merges two StreamingHistogram shards."""
+    histogram.merge(other)
+    return histogram
 
 
 def create_histogram(a, trim_p, bin_size, p_title, p_ylabel, p_xlabel, 
@@ -27,6 +92,10 @@ def create_histogram(a, trim_p, bin_size, p_title, p_ylabel, p_xlabel,
                  trim_p is applied. Values include "both", "left", and "right".
                  Defaults to "both".
     """
+    select_backend()
+    import pylab
+    from scipy import stats
+
     a.sort()
     sample_size = len(a)
     print("a length pre-trim_p", len(a))
@@ -59,94 +128,176 @@ def create_histogram(a, trim_p, bin_size, p_title, p_ylabel, p_xlabel,
     pylab.show()
 
 
-def hourly_sm_reading_histogram():
+def hourly_sm_reading_histogram(meter_range=(20000, 20100),
+                                start_date=SUMMER_2011_START,
+                                end_date=SUMMER_2011_END,
+                                chunk_size=100000, shard_size=1000, workers=4,
+                                flags=None):
     """Creates a histogram of smart meter readings to identify their 
-    distribution and find outliers.
+    distribution and find outliers. Readings are streamed in chunks into a 
+    StreamingHistogram, so memory is bounded for any number of meters. The 
+    MeterID range is scanned in concurrent shards. Readings on days with a 
+    data quality flag are left out.
+    
+    Arguments:
+    meter_range -- (Optional) (first, last) MeterID range, last is exclusive,
+                   or None for all meters. Defaults to a 100 meter sample.
+    start_date -- (Optional) First ReadDate (inclusive). Defaults to the 
+                  start of summer 2011.
+    end_date -- (Optional) Last ReadDate (inclusive). Defaults to the end of 
+                summer 2011.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+    shard_size -- (Optional) Number of MeterIDs scanned per shard.
+    workers -- (Optional) Number of shards scanned concurrently.
+    flags -- (Optional) QualityFlagIndex of flagged readings. Defaults to 
+             QualityFlagIndex.load().
     """
-    cursor = connections["ldc"].cursor()
-    cursor.execute("select smr.Reading " 
-                   "from essex_annotated.SmartMeterReadings smr " 
-                   "inner join Meters m on m.MeterID = smr.MeterID " 
-                   "   and m.`Phase` = 1 " 
-                   "left join meter_data_quality_flag mdqf " 
-                   "   on smr.MeterID = mdqf.MeterID " 
-                   "   and mdqf.applicability_start_date <= '2011-05-01' " 
-                   "   and mdqf.applicability_end_date >= '2012-10-31' " 
-                   "where smr.MeterID >= 20000 and smr.MeterID < 20100 " 
-                   "and mdqf.MeterID is null " 
-                   "and smr.ReadDate >= '2011-05-01' " 
-                   "and smr.ReadDate <= '2011-10-31'")
-    # Create a list of hourly reading values
-    readings = [row[0] for row in cursor.fetchall()]
+    if flags is None:
+        flags = QualityFlagIndex.load()
+    
+    def scan(shard):
+        query = _phase1_readings_query(["smr.MeterID", "to_days(smr.ReadDate)",
+                                        "smr.Reading"], 
+                                       shard, start_date, end_date)
+        # Accumulate hourly reading values outside of flagged days
+        histogram = StreamingHistogram(0.1)
+        for chunk in query.stream_chunks(connections["ldc"], 
+                                         chunk_size):
+            kept = ~flags.flagged(chunk[:, 0], to_days_dates(chunk[:, 1]))
+            histogram.update(chunk[kept, 2])
+        return histogram
+    
+    histogram = scan_shards(_meter_shards(meter_range, shard_size), scan, 
+                            _merge_histograms, workers)
+    if histogram is None:
+        print("No meters to scan")
+        return
+    if histogram.count == 0:
+        print("No readings to plot")
+        return
     
     # Create histogram
-    sample_size = len(readings)
+    sample_size = histogram.count
     trim_p = 0.0005
     p_title = "Histogram of Hourly Readings \n" \
                 "(Summer 2011, sample: " + str(sample_size) + " readings, " \
                 "right trim:" + str(trim_p * 100.0) + "%)"
     p_xlabel = "Hourly Reading (kW)"
     p_ylabel = "Occurrences"
-    create_histogram(readings, trim_p, 0.1, p_title, p_ylabel, p_xlabel, 
-                     "hourly_sm_reading_histogram_summer2011", 1, "right")
+    create_streaming_histogram(histogram, trim_p, p_title, p_ylabel, p_xlabel,
+                               "hourly_sm_reading_histogram_summer2011", 1,
+                               "right")
     
 
-def reading_count_histogram():
-    """Gets the number of readings in a time range grouped by MeterID"""
-    cursor = connections["ldc"].cursor()
-    cursor.execute("select count(smr.read_datetime) "
-                   "from essex_annotated.SmartMeterReadings smr " 
-                   "inner join Meters m "
-                   "  on m.MeterID = smr.MeterID and m.`Phase` = 1 "
-                   "left join meter_data_quality_flag mdqf "
-                   "   on smr.MeterID = mdqf.MeterID " 
-                   "   and mdqf.applicability_start_date <= '2011-05-01' "
-                   "   and mdqf.applicability_end_date >= '2012-10-31' "
-                   "where smr.MeterID >= 20000 and smr.MeterID < 30000 "
-                   "and mdqf.MeterID is null " 
-                   "and smr.ReadDate >= '2011-05-01' " 
-                   "and smr.ReadDate <= '2011-10-31' "
-                   "group by smr.MeterID")
-    # Create a list of observation counts
-    reading_counts = [row[0] for row in cursor.fetchall()]
+def reading_count_histogram(meter_range=(20000, 30000),
+                            start_date=SUMMER_2011_START,
+                            end_date=SUMMER_2011_END,
+                            shard_size=1000, workers=4, flags=None):
+    """Gets the number of readings in a time range grouped by MeterID, not 
+    counting readings on days with a data quality flag. Meters without a 
+    flag in the time range are counted and binned in the database, the few 
+    flagged meters are counted per day and masked with the flag index.
+    
+    Arguments:
+    meter_range -- (Optional) (first, last) MeterID range, last is exclusive,
+                   or None for all meters.
+    start_date -- (Optional) First ReadDate (inclusive). Defaults to the 
+                  start of summer 2011.
+    end_date -- (Optional) Last ReadDate (inclusive). Defaults to the end of 
+                summer 2011.
+    shard_size -- (Optional) Number of MeterIDs scanned per shard.
+    workers -- (Optional) Number of shards scanned concurrently.
+    flags -- (Optional) QualityFlagIndex of flagged readings. Defaults to 
+             QualityFlagIndex.load().
+    """
+    bin_size = 1
+    if flags is None:
+        flags = QualityFlagIndex.load()
+    flagged_meters = flags.meters_flagged_between(start_date, end_date)
+    
+    def scan(shard):
+        shard_flagged = flagged_meters[(flagged_meters >= shard[0]) & 
+                                       (flagged_meters < shard[1])].tolist()
+        query = _phase1_readings_query(["count(smr.read_datetime) as value"],
+                                       shard, start_date, end_date)
+        if shard_flagged:
+            query.where("smr.MeterID not in (" + 
+                        ", ".join(["%s"] * len(shard_flagged)) + ")",
+                        *shard_flagged)
+        query.group("smr.MeterID")
+        # Bin the observation counts in the database
+        rows = cached_rows(server_binned_query(query, bin_size), 
+                           READINGS_SOURCES)
+        if not shard_flagged:
+            return rows
+        
+        # Count the flagged meters' readings per day and drop flagged days
+        query = _phase1_readings_query(["smr.MeterID", 
+                                        "to_days(smr.ReadDate)",
+                                        "count(smr.read_datetime)"],
+                                       shard, start_date, end_date)
+        query.where_in("smr.MeterID", shard_flagged)
+        query.group("smr.MeterID", "smr.ReadDate")
+        days = cached_rows(query, READINGS_SOURCES)
+        kept = days[~flags.flagged(days[:, 0], to_days_dates(days[:, 1]))]
+        meters, groups = numpy.unique(kept[:, 0], return_inverse=True)
+        counts = numpy.bincount(groups, weights=kept[:, 2], 
+                                minlength=len(meters))
+        return merge_binned(rows, bin_values(counts, bin_size))
+    
+    rows = scan_shards(_meter_shards(meter_range, shard_size), scan, 
+                       merge_binned, workers)
+    if rows is None:
+        print("No meters to scan")
+        return
+    if not len(rows):
+        print("No readings to plot")
+        return
     
     # Create histogram
-    sample_size = len(reading_counts)
+    sample_size = int(rows[:, 1].sum())
     trim_p = 0.001
+    print("count min=" + str(rows[0, 2]) + ", count max=" + str(rows[-1, 3]))
+    edges, counts = trim_binned(rows, bin_size, trim_p, "left")
     p_title = "Number of Readings Histogram \n" \
                 "(Summer 2011, sample: " + str(sample_size) + " meters, " \
                 "left trim:" + str(trim_p * 100.0) + "%)"
     p_xlabel = "Number of Readings During Timeframe"
     p_ylabel = "Number of Meters"
-    create_histogram(reading_counts, trim_p, 1, p_title, p_ylabel, p_xlabel, 
-                     "sm_reading_count_histogram_summer2011", 0, "left")
+    plot_binned_histogram(edges, counts, trim_p, p_title, p_ylabel, p_xlabel,
+                          "sm_reading_count_histogram_summer2011")
     
     
 def sm_reading_exception_count_histogram():
     """Counts the number of exceptions per MeterNumber and plots a 
     histogram.
     """
-    cursor = connections["ldc"].cursor()
-    cursor.execute("select count(smre.reading_datetime_standard) "
-                   "from Meters m "
-                   "left join SmartMeterReadingsExceptions smre "
-                   "   on smre.MeterNumber = m.MeterNumber "
-                   "group by m.MeterNumber")
-    # Create a list of observation counts
-    exception_counts = [row[0] for row in cursor.fetchall()]
+    query = SelectQuery(["count(smre.reading_datetime_standard) as value"], 
+                        "Meters m")
+    query.join("left join SmartMeterReadingsExceptions smre "
+               "on smre.MeterNumber = m.MeterNumber")
+    query.group("m.MeterNumber")
+    # Bin the observation counts in the database
+    bin_size = 10.0
+    rows = cached_rows(server_binned_query(query, bin_size), 
+                       EXCEPTIONS_SOURCES)
+    if not len(rows):
+        print("No meters to plot")
+        return
     
     # Create histogram
-    sample_size = len(exception_counts)
-    bin_size = 10.0
+    sample_size = int(rows[:, 1].sum())
     trim_p = 0
+    print("count min=" + str(rows[0, 2]) + ", count max=" + str(rows[-1, 3]))
+    edges, counts = trim_binned(rows, bin_size, trim_p, "right")
     p_title = "Number of Exceptions Histogram \n" \
                 "(sample: " + str(sample_size) + " meters, " \
                 "bin size:" + str(bin_size) + ", " \
                 "trim: " + str(trim_p * 100.0) + "%)"
     p_xlabel = "Number of Exception per Meter"
     p_ylabel = "Occurrences"
-    create_histogram(exception_counts, trim_p, bin_size, p_title, p_ylabel, p_xlabel, 
-                     "sm_exception_count_histogram", 0, "right")
+    plot_binned_histogram(edges, counts, trim_p, p_title, p_ylabel, p_xlabel,
+                          "sm_exception_count_histogram")
 
 
 def main():
@@ -3,18 +3,69 @@ Created on May 28, 2014
 
 @author: r24mille
 """
+import multiprocessing
+import sys
+
 from django.db import connections
-from matplotlib import pyplot
 import numpy
 import math
 
+from ldc_analysis.bootstrap import error_bars, normal_intervals, \
+    temperature_dict_intervals
+from ldc_analysis.cache import cached_result, cached_rows
+from ldc_analysis.holidays import business_day_ranges
+from ldc_analysis.profiling import PROFILER, timer
+from ldc_analysis.query import SelectQuery
+from ldc_analysis.render import _init_worker, bounded_imap, import_pyplot
+from ldc_analysis.running_stats import RunningStats
+from ldc_analysis.tou import SUMMER_EVENING_MID_PEAK, \
+    SUMMER_MORNING_MID_PEAK, SUMMER_MORNING_OFF_PEAK, SUMMER_NIGHT_OFF_PEAK, \
+    SUMMER_ON_PEAK, SUMMER_PERIOD_TITLES
+from ldc_analysis.weather import MAX_TEMPERATURE, MIN_TEMPERATURE, \
+    check_temperatures, epoch_seconds_sql, round_temperatures, weather_store
+
+
+# Tables read by each analysis and the expression that changes when new rows
+# are loaded into them, used to key cached results
+AGGREGATE_SOURCES = [("r24mille_aggregate_res_readings",
+                      "max(aggregate_reading_datetime_standard)"),
+                     ("weathertables.wunderground_observation",
+                      "max(observation_datetime_standard)")]
+QUANTIZED_SOURCES = [("essex_annotated.r24mille_quantized_res_readings",
+                      "sum(number_of_readings)")]
 
-def partition_by_temperature(location_id, start_datetime, end_datetime):
+
+def _temperature_partition_query(start_datetime, end_datetime):
+    """
+    Returns a SelectQuery of (hour_of_day, avg_reading, reading_seconds) rows 
+    for business days, see partition_by_temperature for arguments. Weekends 
+    and holidays are excluded with range predicates from the holiday 
+    calendar so that the index on aggregate_reading_datetime_standard is 
+    used. reading_seconds is aligned to temperatures by a WeatherStore.
+    """
+    reading_datetime = "arr.aggregate_reading_datetime_standard"
+    query = SelectQuery(["hour(" + reading_datetime + ") as hour_of_day",
+                         "(arr.aggregate_reading / arr.number_of_meters) " + 
+                         "as avg_reading",
+                         epoch_seconds_sql(reading_datetime) + 
+                         " as reading_seconds"],
+                        "r24mille_aggregate_res_readings arr")
+    query.where(reading_datetime + " >= %s", str(start_datetime))
+    query.where(reading_datetime + " <= %s", str(end_datetime))
+    query.where_ranges(reading_datetime,
+                       business_day_ranges(start_datetime, end_datetime))
+    query.order(reading_datetime + " asc")
+    return query
+
+
+def partition_by_temperature(location_id, start_datetime, end_datetime,
+                             method="exact", tolerance=None):
     """
     First analysis method partitions demand measurements into 2D arrays by 
     temperature x hour, values are average aggregate demand. Returns a 
     dictionary using temperature as a key. The value is a 2D list hour x 
-    rounded temperature.
+    rounded temperature. Readings without a matching weather observation are 
+    skipped.
     
     Arguments:
     location_id -- The weathertables.location to use for hourly temperature 
@@ -24,36 +75,24 @@ def partition_by_temperature(location_id, start_datetime, end_datetime):
                       readings.
     end_datetime -- A string in MySQL DATETIME format indicating the timeseries
                     ending point (inclusive) of aggregate readings.
+    method -- (Optional) How readings are matched to observations, see 
+              WeatherStore.align. Defaults to "exact".
+    tolerance -- (Optional) Seconds, see WeatherStore.align. Defaults to None.
     """
-    cursor = connections["ldc"].cursor()
-    cursor.execute("select hour(arr.aggregate_reading_datetime_standard) as hour_of_day, " + 
-                    "(arr.aggregate_reading / arr.number_of_meters) as avg_reading, " + 
-                    "round(wu.temp_metric) as rounded_temp " + 
-                    "from r24mille_aggregate_res_readings arr " + 
-                    "left join weathertables.wunderground_observation wu " + 
-                    "    on wu.observation_datetime_standard = arr.aggregate_reading_datetime_standard " + 
-                    "    and wu.location_id = " + str(location_id) + " " + 
-                    "where arr.aggregate_reading_datetime_standard >= '" + str(start_datetime) + "' " + 
-                    "and arr.aggregate_reading_datetime_standard <= '" + str(end_datetime) + "' " + 
-                    "and dayofweek(arr.aggregate_reading_datetime_standard) > 1 " + 
-                    "and dayofweek(arr.aggregate_reading_datetime_standard) < 7 " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2011-05-23' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2011-07-01' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2011-09-05' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2011-10-10' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2012-05-21' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2012-07-01' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2012-09-03' " + 
-                    "and date(arr.aggregate_reading_datetime_standard) != '2012-10-08' " + 
-                    "order by arr.aggregate_reading_datetime_standard asc")
+    query = _temperature_partition_query(start_datetime, end_datetime)
+    rows = cached_rows(query, AGGREGATE_SOURCES)
+    temps = weather_store([location_id]).align(location_id, rows[:, 2],
+                                               method, tolerance)
+    matched = ~numpy.isnan(temps)
+    rows = rows[matched]
+    temps = round_temperatures(temps[matched])
     
     # Create a 2D array of aggregate readings partitioned by temperature and 
     # hour-of-day.
     temperature_dict = {}
-    for row in cursor.fetchall():
+    for row, rounded_temp in zip(rows.tolist(), temps.tolist()):
         hour_of_day = int(row[0])
         avg_reading = row[1]
-        rounded_temp = int(row[2])
         
         if rounded_temp not in temperature_dict:
             temperature_dict[rounded_temp] = [0] * 24
@@ -64,7 +103,111 @@ def partition_by_temperature(location_id, start_datetime, end_datetime):
             temperature_dict[rounded_temp][hour_of_day] = [avg_reading]
     return temperature_dict
 
-def plot_tou_dict_comparison(pre_tou_dict, post_tou_dict):
+
+def stream_partition_by_temperature(location_id, start_datetime, end_datetime,
+                                    chunk_size=10000, method="exact",
+                                    tolerance=None):
+    """
+    Constant-memory alternative to partition_by_temperature. Reads the same 
+    rows in chunks of chunk_size and folds them into running 
+    (temperature, hour-of-day) statistics. Returns a summary dictionary with 
+    keys "temperatures" (1D array of rounded temperatures), and "mean", 
+    "std", "count" and "max" (2D arrays of temperature x hour). Cells 
+    without readings have zero mean, std and count.
+    
+    Arguments:
+    location_id -- The weathertables.location to use for hourly temperature 
+                   measurements.
+    start_datetime -- A string in MySQL DATETIME format indicating the 
+                      timeseries starting point (inclusive) of aggregate 
+                      readings.
+    end_datetime -- A string in MySQL DATETIME format indicating the timeseries
+                    ending point (inclusive) of aggregate readings.
+    chunk_size -- (Optional) Number of rows fetched per round trip. Defaults 
+                  to 10000.
+    method -- (Optional) How readings are matched to observations, see 
+              WeatherStore.align. Defaults to "exact".
+    tolerance -- (Optional) Seconds, see WeatherStore.align. Defaults to None.
+    """
+    return cached_result("stream_partition_by_temperature",
+                         (location_id, str(start_datetime), str(end_datetime),
+                          method, tolerance),
+                         AGGREGATE_SOURCES,
+                         lambda: _stream_partition_by_temperature(
+                             location_id, start_datetime, end_datetime,
+                             chunk_size, method, tolerance))
+
+
+def _stream_partition_by_temperature(location_id, start_datetime, end_datetime,
+                                     chunk_size, method, tolerance):
+    """
+    Uncached implementation of stream_partition_by_temperature.
+    """
+    query = _temperature_partition_query(start_datetime, end_datetime)
+    store = weather_store([location_id])
+    
+    stats = RunningStats((MAX_TEMPERATURE - MIN_TEMPERATURE + 1, 24))
+    for chunk in query.stream_chunks(connections["ldc"], chunk_size):
+        temps = store.align(location_id, chunk[:, 2], method, tolerance)
+        # Readings without a matching weather observation are skipped
+        matched = ~numpy.isnan(temps)
+        chunk = chunk[matched]
+        temps = round_temperatures(temps[matched])
+        check_temperatures(temps)
+        stats.update((temps - MIN_TEMPERATURE, chunk[:, 0].astype(numpy.intp)),
+                     chunk[:, 1])
+    
+    observed = numpy.flatnonzero(stats.count.sum(axis=1))
+    if observed.size == 0:
+        observed_rows = slice(0, 0)
+    else:
+        observed_rows = slice(observed[0], observed[-1] + 1)
+    count = stats.count[observed_rows]
+    maximum = stats.maximum[observed_rows].copy()
+    maximum[count == 0] = 0
+    return {"temperatures": numpy.arange(MIN_TEMPERATURE, 
+                                         MAX_TEMPERATURE + 1)[observed_rows],
+            "mean": stats.mean[observed_rows],
+            "std": stats.std()[observed_rows],
+            "count": count,
+            "max": maximum}
+
+
+def summarize_temperature_dict(temperature_dict):
+    """
+    Converts a dictionary returned by partition_by_temperature into the 
+    summary dictionary returned by stream_partition_by_temperature.
+    
+    Arguments:
+    temperature_dict -- A dictionary of average aggregate demand using 
+                        temperature as key. The value is a 2D list of 
+                        hours x demand.
+    """
+    hours = 24
+    temps = numpy.arange(min(temperature_dict), max(temperature_dict) + 1)
+    means = numpy.zeros((len(temps), hours))
+    stds = numpy.zeros((len(temps), hours))
+    counts = numpy.zeros((len(temps), hours), dtype=numpy.int64)
+    maxima = numpy.zeros((len(temps), hours))
+    for i, t in enumerate(temps):
+        if t not in temperature_dict:
+            continue
+        for h in range(hours):
+            readings = temperature_dict[t][h]
+            if isinstance(readings, list):
+                means[i, h] = numpy.mean(readings)
+                stds[i, h] = numpy.std(readings)
+                counts[i, h] = len(readings)
+                maxima[i, h] = max(readings)
+    return {"temperatures": temps,
+            "mean": means,
+            "std": stds,
+            "count": counts,
+            "max": maxima}
+
+
+def plot_tou_dict_comparison(pre_tou_dict, post_tou_dict, confidence=None,
+                             resamples=1000, seed=0, processes=1):
     """
     Creates summary comparison plots of a pre-TOU dictionary and a post-TOU 
     dictionary. The y-axis value is the mean reading for a given 
@@ -77,34 +220,84 @@ def plot_tou_dict_comparison(pre_tou_dict, post_tou_dict):
     post_tou_dict -- A dictionary of post-TOU average aggregate demand for a 
                      region using temperature as key. The value is a 2D list 
                      of hours x demand.
+    confidence -- (Optional) Coverage of bootstrap confidence intervals of 
+                  the means drawn as error bars, eg. 0.95. Defaults to None, 
+                  error bars of one standard deviation.
+    resamples -- (Optional) Number of bootstrap resamples. Defaults to 1000.
+    seed -- (Optional) Seed of the bootstrap. Defaults to 0.
+    processes -- (Optional) Number of bootstrap processes. Defaults to 1.
+    """
+    pre_intervals = post_intervals = None
+    if confidence is not None:
+        options = {"confidence": confidence, "resamples": resamples,
+                   "seed": seed, "processes": processes}
+        pre_intervals = temperature_dict_intervals(pre_tou_dict, **options)
+        post_intervals = temperature_dict_intervals(post_tou_dict, **options)
+    plot_tou_summary_comparison(summarize_temperature_dict(pre_tou_dict),
+                                summarize_temperature_dict(post_tou_dict),
+                                pre_intervals, post_intervals)
+
+
+def summary_intervals(summary, confidence=0.95):
+    """
+    Returns (lower, upper) temperature x hour arrays of normal-approximation 
+    confidence intervals of the means of a summary dictionary, see 
+    stream_partition_by_temperature.
+    """
+    count = summary["count"]
+    variance = summary["std"] ** 2 * count / numpy.maximum(count - 1, 1)
+    return normal_intervals(summary["mean"], variance, count, confidence)
+
+
+def _summary_hours(summary, temperature, intervals=None):
+    """
+    Returns the (means, yerr) hour-of-day arrays of a summary dictionary for 
+    one temperature, zeros if the temperature was not observed. yerr is the 
+    standard deviation, or the distances to (lower, upper) intervals.
+    """
+    temps = summary["temperatures"]
+    if len(temps) and temps[0] <= temperature <= temps[-1]:
+        i = temperature - temps[0]
+        if intervals is None:
+            return summary["mean"][i], summary["std"][i]
+        return summary["mean"][i], error_bars(summary["mean"][i],
+                                              intervals[0][i],
+                                              intervals[1][i])
+    return numpy.zeros(24), numpy.zeros(24)
+
+
+def plot_tou_summary_comparison(pre_tou_summary, post_tou_summary,
+                                pre_intervals=None, post_intervals=None):
     """
+    Creates summary comparison plots of pre-TOU and post-TOU summaries. The 
+    y-axis value is the mean reading for a given (temperature, hour-of-day) 
+    tuple.
+    
+    Arguments:
+    pre_tou_summary -- A summary dictionary of pre-TOU average aggregate 
+                       demand, see stream_partition_by_temperature.
+    post_tou_summary -- A summary dictionary of post-TOU average aggregate 
+                        demand, see stream_partition_by_temperature.
+    pre_intervals -- (Optional) (lower, upper) temperature x hour arrays of 
+                     confidence intervals drawn as error bars, see 
+                     summary_intervals and 
+                     bootstrap.temperature_dict_intervals. Defaults to one 
+                     standard deviation.
+    post_intervals -- (Optional) Same as pre_intervals for post_tou_summary.
+    """
+    pyplot = import_pyplot()
     hours = 24
-    temps = list(pre_tou_dict.keys()) + list(post_tou_dict.keys())
-    days = list(pre_tou_dict.values()) + list(post_tou_dict.values())
-    readings = []
-    # Iterate through all readings to find the max over all 
-    for d in days:
-        for h in range(hours):
-            if isinstance(d[h], list):
-                for i in d[h]:
-                    readings.append(i)
-            else:
-                readings.append(d[h])
-    max_reading = max(readings)
+    temps = list(pre_tou_summary["temperatures"]) + \
+        list(post_tou_summary["temperatures"])
+    max_reading = max(pre_tou_summary["max"].max(), 
+                      post_tou_summary["max"].max())
     
     for t in range(min(temps), max(temps)):
         
-        pre_means = [0] * (hours)
-        pre_stderrs = [0] * (hours)
-        post_means = [0] * (hours)
-        post_stderrs = [0] * (hours)
-        for h in range(hours):
-            if t in pre_tou_dict:
-                pre_means[h] = numpy.mean(pre_tou_dict[t][h])
-                pre_stderrs[h] = numpy.std(pre_tou_dict[t][h])
-            if t in post_tou_dict:
-                post_means[h] = numpy.mean(post_tou_dict[t][h])
-                post_stderrs[h] = numpy.std(post_tou_dict[t][h])
+        pre_means, pre_stderrs = _summary_hours(pre_tou_summary, t,
+                                                pre_intervals)
+        post_means, post_stderrs = _summary_hours(post_tou_summary, t,
+                                                  post_intervals)
         
         ind = numpy.arange(hours)  # the x locations for the groups
         width = 0.3  # the width of the bars
@@ -162,7 +355,8 @@ def plot_tou_dict_comparison(pre_tou_dict, post_tou_dict):
         
         # autolabel(rects1)
         # autolabel(rects2)
-        pyplot.savefig("./figures/summer_" + str(t) + ".png")  # For lab report
+        with timer("savefig"):
+            pyplot.savefig("./figures/summer_" + str(t) + ".png")  # For lab report
         # pyplot.savefig("./figures/summer_" + str(t).zfill(2) + ".png")
         pyplot.close(t)
             
@@ -175,24 +369,50 @@ def quantize_by_period(period_id):
     Arguments:
     period_id -- PK of the r24mille_tou_period_codes table.
     """
-    cursor = connections["ldc"].cursor()
-    cursor.execute("SELECT rounded_temp, sample_mean, tou_billing_active, " + 
-                    "sample_variance, number_of_readings " + 
-                    "FROM essex_annotated.r24mille_quantized_res_readings " + 
-                    "where tou_period_id = " + str(period_id) + " " + 
-                    "and sample_mean > 0 "
-                    "order by rounded_temp asc, tou_billing_active asc")
+    return quantize_by_periods([period_id])[period_id]
+
+
+def quantize_by_periods(period_ids):
+    """
+    Selects pre- and post-TOU summary statistics for several TOU periods 
+    with a single query. Returns a dictionary using period_id as key, the 
+    value is the (means, variance, counts) tuple of quantize_by_period.
     
-        # Create a 2D array of aggregate readings partitioned by temperature and 
+    Arguments:
+    period_ids -- Iterable of PKs of the r24mille_tou_period_codes table.
+    """
+    period_ids = sorted(set(int(p) for p in period_ids))
+    query = SelectQuery(["rounded_temp", "sample_mean", "tou_billing_active",
+                         "sample_variance", "number_of_readings",
+                         "tou_period_id"],
+                        "essex_annotated.r24mille_quantized_res_readings")
+    query.where_in("tou_period_id", period_ids)
+    query.where("sample_mean > 0")
+    query.order("tou_period_id asc", "rounded_temp asc",
+                "tou_billing_active asc")
+    rows = cached_rows(query, QUANTIZED_SOURCES)
+    
+    # Rows are ordered by period, each period is one contiguous slice
+    bounds = numpy.searchsorted(rows[:, 5], period_ids + [numpy.inf])
+    return dict((period_id, _quantized_dicts(rows[bounds[i]:bounds[i + 1]]))
+                for i, period_id in enumerate(period_ids))
+
+
+def _quantized_dicts(rows):
+    """
+    Returns the (means, variance, counts) dictionaries of one TOU period's 
+    rows, see quantize_by_periods.
+    """
+    # Create a 2D array of aggregate readings partitioned by temperature and 
     # hour-of-day.
     means_dict = {}
     variance_dict = {}
     counts_dict = {}
-    for row in cursor.fetchall():
+    for row in rows.tolist():
         rounded_temp = int(row[0])
         sample_mean = row[1]
         tou_billing_active = int(row[2])
-        sample_variance = int(row[3])
+        sample_variance = float(row[3])
         number_of_readings = int(row[4])
         
         if rounded_temp not in means_dict:
@@ -209,8 +429,22 @@ def quantize_by_period(period_id):
     return means_dict, variance_dict, counts_dict
 
 
+def quantized_intervals(period_summary_dict, variance_dict, count_dict,
+                        confidence=0.95):
+    """
+    Returns (lower, upper) temperature x 2 (pre-, post-TOU) arrays of 
+    normal-approximation confidence intervals of the means returned by 
+    quantize_by_period, rows in the order of the dictionaries' keys.
+    """
+    temps = list(period_summary_dict.keys())
+    return normal_intervals([period_summary_dict[t] for t in temps],
+                            [variance_dict[t] for t in temps],
+                            [count_dict[t] for t in temps], confidence)
+
+
 def plot_quantized_comparison(period_title,
-                              period_summary_dict, variance_dict, count_dict):
+                              period_summary_dict, variance_dict, count_dict,
+                              filename=None, intervals=None):
     """
     Creates summary comparison plots of a pre-TOU and a post-TOU for a given 
     period. Plot also has variance and count labeling.
@@ -219,7 +453,13 @@ def plot_quantized_comparison(period_title,
     period_summary_dict -- 
     variance_dict -- 
     count_dict -- 
+    filename -- (Optional) Path or binary file object the PNG is saved to. 
+                Defaults to ./figures/quantized_<period_title>.png.
+    intervals -- (Optional) (lower, upper) arrays of confidence intervals 
+                 drawn as error bars, see quantized_intervals. Defaults to 
+                 one standard deviation.
     """
+    pyplot = import_pyplot()
     temps = [int(k) for k in list(period_summary_dict.keys())]
     print("temps", temps)
     readings = []
@@ -233,8 +473,13 @@ def plot_quantized_comparison(period_title,
     pre_stderrs = [ math.sqrt(v) for v in numpy.array(list(variance_dict.values()))[:, 0] ]
     post_means = numpy.array(list(period_summary_dict.values()))[:, 1]
     post_stderrs = [ math.sqrt(v) for v in numpy.array(list(variance_dict.values()))[:, 1] ]
+    if intervals is not None:
+        pre_stderrs = error_bars(pre_means, intervals[0][:, 0],
+                                 intervals[1][:, 0])
+        post_stderrs = error_bars(post_means, intervals[0][:, 1],
+                                  intervals[1][:, 1])
     
-    ind = numpy.arange(min(temps), max(temps) + 1)  # the x locations for the groups
+    ind = numpy.array(temps)  # the x locations for the groups, temps may have gaps
     print("ind", ind)
     width = 0.3  # the width of the bars
     
@@ -273,60 +518,86 @@ def plot_quantized_comparison(period_title,
     
     # autolabel(rects1)
     # autolabel(rects2)
-    pyplot.savefig("./figures/quantized_" + period_title + ".png")  # For lab report
+    if filename is None:
+        filename = "./figures/quantized_" + period_title + ".png"  # For lab report
+    with timer("savefig"):
+        pyplot.savefig(filename, format="png")
     pyplot.close(period_title)
 
 
+def _plot_job(job):
+    """
+    Plots one plot_quantized_comparison job in a pool worker. Returns the 
+    filename and the worker's profiler records.
+    """
+    period_title, means, variance, counts, filename, intervals = job
+    plot_quantized_comparison(period_title, means, variance, counts, filename,
+                              intervals)
+    return filename, PROFILER.drain()
+
+
+def render_quantized_comparisons(jobs, processes=None):
+    """
+    Plots quantized comparisons concurrently in a pool of worker processes 
+    using the Agg backend and returns the list of filenames written.
+    
+    Arguments:
+    jobs -- Iterable of (period_title, means, variance, counts) tuples, as 
+            plot_quantized_comparison. A fifth item sets the filename and a 
+            sixth the confidence intervals.
+    processes -- (Optional) Number of worker processes. Defaults to the 
+                 number of CPUs.
+    """
+    def pool_jobs():
+        for job in jobs:
+            filename = job[4] if len(job) > 4 else None
+            if filename is None:
+                filename = "./figures/quantized_" + job[0] + ".png"
+            intervals = job[5] if len(job) > 5 else None
+            yield tuple(job[:4]) + (filename, intervals)
+    
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    rendered = []
+    try:
+        for filename, records in bounded_imap(pool, _plot_job, pool_jobs(),
+                                              processes):
+            PROFILER.extend(records)
+            rendered.append(filename)
+    finally:
+        pool.close()
+        pool.join()
+    return rendered
+
+
 if __name__ == '__main__':
     windsor_location_id = 13
     pre_tou_summer_start = '2011-05-01 00:00:00'
     pre_tou_summer_end = '2011-10-31 23:59:59'
-    # pre_tou_summer_dict = partition_by_temperature(windsor_location_id,
-    #                                                pre_tou_summer_start,
-    #                                                pre_tou_summer_end)
-    # print("pre_tou", pre_tou_summer_dict)
+    # pre_tou_summer = stream_partition_by_temperature(windsor_location_id,
+    #                                                  pre_tou_summer_start,
+    #                                                  pre_tou_summer_end)
+    # print("pre_tou", pre_tou_summer["count"].sum())
 
     
     post_tou_summer_start = '2012-05-01 00:00:00'
     post_tou_summer_end = '2012-10-31 23:59:59'
-    # post_tou_summer_dict = partition_by_temperature(windsor_location_id,
-    #                                                post_tou_summer_start,
-    #                                                post_tou_summer_end)
-    # print("post_tou", post_tou_summer_dict)
-    
-    # plot_tou_dict_comparison(pre_tou_summer_dict, post_tou_summer_dict)
-    
-    off1s_period_id = 1
-    off1s_means_dict, off1s_variance_dict, off1s_counts_dict = quantize_by_period(off1s_period_id)
-    plot_quantized_comparison("Summer Morning Off-Peak",
-                              off1s_means_dict,
-                              off1s_variance_dict,
-                              off1s_counts_dict)
-    
-    mid1s_period_id = 8
-    mid1s_means_dict, mid1s_variance_dict, mid1s_counts_dict = quantize_by_period(mid1s_period_id)
-    plot_quantized_comparison("Summer Morning Mid-Peak",
-                              mid1s_means_dict,
-                              mid1s_variance_dict,
-                              mid1s_counts_dict)
+    # post_tou_summer = stream_partition_by_temperature(windsor_location_id,
+    #                                                   post_tou_summer_start,
+    #                                                   post_tou_summer_end)
+    # print("post_tou", post_tou_summer["count"].sum())
     
-    on1s_period_id = 5
-    on1s_means_dict, on1s_variance_dict, on1s_counts_dict = quantize_by_period(on1s_period_id)
-    plot_quantized_comparison("Summer On-Peak",
-                              on1s_means_dict,
-                              on1s_variance_dict,
-                              on1s_counts_dict)
+    # plot_tou_summary_comparison(pre_tou_summer, post_tou_summer)
     
-    mid2s_period_id = 9 
-    mid2s_means_dict, mid2s_variance_dict, mid2s_counts_dict = quantize_by_period(mid2s_period_id)
-    plot_quantized_comparison("Summer Evening Mid-Peak",
-                              mid2s_means_dict,
-                              mid2s_variance_dict,
-                              mid2s_counts_dict)
+    # Number of plotting processes, defaults to the number of CPUs
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
     
-    off2s_period_id = 2
-    off2s_means_dict, off2s_variance_dict, off2s_counts_dict = quantize_by_period(off2s_period_id)
-    plot_quantized_comparison("Summer Night Off-Peak",
-                              off2s_means_dict,
-                              off2s_variance_dict,
-                              off2s_counts_dict)
+    summer_periods = [SUMMER_MORNING_OFF_PEAK, SUMMER_MORNING_MID_PEAK,
+                      SUMMER_ON_PEAK, SUMMER_EVENING_MID_PEAK,
+                      SUMMER_NIGHT_OFF_PEAK]
+    quantized = quantize_by_periods(summer_periods)
+    rendered = render_quantized_comparisons(
+        [(SUMMER_PERIOD_TITLES[period_id],) + quantized[period_id] +
+         (None, quantized_intervals(*quantized[period_id]))
+         for period_id in summer_periods if quantized[period_id][0]],
+        processes=processes)
+    print("rendered", len(rendered), "figures")
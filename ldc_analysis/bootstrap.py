@@ -0,0 +1,195 @@
+"""
+Batched bootstrap confidence intervals of cell means.
+
+The samples of every cell (eg. each (temperature, hour-of-day) of
+partition_by_temperature) are concatenated into one array with an offset per
+cell. Cells are grouped into blocks of about max_draws / resamples samples;
+a block draws all of its resample indices as one array, gathers the values
+and sums each cell with numpy.add.reduceat, so the cost is a few array
+operations per block rather than a loop over cells and resamples. Each block
+has its own random stream spawned from one SeedSequence, so intervals depend
+on the seed and max_draws but not on the number of worker processes.
+
+Summaries that only keep a mean, variance and count (the quantized readings
+table, stream_partition_by_temperature) have no samples to resample, their
+intervals use the normal approximation instead.
+
+@author: r24mille
+"""
+import multiprocessing
+import statistics
+
+import numpy
+
+
+def group_samples(sample_lists):
+    """
+    Returns (values, offsets) of a sequence of sample lists, cell i spans
+    values[offsets[i]:offsets[i + 1]].
+
+    Arguments:
+    sample_lists -- Sequence of lists of readings, empty for cells without
+                    samples.
+    """
+    counts = numpy.array([len(samples) for samples in sample_lists],
+                         dtype=numpy.intp)
+    offsets = numpy.zeros(len(counts) + 1, dtype=numpy.intp)
+    numpy.cumsum(counts, out=offsets[1:])
+    values = numpy.fromiter((v for samples in sample_lists for v in samples),
+                            dtype=numpy.float64, count=offsets[-1])
+    return values, offsets
+
+
+def _blocks(counts, resamples, max_draws):
+    """
+    Returns the cell offsets of consecutive blocks holding about
+    max_draws // resamples samples each (at least one cell per block).
+    """
+    target = max(max_draws // resamples, 1)
+    ends = numpy.cumsum(counts)
+    bounds = [0]
+    while bounds[-1] < len(counts):
+        start = bounds[-1]
+        done = ends[start - 1] if start else 0
+        end = numpy.searchsorted(ends, done + target, side="right")
+        bounds.append(max(end, start + 1))
+    return bounds
+
+
+def _bootstrap_block(job):
+    """
+    Returns the (resamples, cells) bootstrap means of one block of cells.
+    Resamples are drawn in batches of about max_draws indices.
+    """
+    values, counts, resamples, seed, max_draws = job
+    rng = numpy.random.default_rng(seed)
+    starts = numpy.zeros(len(counts), dtype=numpy.intp)
+    numpy.cumsum(counts[:-1], out=starts[1:])
+    sampled = counts > 0
+    means = numpy.full((resamples, len(counts)), numpy.nan)
+    if not sampled.any():
+        return means
+    # Empty cells add no columns, so every sampled cell ends where the next
+    # sampled cell starts
+    cells = numpy.repeat(numpy.arange(len(counts)), counts)
+    batch = max(max_draws // max(len(values), 1), 1)
+    for first in range(0, resamples, batch):
+        rows = min(batch, resamples - first)
+        draws = rng.random((rows, len(values)))
+        index = starts[cells] + (draws * counts[cells]).astype(numpy.intp)
+        sums = numpy.add.reduceat(values[index], starts[sampled], axis=1)
+        means[first:first + rows, sampled] = sums / counts[sampled]
+    return means
+
+
+def bootstrap_intervals(values, offsets, resamples=1000, confidence=0.95,
+                        seed=0, processes=1, max_draws=2 ** 22):
+    """
+    Returns a dictionary of per-cell arrays "mean", "lower", "upper" (the
+    percentile bootstrap interval of the mean) and "count". Cells without
+    samples are NaN.
+
+    Arguments:
+    values -- 1D array of samples of all cells, see group_samples.
+    offsets -- Cell offsets into values.
+    resamples -- (Optional) Number of bootstrap resamples. Defaults to 1000.
+    confidence -- (Optional) Coverage of the interval. Defaults to 0.95.
+    seed -- (Optional) Seed of the random streams. Defaults to 0.
+    processes -- (Optional) Number of worker processes, None for the number
+                 of CPUs. Defaults to 1 (no pool).
+    max_draws -- (Optional) Resample indices drawn per array operation, which
+                 bounds memory. Defaults to 2 ** 22.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    offsets = numpy.asarray(offsets, dtype=numpy.intp)
+    counts = numpy.diff(offsets)
+    bounds = _blocks(counts, resamples, max_draws)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(bounds) - 1)
+    jobs = [(values[offsets[start]:offsets[end]], counts[start:end],
+             resamples, seeds[i], max_draws)
+            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+    if processes == 1 or len(jobs) < 2:
+        blocks = [_bootstrap_block(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            blocks = pool.map(_bootstrap_block, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    if blocks:
+        means = numpy.concatenate(blocks, axis=1)
+    else:
+        means = numpy.zeros((resamples, 0))
+    alpha = (1.0 - confidence) / 2.0
+    sampled = counts > 0
+    lower = numpy.full(len(counts), numpy.nan)
+    upper = numpy.full(len(counts), numpy.nan)
+    mean = numpy.full(len(counts), numpy.nan)
+    if sampled.any():
+        lower[sampled], upper[sampled] = numpy.quantile(
+            means[:, sampled], [alpha, 1.0 - alpha], axis=0)
+        mean[sampled] = numpy.add.reduceat(values, offsets[:-1][sampled]) / \
+            counts[sampled]
+    return {"mean": mean, "lower": lower, "upper": upper, "count": counts}
+
+
+def normal_intervals(mean, variance, count, confidence=0.95):
+    """
+    Returns (lower, upper) arrays of the normal-approximation interval of
+    the mean of summarized cells, NaN for cells without readings.
+
+    Arguments:
+    mean -- array_like of cell means.
+    variance -- array_like of cell sample variances.
+    count -- array_like of cell reading counts.
+    confidence -- (Optional) Coverage of the interval. Defaults to 0.95.
+    """
+    mean = numpy.asarray(mean, dtype=numpy.float64)
+    count = numpy.asarray(count, dtype=numpy.float64)
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2.0)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        half = z * numpy.sqrt(numpy.asarray(variance, dtype=numpy.float64) /
+                              count)
+    half[count == 0] = numpy.nan
+    return mean - half, mean + half
+
+
+def temperature_dict_intervals(temperature_dict, **kwargs):
+    """
+    Returns (lower, upper) temperature x hour arrays of bootstrap intervals
+    for a dictionary returned by partition_by_temperature, with the rows of
+    aggregate.summarize_temperature_dict.
+
+    Arguments:
+    temperature_dict -- A dictionary of average aggregate demand using
+                        temperature as key. The value is a 2D list of
+                        hours x demand.
+    kwargs -- (Optional) Arguments of bootstrap_intervals.
+    """
+    hours = 24
+    temps = range(min(temperature_dict), max(temperature_dict) + 1)
+    sample_lists = []
+    for t in temps:
+        for h in range(hours):
+            readings = temperature_dict.get(t, [0] * hours)[h]
+            sample_lists.append(readings if isinstance(readings, list)
+                                else [])
+    values, offsets = group_samples(sample_lists)
+    intervals = bootstrap_intervals(values, offsets, **kwargs)
+    shape = (len(temps), hours)
+    return (intervals["lower"].reshape(shape),
+            intervals["upper"].reshape(shape))
+
+
+def error_bars(means, lower, upper):
+    """
+    Returns the 2 x n yerr array of matplotlib's bar() for intervals around
+    means, zero where an interval is missing.
+    """
+    means = numpy.asarray(means, dtype=numpy.float64)
+    below = numpy.nan_to_num(means - numpy.asarray(lower))
+    above = numpy.nan_to_num(numpy.asarray(upper) - means)
+    return numpy.maximum(numpy.vstack((below, above)), 0)
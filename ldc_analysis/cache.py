@@ -0,0 +1,184 @@
+"""
+Persistent on-disk cache of analysis query results.
+
+Results are stored as compressed NumPy (.npz) files keyed by a hash of the
+SQL, its parameters and a stamp of the source tables (eg. their maximum
+timestamp), so new data in a source table yields a new key. The cache
+directory is bounded in size with least-recently-used eviction.
+
+@author: r24mille
+"""
+import hashlib
+import os
+import tempfile
+import zipfile
+
+from django.db import connections
+import numpy
+
+
+class ResultCache(object):
+    """
+    Size-bounded, least-recently-used cache of dictionaries of numpy arrays
+    stored as compressed .npz files in a directory.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3):
+        """
+        Arguments:
+        directory -- Directory holding the cache files, created on demand.
+        max_bytes -- (Optional) Total size of cache files kept after each
+                     write. Defaults to 1 GiB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def make_key(self, *parts):
+        """Returns a hex digest identifying a result from its inputs."""
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """
+        Returns the dictionary of arrays stored under key or None. A hit
+        marks the entry as recently used, a corrupt or truncated entry is
+        deleted and treated as a miss.
+        """
+        path = self._path(key)
+        try:
+            with numpy.load(path) as stored:
+                arrays = dict(stored)
+        except (IOError, OSError):
+            return None
+        except (zipfile.BadZipFile, ValueError, EOFError):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path, None)
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Stores a dictionary of numpy arrays under key, then evicts the least
+        recently used entries while the cache exceeds max_bytes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(suffix=".tmp",
+                                            dir=self.directory)
+        with os.fdopen(handle, "wb") as tmp_file:
+            numpy.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until under max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    # Evicted concurrently by another thread or process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        """
+        Deletes the entry stored under key, or every entry if key is None.
+        """
+        if key is not None:
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+        elif os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+
+RESULT_CACHE = ResultCache(os.environ.get("LDC_CACHE_DIR", "./cache/"))
+
+
+def source_stamp(sources, connection_name="ldc"):
+    """
+    Returns a tuple identifying the current contents of source tables.
+
+    Arguments:
+    sources -- List of (table, expression) tuples. Each expression is
+               evaluated over its table, eg. ("TransformerLoads",
+               "max(reading_datetime_standard)").
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    """
+    cursor = connections[connection_name].cursor()
+    stamp = []
+    for table, expression in sources:
+        cursor.execute("select " + expression + " from " + table)
+        stamp.append(str(cursor.fetchone()[0]))
+    return tuple(stamp)
+
+
+def cached_rows(query, sources, connection_name="ldc", cache=RESULT_CACHE):
+    """
+    Returns all rows of a SelectQuery as a 2D float64 numpy array (NULLs
+    become NaN), executing the query only if no cached result exists for
+    the current contents of the source tables.
+
+    Arguments:
+    query -- SelectQuery of numeric columns.
+    sources -- List of (table, expression) tuples, see source_stamp.
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    cache -- (Optional) ResultCache to use. Defaults to RESULT_CACHE.
+    """
+    sql, params = query.sql()
+    key = cache.make_key(connection_name, sql, params,
+                         source_stamp(sources, connection_name))
+    arrays = cache.get(key)
+    if arrays is not None:
+        return arrays["rows"]
+
+    cursor = connections[connection_name].cursor()
+    cursor.execute(sql, params)
+    rows = numpy.array(cursor.fetchall(), dtype=numpy.float64)
+    if rows.size == 0:
+        rows = rows.reshape(0, len(query.columns))
+    cache.put(key, {"rows": rows})
+    return rows
+
+
+def cached_result(name, inputs, sources, compute, connection_name="ldc",
+                  cache=RESULT_CACHE):
+    """
+    Returns the dictionary of numpy arrays computed by compute(), reusing a
+    cached result for the same name, inputs and source table contents.
+
+    Arguments:
+    name -- Name of the computation (eg. the function name).
+    inputs -- Tuple of the computation's arguments.
+    sources -- List of (table, expression) tuples, see source_stamp.
+    compute -- Callable returning a dictionary of numpy arrays.
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    cache -- (Optional) ResultCache to use. Defaults to RESULT_CACHE.
+    """
+    key = cache.make_key(name, inputs, source_stamp(sources, connection_name))
+    arrays = cache.get(key)
+    if arrays is None:
+        arrays = compute()
+        cache.put(key, arrays)
+    return arrays
@@ -0,0 +1,444 @@
+"""
+Mini-batch k-means clustering of daily load profiles.
+
+Every (meter, day) of SmartMeterReadings with a reading in each of the 24
+hours becomes a profile, normalized so that days of large and small
+households with the same shape are alike. Readings are streamed ordered by
+meter and day, one chunk at a time, so memory is bounded by the chunk, the
+batch and the per-meter histograms rather than the number of profiles:
+
+1. A uniform sample of profiles is drawn in one pass (each profile gets a
+   random key, the smallest keys are kept) and seeds the centroids with
+   k-means++.
+2. Each training pass assigns batches of profiles to their nearest centroid
+   and moves every centroid to the running mean of the profiles assigned to
+   it (Sculley's mini-batch k-means with per-centroid learning rates).
+3. A final pass assigns every profile to the trained centroids and counts
+   the profiles of each cluster per meter.
+
+Distances of a batch to all centroids are computed at once from
+|x|^2 - 2 x.c + |c|^2, one matrix product per batch.
+
+@author: r24mille
+"""
+import csv
+import os
+import sys
+
+from django.db import connections
+import numpy
+
+from ldc_analysis.cache import cached_result
+from ldc_analysis.heatmap import HOURS_PER_DAY
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.profiling import timer
+from ldc_analysis.quality import DAY_SPAN, QUALITY_FLAG_SOURCES, \
+    QualityFlagIndex
+from ldc_analysis.query import SelectQuery, to_days_dates
+from ldc_analysis.render import import_pyplot
+
+
+READINGS_SOURCES = [("essex_annotated.SmartMeterReadings",
+                     "max(SmartMeterReadings_id)")]
+NORMALIZATIONS = ("sum", "max")
+
+
+def _readings_query(start_date, end_date, meter_range=None, phase=1):
+    """
+    Returns a SelectQuery of (MeterID, to_days(ReadDate), hour, Reading)
+    ordered by meter and day, so each (meter, day) is a contiguous run.
+    """
+    query = SelectQuery(["smr.MeterID", "to_days(smr.ReadDate)",
+                         "hour(smr.read_datetime)", "smr.Reading"],
+                        "essex_annotated.SmartMeterReadings smr")
+    if phase is not None:
+        query.join("inner join Meters m "
+                   "on m.MeterID = smr.MeterID and m.`Phase` = %s", phase)
+    if meter_range is not None:
+        query.where("smr.MeterID >= %s", meter_range[0])
+        query.where("smr.MeterID < %s", meter_range[1])
+    query.where("smr.ReadDate >= %s", str(parse_datetime(start_date).date()))
+    query.where("smr.ReadDate <= %s", str(parse_datetime(end_date).date()))
+    query.order("smr.MeterID", "smr.ReadDate")
+    return query
+
+
+def daily_profiles(rows, normalize="sum", flags=None):
+    """
+    Returns (meter_ids, days, profiles, dropped) of complete (meter, day)
+    runs of readings. profiles is a float64 n x 24 array, divided by each
+    day's total ("sum") or peak ("max"). Days missing an hour, inside a
+    flagged interval or without a positive total or peak are dropped and
+    counted in dropped. Readings of a repeated hour (the end of daylight
+    saving time) are summed.
+
+    Arguments:
+    rows -- 2D array of (MeterID, to_days(ReadDate), hour, Reading) rows
+            ordered by MeterID then day.
+    normalize -- (Optional) One of NORMALIZATIONS. Defaults to "sum".
+    flags -- (Optional) QualityFlagIndex of flagged readings. Defaults to
+             none.
+    """
+    rows = rows[~numpy.isnan(rows).any(axis=1)]
+    rows = rows[(rows[:, 2] >= 0) & (rows[:, 2] < HOURS_PER_DAY)]
+    hours = rows[:, 2].astype(numpy.intp)
+    keys = rows[:, 0].astype(numpy.int64) * DAY_SPAN + \
+        rows[:, 1].astype(numpy.int64)
+    keys, first, groups = numpy.unique(keys, return_index=True,
+                                       return_inverse=True)
+    cells = groups.ravel() * HOURS_PER_DAY + hours
+    size = len(keys) * HOURS_PER_DAY
+    profiles = numpy.bincount(cells, weights=rows[:, 3], minlength=size) \
+        .reshape(-1, HOURS_PER_DAY)
+    kept = (numpy.bincount(cells, minlength=size) > 0) \
+        .reshape(-1, HOURS_PER_DAY).all(axis=1)
+
+    meter_ids = rows[first, 0].astype(numpy.int64)
+    days = to_days_dates(rows[first, 1])
+    if flags is not None:
+        kept &= ~flags.flagged(meter_ids, days)
+    if normalize == "sum":
+        scale = profiles.sum(axis=1)
+    elif normalize == "max":
+        scale = profiles.max(axis=1)
+    else:
+        raise ValueError("Unknown normalization " + str(normalize))
+    kept &= scale > 0
+    profiles = profiles[kept] / scale[kept, numpy.newaxis]
+    return meter_ids[kept], days[kept], profiles, int((~kept).sum())
+
+
+def iter_daily_profiles(query, normalize="sum", flags=None,
+                        chunk_size=100000, connection_name="ldc"):
+    """
+    Generator of the daily_profiles tuples of each chunk of readings. The
+    last (meter, day) of a chunk is held back until the next chunk, as it
+    may continue there.
+
+    Arguments:
+    query -- SelectQuery of readings, see _readings_query.
+    normalize -- (Optional) One of NORMALIZATIONS. Defaults to "sum".
+    flags -- (Optional) QualityFlagIndex of flagged readings.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    """
+    pending = numpy.empty((0, 4))
+    for chunk in query.stream_chunks(connections[connection_name],
+                                     chunk_size):
+        chunk = numpy.concatenate((pending, chunk))
+        # Runs are contiguous, the last one starts at its first row
+        last = (chunk[:, 0] == chunk[-1, 0]) & (chunk[:, 1] == chunk[-1, 1])
+        end = int(numpy.argmax(last))
+        pending = chunk[end:]
+        if end:
+            with timer("cluster_profiles.profiles"):
+                profiled = daily_profiles(chunk[:end], normalize, flags)
+            yield profiled
+    if len(pending):
+        yield daily_profiles(pending, normalize, flags)
+
+
+def nearest_centroids(profiles, centroids):
+    """
+    Returns (labels, distances), the index of and squared Euclidean distance
+    to the nearest centroid of each profile.
+
+    Arguments:
+    profiles -- n x 24 numpy array.
+    centroids -- k x 24 numpy array.
+    """
+    distances = numpy.dot(profiles, -2.0 * centroids.T)
+    distances += (centroids ** 2).sum(axis=1)
+    labels = distances.argmin(axis=1)
+    nearest = distances[numpy.arange(len(labels)), labels] + \
+        (profiles ** 2).sum(axis=1)
+    return labels, numpy.maximum(nearest, 0.0)
+
+
+def kmeans_plus_plus(sample, clusters, rng):
+    """
+    Returns clusters x 24 centroids drawn from sample with k-means++: each
+    next centroid is a profile drawn with probability proportional to its
+    squared distance to the nearest centroid already chosen.
+
+    Arguments:
+    sample -- n x 24 numpy array, n >= clusters.
+    clusters -- Number of centroids.
+    rng -- numpy.random.Generator.
+    """
+    centroids = numpy.empty((clusters, sample.shape[1]))
+    centroids[0] = sample[rng.integers(len(sample))]
+    nearest = ((sample - centroids[0]) ** 2).sum(axis=1)
+    for i in range(1, clusters):
+        total = nearest.sum()
+        if total > 0:
+            choice = numpy.searchsorted(numpy.cumsum(nearest),
+                                        rng.random() * total, side="right")
+            choice = min(choice, len(sample) - 1)
+        else:
+            choice = rng.integers(len(sample))
+        centroids[i] = sample[choice]
+        numpy.minimum(nearest, ((sample - centroids[i]) ** 2).sum(axis=1),
+                      out=nearest)
+    return centroids
+
+
+def minibatch_update(centroids, counts, batch):
+    """
+    Moves centroids (in place) towards a batch of profiles. Each centroid
+    becomes the mean of every profile assigned to it so far, its learning
+    rate is the inverse of its count.
+
+    Arguments:
+    centroids -- k x 24 numpy array, updated in place.
+    counts -- int64 array of profiles assigned to each centroid so far,
+              updated in place.
+    batch -- n x 24 numpy array.
+    """
+    clusters = len(centroids)
+    labels, _ = nearest_centroids(batch, centroids)
+    cells = labels[:, numpy.newaxis] * HOURS_PER_DAY + \
+        numpy.arange(HOURS_PER_DAY)
+    sums = numpy.bincount(cells.ravel(), weights=batch.ravel(),
+                          minlength=clusters * HOURS_PER_DAY) \
+        .reshape(clusters, HOURS_PER_DAY)
+    assigned = numpy.bincount(labels, minlength=clusters)
+    counts += assigned
+    hit = assigned > 0
+    centroids[hit] += (sums[hit] - assigned[hit, numpy.newaxis] *
+                       centroids[hit]) / counts[hit, numpy.newaxis]
+
+
+def _batches(profile_chunks, batch_size):
+    """
+    Generator regrouping the profiles of daily_profiles tuples into arrays
+    of batch_size profiles (the last one may be smaller).
+    """
+    buffered = []
+    count = 0
+    for _, _, profiles, _ in profile_chunks:
+        buffered.append(profiles)
+        count += len(profiles)
+        while count >= batch_size:
+            profiles = numpy.concatenate(buffered)
+            yield profiles[:batch_size]
+            buffered = [profiles[batch_size:]]
+            count -= batch_size
+    if count:
+        yield numpy.concatenate(buffered)
+
+
+def _sample_profiles(profile_chunks, sample_size, rng):
+    """
+    Returns (sample, profiles, dropped): a uniform sample of at most
+    sample_size profiles, the number of profiles and the number of dropped
+    days. Only sample_size profiles are held between chunks.
+    """
+    sample = numpy.empty((0, HOURS_PER_DAY))
+    keys = numpy.empty(0)
+    profiles = dropped = 0
+    for _, _, chunk, chunk_dropped in profile_chunks:
+        profiles += len(chunk)
+        dropped += chunk_dropped
+        sample = numpy.concatenate((sample, chunk))
+        keys = numpy.concatenate((keys, rng.random(len(chunk))))
+        if len(keys) > sample_size:
+            smallest = numpy.argpartition(keys, sample_size)[:sample_size]
+            sample, keys = sample[smallest], keys[smallest]
+    # Ordered by key, the sample does not depend on the chunk size
+    return sample[numpy.argsort(keys)], profiles, dropped
+
+
+def _assign(profile_chunks, centroids):
+    """
+    Returns (meter_ids, histograms, sizes, inertia) of every profile
+    assigned to its nearest centroid. histograms[i] counts the profiles of
+    meter_ids[i] in each cluster.
+    """
+    clusters = len(centroids)
+    meters = []
+    partials = []
+    sizes = numpy.zeros(clusters, dtype=numpy.int64)
+    inertia = 0.0
+    for meter_ids, _, profiles, _ in profile_chunks:
+        if not len(profiles):
+            continue
+        labels, distances = nearest_centroids(profiles, centroids)
+        inertia += distances.sum()
+        sizes += numpy.bincount(labels, minlength=clusters)
+        chunk_meters, groups = numpy.unique(meter_ids, return_inverse=True)
+        meters.append(chunk_meters)
+        partials.append(numpy.bincount(groups.ravel() * clusters + labels,
+                                       minlength=len(chunk_meters) *
+                                       clusters).reshape(-1, clusters))
+    if not meters:
+        return (numpy.empty(0, dtype=numpy.int64),
+                numpy.zeros((0, clusters), dtype=numpy.int64), sizes, inertia)
+
+    # Meters are streamed in order, a meter split across chunks is summed
+    meters = numpy.concatenate(meters)
+    partials = numpy.concatenate(partials)
+    starts = numpy.flatnonzero(numpy.concatenate(([True],
+                                                  meters[1:] != meters[:-1])))
+    return (meters[starts], numpy.add.reduceat(partials, starts, axis=0),
+            sizes, inertia)
+
+
+def cluster_profiles(start_date, end_date, clusters=8, meter_range=None,
+                     phase=1, normalize="sum", batch_size=4096, passes=1,
+                     sample_size=20000, seed=0, chunk_size=100000,
+                     flags=None):
+    """
+    Clusters the normalized daily load profiles of SmartMeterReadings with
+    mini-batch k-means (see the module documentation) and returns a
+    dictionary of arrays, cached until a reading is added:
+
+    centroids -- clusters x 24 normalized profile of each cluster.
+    sizes -- Number of profiles of each cluster.
+    meter_ids -- Sorted MeterIDs with at least one profile.
+    histograms -- meters x clusters number of profiles of each meter in
+                  each cluster.
+    profiles -- Number of profiles clustered (a 0-d array).
+    dropped -- Number of (meter, day) runs that were not a complete,
+               unflagged day (a 0-d array).
+    inertia -- Mean squared distance of a profile to its centroid (a 0-d
+               array).
+
+    Arguments:
+    start_date -- First ReadDate (inclusive), see holidays.parse_datetime.
+    end_date -- Last ReadDate (inclusive).
+    clusters -- (Optional) Number of clusters. Defaults to 8.
+    meter_range -- (Optional) (first, last) MeterID range, last is
+                   exclusive. Defaults to every meter.
+    phase -- (Optional) Meters.Phase of the meters, None for every meter.
+             Defaults to 1 (residential).
+    normalize -- (Optional) One of NORMALIZATIONS, divide each day by its
+                 total or its peak. Defaults to "sum".
+    batch_size -- (Optional) Profiles per mini-batch. Defaults to 4096.
+    passes -- (Optional) Number of training passes over the readings.
+              Defaults to 1.
+    sample_size -- (Optional) Profiles sampled to seed the centroids.
+                   Defaults to 20000.
+    seed -- (Optional) Seed of the sample and of k-means++. Defaults to 0.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+    flags -- (Optional) QualityFlagIndex of flagged readings. Defaults to
+             QualityFlagIndex.load().
+    """
+    if normalize not in NORMALIZATIONS:
+        raise ValueError("Unknown normalization " + str(normalize))
+    if clusters < 1 or passes < 1 or batch_size < 1:
+        raise ValueError("clusters, passes and batch_size must be positive")
+    start = str(parse_datetime(start_date).date())
+    end = str(parse_datetime(end_date).date())
+    meter_range = None if meter_range is None else tuple(meter_range)
+
+    def compute():
+        index = QualityFlagIndex.load() if flags is None else flags
+        query = _readings_query(start, end, meter_range, phase)
+        rng = numpy.random.default_rng(seed)
+
+        def stream():
+            return iter_daily_profiles(query, normalize, index, chunk_size)
+
+        with timer("cluster_profiles.sample"):
+            sample, profiles, dropped = _sample_profiles(
+                stream(), max(sample_size, clusters), rng)
+        if len(sample) < clusters:
+            raise ValueError("Only " + str(len(sample)) + " profiles for " +
+                             str(clusters) + " clusters")
+        centroids = kmeans_plus_plus(sample, clusters, rng)
+        del sample
+
+        counts = numpy.zeros(clusters, dtype=numpy.int64)
+        for _ in range(passes):
+            for batch in _batches(stream(), batch_size):
+                with timer("cluster_profiles.update"):
+                    minibatch_update(centroids, counts, batch)
+
+        with timer("cluster_profiles.assign"):
+            meter_ids, histograms, sizes, inertia = _assign(stream(),
+                                                            centroids)
+        return {"centroids": centroids, "sizes": sizes,
+                "meter_ids": meter_ids, "histograms": histograms,
+                "profiles": numpy.array(profiles),
+                "dropped": numpy.array(dropped),
+                "inertia": numpy.array(inertia / max(profiles, 1))}
+
+    if flags is not None:
+        return compute()
+    inputs = (start, end, clusters, meter_range, phase, normalize,
+              batch_size, passes, sample_size, seed)
+    return cached_result("cluster_profiles", inputs,
+                         READINGS_SOURCES + QUALITY_FLAG_SOURCES, compute)
+
+
+def write_clusters(directory, result):
+    """
+    Writes centroids.csv (a row of 24 hourly values and the size of each
+    cluster) and meter_clusters.csv (the profiles of each meter in each
+    cluster) of a cluster_profiles result to directory.
+
+    Arguments:
+    directory -- Directory of the CSV files, created if needed.
+    result -- Dictionary returned by cluster_profiles.
+    """
+    os.makedirs(directory, exist_ok=True)
+    clusters = len(result["centroids"])
+    with open(os.path.join(directory, "centroids.csv"), "w",
+              newline="") as centroid_file:
+        writer = csv.writer(centroid_file)
+        writer.writerow(["cluster", "profiles"] +
+                        ["hour_" + str(h) for h in range(HOURS_PER_DAY)])
+        for i in range(clusters):
+            writer.writerow([i, int(result["sizes"][i])] +
+                            result["centroids"][i].tolist())
+    with open(os.path.join(directory, "meter_clusters.csv"), "w",
+              newline="") as meter_file:
+        writer = csv.writer(meter_file)
+        writer.writerow(["meter_id"] +
+                        ["cluster_" + str(i) for i in range(clusters)])
+        for meter_id, histogram in zip(result["meter_ids"].tolist(),
+                                       result["histograms"].tolist()):
+            writer.writerow([meter_id] + histogram)
+
+
+def plot_centroids(filename, result):
+    """
+    Draws the centroid profiles of a cluster_profiles result, labelled with
+    their share of the profiles, and saves them to filename.
+
+    Arguments:
+    filename -- Path of the PNG file to write.
+    result -- Dictionary returned by cluster_profiles.
+    """
+    pyplot = import_pyplot()
+
+    sizes = result["sizes"]
+    shares = sizes / float(max(sizes.sum(), 1))
+    fig = pyplot.figure()
+    ax = pyplot.subplot()
+    for i in numpy.argsort(-sizes):
+        ax.plot(range(HOURS_PER_DAY), result["centroids"][i],
+                label="Cluster " + str(i) + " (" +
+                str(round(shares[i] * 100.0, 1)) + "%)")
+    ax.set_title("Daily Load Profile Clusters")
+    ax.set_xlabel("Hour of Day")
+    ax.set_ylabel("Normalized Reading")
+    ax.xaxis.set_ticks(range(0, HOURS_PER_DAY, 2))
+    ax.legend(fontsize="small")
+    with timer("savefig"):
+        pyplot.savefig(filename, format="png")
+    pyplot.close(fig)
+
+
+if __name__ == '__main__':
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
+
+    # Number of clusters, eg. 8
+    clusters = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    result = cluster_profiles("2011-05-01", "2011-10-31", clusters=clusters)
+    write_clusters("./figures/clusters/", result)
+    plot_centroids("./figures/clusters/centroids.png", result)
+    print("clustered", int(result["profiles"]), "profiles, dropped",
+          int(result["dropped"]))
@@ -0,0 +1,183 @@
+"""
+Memory-mapped meter x hour cube of smart meter readings.
+
+export_reading_cube writes SmartMeterReadings into a dense float32 .npy file
+of shape (meters, hours), with NaN for hours without a reading, and a sidecar
+index of the MeterID of each row and the timestamp of the first column.
+ReadingCube opens the export read-only with numpy.memmap so heatmaps,
+histograms and regressions can take zero-copy slices from local disk instead
+of querying MySQL.
+
+@author: r24mille
+"""
+import datetime
+import os
+
+from django.db import connections
+import numpy
+from numpy.lib.format import open_memmap
+
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.query import SelectQuery, to_days
+from ldc_analysis.shards import scan_shards
+
+
+CUBE_FILE = "readings.npy"
+INDEX_FILE = "index.npz"
+
+
+def export_reading_cube(directory, start_date, end_date, meter_ids=None,
+                        uom_id=None, shard_size=1000, workers=4,
+                        chunk_size=100000):
+    """
+    Exports hourly readings between two dates into a cube in directory and
+    returns the opened ReadingCube.
+
+    Arguments:
+    directory -- Directory of the cube files, created on demand.
+    start_date -- First ReadDate (inclusive) in MySQL DATE format.
+    end_date -- Last ReadDate (inclusive) in MySQL DATE format.
+    meter_ids -- (Optional) Iterable of MeterIDs to export. Defaults to every
+                 meter in the Meters table.
+    uom_id -- (Optional) UnitsOfMeasure PK of the readings to export.
+              Defaults to all units, the last reading of an hour wins.
+    shard_size -- (Optional) Number of meters scanned per shard.
+    workers -- (Optional) Number of shards scanned concurrently.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+    """
+    start = parse_datetime(start_date)
+    start_days = to_days(start)
+    end = parse_datetime(end_date) + datetime.timedelta(days=1)
+    num_hours = int((end - start).total_seconds() // 3600)
+    if meter_ids is None:
+        cursor = connections["ldc"].cursor()
+        cursor.execute("select MeterID from Meters order by MeterID")
+        meter_ids = [row[0] for row in cursor.fetchall()]
+    meter_ids = numpy.unique(numpy.asarray(list(meter_ids),
+                                           dtype=numpy.int64))
+
+    os.makedirs(directory, exist_ok=True)
+    cube = open_memmap(os.path.join(directory, CUBE_FILE), mode="w+",
+                       dtype=numpy.float32,
+                       shape=(len(meter_ids), num_hours))
+    cube[:] = numpy.nan
+
+    def scan(shard):
+        first, last = shard
+        query = SelectQuery(["smr.MeterID",
+                             "to_days(smr.read_datetime)",
+                             "hour(smr.read_datetime)",
+                             "smr.Reading"],
+                            "essex_annotated.SmartMeterReadings smr")
+        query.where("smr.MeterID >= %s", int(meter_ids[first]))
+        query.where("smr.MeterID <= %s", int(meter_ids[last - 1]))
+        query.where("smr.ReadDate >= %s", str(start_date))
+        query.where("smr.ReadDate <= %s", str(end_date))
+        if uom_id is not None:
+            query.where("smr.UOMID = %s", uom_id)
+        for chunk in query.stream_chunks(connections["ldc"],
+                                         chunk_size):
+            ids = chunk[:, 0].astype(numpy.int64)
+            hours = (chunk[:, 1].astype(numpy.int64) - start_days) * 24 + \
+                chunk[:, 2].astype(numpy.int64)
+            rows = numpy.searchsorted(meter_ids, ids)
+            # Meters absent from meter_ids and hours outside the window
+            kept = (rows < len(meter_ids)) & \
+                (meter_ids[numpy.minimum(rows, len(meter_ids) - 1)] == ids) & \
+                (hours >= 0) & (hours < num_hours)
+            cube[rows[kept], hours[kept]] = chunk[kept, 3]
+
+    shards = [(i, min(i + shard_size, len(meter_ids)))
+              for i in range(0, len(meter_ids), shard_size)]
+    scan_shards(shards, scan, lambda result, partial: None, workers)
+    cube.flush()
+    del cube
+
+    numpy.savez(os.path.join(directory, INDEX_FILE),
+                meter_ids=meter_ids,
+                start=numpy.datetime64(start, "h"))
+    return ReadingCube(directory)
+
+
+class ReadingCube(object):
+    """
+    Read-only view of a cube written by export_reading_cube. Rows are meters
+    in ascending MeterID order and columns are consecutive hours.
+    """
+
+    def __init__(self, directory):
+        """
+        Arguments:
+        directory -- Directory passed to export_reading_cube.
+        """
+        self.readings = numpy.load(os.path.join(directory, CUBE_FILE),
+                                   mmap_mode="r")
+        with numpy.load(os.path.join(directory, INDEX_FILE)) as index:
+            self.meter_ids = index["meter_ids"]
+            self.start = index["start"]
+
+    @property
+    def timestamps(self):
+        """datetime64[h] array of the hour of each column."""
+        return self.start + numpy.arange(self.readings.shape[1])
+
+    def rows(self, meter_ids):
+        """
+        Returns the row index of each MeterID, raising KeyError for meters
+        not in the cube.
+
+        Arguments:
+        meter_ids -- array_like of MeterIDs.
+        """
+        meter_ids = numpy.asarray(meter_ids, dtype=numpy.int64)
+        rows = numpy.searchsorted(self.meter_ids, meter_ids)
+        rows = numpy.minimum(rows, len(self.meter_ids) - 1)
+        if not numpy.array_equal(self.meter_ids[rows], meter_ids):
+            raise KeyError("MeterID not in the reading cube")
+        return rows
+
+    def meter(self, meter_id):
+        """
+        Returns a zero-copy array of one meter's hourly readings.
+
+        Arguments:
+        meter_id -- MeterID of the meter.
+        """
+        return self.readings[self.rows([meter_id])[0]]
+
+    def hours(self, start, end):
+        """
+        Returns the (first, last) column slice bounds of the hours from start
+        (inclusive) to end (exclusive), clipped to the cube.
+
+        Arguments:
+        start -- Timeseries starting point, see holidays.parse_datetime.
+        end -- Timeseries ending point (exclusive).
+        """
+        first = (numpy.datetime64(parse_datetime(start), "h") -
+                 self.start).astype(numpy.int64)
+        last = (numpy.datetime64(parse_datetime(end), "h") -
+                self.start).astype(numpy.int64)
+        num_hours = self.readings.shape[1]
+        return (int(min(max(first, 0), num_hours)),
+                int(min(max(last, 0), num_hours)))
+
+    def window(self, start, end):
+        """
+        Returns a zero-copy (meters x hours) slice of every meter's readings
+        from start (inclusive) to end (exclusive).
+        """
+        first, last = self.hours(start, end)
+        return self.readings[:, first:last]
+
+    def day_hour(self, meter_id):
+        """
+        Returns one meter's readings as a zero-copy (days x 24) heatmap
+        view, the cube must start at midnight.
+
+        Arguments:
+        meter_id -- MeterID of the meter.
+        """
+        readings = self.meter(meter_id)
+        num_days = len(readings) // 24
+        return readings[:num_days * 24].reshape(num_days, 24)
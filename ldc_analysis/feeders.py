@@ -0,0 +1,279 @@
+"""
+Rollup of hourly loads up the FeederMapping hierarchy.
+
+FeederTree indexes the feeders 0..n-1 and precomputes the depth of each
+feeder below its root. Loads are summed per feeder and hour with one
+numpy.bincount per fetched chunk, then the totals are added into each
+feeder's parent one level at a time from the deepest feeders up, giving the
+day x hour heatmap of every feeder in the network from a single scan.
+
+@author: r24mille
+"""
+import datetime
+import os
+import sys
+
+from django.db import connections
+import numpy
+
+from ldc_analysis.heatmap import HOURS_PER_DAY
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.models import Feeder
+from ldc_analysis.query import SelectQuery, to_days
+
+
+class FeederTree(object):
+    """
+    Feeders indexed 0..n-1 in FeederID order grouped by their depth in the
+    ParentFeeder relation.
+    """
+
+    def __init__(self, feeder_ids, parent_ids):
+        """
+        Arguments:
+        feeder_ids -- Sequence of FeederIDs.
+        parent_ids -- Sequence of the ParentFeeder of each feeder. None, the
+                      feeder itself or an unknown FeederID marks a root.
+        """
+        order = numpy.argsort(numpy.asarray(feeder_ids, dtype=object)
+                              .astype(str), kind="mergesort")
+        self.feeder_ids = numpy.asarray(feeder_ids, dtype=object) \
+            .astype(str)[order]
+        parent_ids = [parent_ids[i] for i in order]
+        parents = self.index([str(p) if p is not None else ""
+                              for p in parent_ids])
+        parents[parents == numpy.arange(len(parents))] = -1
+        self.parents = parents
+
+        # Follow every feeder's parent pointers in lock step, one level of
+        # the tree per iteration
+        depths = numpy.zeros(len(parents), dtype=numpy.intp)
+        nodes = numpy.arange(len(parents))
+        current = parents.copy()
+        for _ in range(len(parents)):
+            climbing = current >= 0
+            if not climbing.any():
+                break
+            nodes, current = nodes[climbing], current[climbing]
+            depths[nodes] += 1
+            current = parents[current]
+        else:
+            if len(parents) and (current >= 0).any():
+                raise ValueError("FeederMapping contains a cycle")
+
+        # Feeders of each depth below the roots, deepest first
+        order = numpy.argsort(-depths, kind="mergesort")
+        bounds = numpy.flatnonzero(numpy.diff(depths[order])) + 1
+        self.levels = [level for level in numpy.split(order, bounds)
+                       if len(level) and depths[level[0]] > 0]
+
+    @classmethod
+    def load(cls, connection_name="ldc"):
+        """Returns the tree of every row of FeederMapping."""
+        rows = list(Feeder.objects.using(connection_name)
+                    .values_list("FeederID", "ParentFeeder"))
+        if not rows:
+            return cls([], [])
+        feeder_ids, parent_ids = zip(*rows)
+        return cls(feeder_ids, parent_ids)
+
+    def __len__(self):
+        return len(self.feeder_ids)
+
+    def index(self, feeder_ids):
+        """
+        Returns the index of each FeederID, -1 for unknown feeders.
+
+        Arguments:
+        feeder_ids -- Sequence of FeederIDs.
+        """
+        feeder_ids = numpy.asarray(feeder_ids, dtype=object).astype(str)
+        if len(self.feeder_ids) == 0:
+            return numpy.full(len(feeder_ids), -1, dtype=numpy.intp)
+        positions = numpy.searchsorted(self.feeder_ids, feeder_ids)
+        positions = numpy.minimum(positions, len(self.feeder_ids) - 1)
+        found = self.feeder_ids[positions] == feeder_ids
+        return numpy.where(found, positions, -1).astype(numpy.intp)
+
+    def rollup(self, totals):
+        """
+        Returns the sub-tree sums of per-feeder totals, ie. row i is the sum
+        of the rows of feeder i and all feeders below it. Each level is added
+        into its parents in a single copy of totals, from the deepest feeders
+        up.
+
+        Arguments:
+        totals -- numpy array whose first axis is indexed by feeder.
+        """
+        sums = totals.copy()
+        for level in self.levels:
+            numpy.add.at(sums, self.parents[level], sums[level])
+        return sums
+
+
+def _feeder_heatmaps(tree, rows, start_date, end_date):
+    """
+    Sums an iterable of (feeder index, day index, hour, value) column chunks
+    into per-feeder hourly totals, then rolls them up the tree. Returns a
+    tuple of (heatmaps, missing, start_date, end_date) as build_heatmaps.
+    """
+    num_days = (end_date - start_date).days + 1
+    num_hours = num_days * HOURS_PER_DAY
+    totals = numpy.zeros(len(tree) * num_hours)
+    observed = numpy.zeros(num_hours, dtype=bool)
+    for feeders, days, hours, values in rows:
+        cells = days * HOURS_PER_DAY + hours
+        kept = (feeders >= 0) & (cells >= 0) & (cells < num_hours) & \
+            ~numpy.isnan(values)
+        cells = cells[kept]
+        # Adds in place, a full-length bincount would allocate a copy of
+        # totals per chunk
+        numpy.add.at(totals, feeders[kept] * num_hours + cells, values[kept])
+        observed[cells] = True
+
+    heatmaps = tree.rollup(totals.reshape(len(tree), num_days,
+                                          HOURS_PER_DAY))
+    missing = ~observed.reshape(num_days, HOURS_PER_DAY)
+    return heatmaps, missing, start_date, end_date
+
+
+def _date_range(start_date, end_date):
+    """Returns (datetime.date, datetime.date, MySQL TO_DAYS of the start)."""
+    start = parse_datetime(start_date).date()
+    end = parse_datetime(end_date).date()
+    return start, end, to_days(start)
+
+
+def meter_feeder_heatmaps(tree, start_date, end_date, uom_id=None,
+                          chunk_size=100000):
+    """
+    Returns (heatmaps, missing, start_date, end_date) of the summed
+    SmartMeterReadings of every meter below each feeder, heatmaps[i] is the
+    heatmap of tree.feeder_ids[i].
+
+    Arguments:
+    tree -- FeederTree.
+    start_date -- First ReadDate (inclusive) in MySQL DATE format.
+    end_date -- Last ReadDate (inclusive) in MySQL DATE format.
+    uom_id -- (Optional) UnitsOfMeasure PK of the readings to sum. Defaults
+              to all units.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+    """
+    start, end, start_days = _date_range(start_date, end_date)
+    cursor = connections["ldc"].cursor()
+    cursor.execute("select MeterID, Feeder from Meters "
+                   "where Feeder is not null order by MeterID")
+    meters = cursor.fetchall()
+    meter_ids = numpy.array([m[0] for m in meters], dtype=numpy.int64)
+    meter_feeders = tree.index([m[1] for m in meters])
+
+    query = SelectQuery(["smr.MeterID", "to_days(smr.ReadDate)",
+                         "hour(smr.read_datetime)", "smr.Reading"],
+                        "essex_annotated.SmartMeterReadings smr")
+    query.where("smr.ReadDate >= %s", str(start))
+    query.where("smr.ReadDate <= %s", str(end))
+    if uom_id is not None:
+        query.where("smr.UOMID = %s", uom_id)
+
+    def rows():
+        for chunk in query.stream_chunks(connections["ldc"],
+                                         chunk_size):
+            ids = chunk[:, 0].astype(numpy.int64)
+            positions = numpy.minimum(numpy.searchsorted(meter_ids, ids),
+                                      max(len(meter_ids) - 1, 0))
+            if len(meter_ids):
+                feeders = numpy.where(meter_ids[positions] == ids,
+                                      meter_feeders[positions], -1)
+            else:
+                feeders = numpy.full(len(ids), -1, dtype=numpy.intp)
+            yield (feeders, chunk[:, 1].astype(numpy.intp) - start_days,
+                   chunk[:, 2].astype(numpy.intp), chunk[:, 3])
+
+    return _feeder_heatmaps(tree, rows(), start, end)
+
+
+def transformer_feeders(tree):
+    """
+    Returns a dictionary of the feeder index of each TransformerID, the
+    feeder serving most of the transformer's meters.
+    """
+    cursor = connections["ldc"].cursor()
+    cursor.execute("select TransformerID, Feeder, count(*) from Meters "
+                   "where TransformerID is not null and Feeder is not null "
+                   "group by TransformerID, Feeder")
+    feeders = {}
+    for transformer_id, feeder_id, count in sorted(cursor.fetchall(),
+                                                   key=lambda r: r[2]):
+        feeders[str(transformer_id)] = feeder_id
+    indices = tree.index(list(feeders.values()))
+    return dict(zip(feeders.keys(), indices.tolist()))
+
+
+def transformer_feeder_heatmaps(tree, start_date, end_date,
+                                chunk_size=100000):
+    """
+    Returns (heatmaps, missing, start_date, end_date) of the summed
+    TransformerLoads (MW) of every transformer below each feeder, see
+    meter_feeder_heatmaps. A transformer belongs to the feeder of most of
+    its meters.
+
+    Arguments:
+    tree -- FeederTree.
+    start_date -- First ReadDate (inclusive) in MySQL DATE format.
+    end_date -- Last ReadDate (inclusive) in MySQL DATE format.
+    chunk_size -- (Optional) Number of rows fetched per round trip.
+    """
+    start, end, start_days = _date_range(start_date, end_date)
+    feeders = transformer_feeders(tree)
+
+    query = SelectQuery(["tl.TransformerID", "to_days(tl.ReadDate)",
+                         "tl.`Interval`", "tl.TransformerLoad"],
+                        "TransformerLoads tl")
+    query.where("tl.ReadDate >= %s", str(start))
+    query.where("tl.ReadDate <= %s", str(end))
+
+    def rows():
+        cursor = query.execute(connections["ldc"].cursor())
+        fetched = cursor.fetchmany(chunk_size)
+        while fetched:
+            transformer_ids, days, hours, loads = zip(*fetched)
+            # Look up each distinct transformer of the chunk once
+            distinct, inverse = numpy.unique(numpy.array(transformer_ids,
+                                                         dtype=str),
+                                             return_inverse=True)
+            lookup = numpy.array([feeders.get(t, -1) for t in distinct],
+                                 dtype=numpy.intp)
+            yield (lookup[inverse],
+                   numpy.array(days, dtype=numpy.intp) - start_days,
+                   numpy.array(hours, dtype=numpy.intp),
+                   numpy.array(loads, dtype=numpy.float64))
+            fetched = cursor.fetchmany(chunk_size)
+
+    return _feeder_heatmaps(tree, rows(), start, end)
+
+
+def heatmap_jobs(tree, heatmaps, start_date, end_date, units):
+    """
+    Returns render_heatmaps jobs of feeder heatmaps, written to
+    ./figures/feeders/<FeederID>.png.
+    """
+    return [("./figures/feeders/" + feeder_id + ".png", heatmaps[i],
+             start_date, end_date, "Feeder " + feeder_id + " (" + units + ")")
+            for i, feeder_id in enumerate(tree.feeder_ids)]
+
+
+if __name__ == '__main__':
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
+    from ldc_analysis.render import render_heatmaps
+
+    # Number of rendering processes, defaults to the number of CPUs
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    tree = FeederTree.load()
+    heatmaps, missing_hours, start_date, end_date = \
+        transformer_feeder_heatmaps(tree, datetime.date(2011, 5, 1),
+                                    datetime.date(2011, 10, 31))
+    rendered = render_heatmaps(heatmap_jobs(tree, heatmaps, start_date,
+                                            end_date, "MW"),
+                               processes=processes)
+    print("rendered", len(rendered), "figures")
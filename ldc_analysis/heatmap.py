@@ -0,0 +1,107 @@
+"""
+Shared construction of day x hour demand heatmaps.
+
+@author: r24mille
+"""
+import numpy
+
+from ldc_analysis.profiling import timer
+
+
+HOURS_PER_DAY = 24
+
+
+def build_heatmap(read_dates, hours, values, hour_offset=0):
+    """
+    Scatters flat (date, hour, value) columns into an n x 24 matrix in a
+    single NumPy assignment. Returns a tuple of (heatmap, missing, start_date,
+    end_date) where missing is a boolean n x 24 mask that is True for every
+    hour without a reading. Hours without a reading are zero in the heatmap,
+    matching the matrices previously built by the run.py scripts.
+
+    Arguments:
+    read_dates -- array_like of datetime.date or datetime.datetime objects.
+                  Only the date portion is used to pick the heatmap row.
+    hours -- array_like of integer hours, one per reading.
+    values -- array_like of numeric readings (floats, ints or Decimals).
+    hour_offset -- (Optional) Subtracted from every hour to produce a column
+                   index (eg. 1 for hours numbered 1 to 24). Defaults to 0.
+    """
+    readings = numpy.asarray(values, dtype=numpy.float64)
+    heatmaps, missing, start_date, end_date = build_heatmaps(
+        read_dates, hours, readings[:, numpy.newaxis], hour_offset)
+    return heatmaps[0], missing, start_date, end_date
+
+
+def build_heatmaps(read_dates, hours, values, hour_offset=0):
+    """
+    Scatters several value columns sharing the same (date, hour) columns
+    into a stack of n x 24 matrices in a single NumPy assignment. Returns a
+    tuple of (heatmaps, missing, start_date, end_date) where heatmaps has
+    shape (columns, days, 24), see build_heatmap.
+
+    Arguments:
+    read_dates -- array_like of datetime.date or datetime.datetime objects
+                  or a numpy datetime64 array.
+    hours -- array_like of integer hours, one per reading.
+    values -- 2D array_like of readings x value columns.
+    hour_offset -- (Optional) Subtracted from every hour to produce a column
+                   index (eg. 1 for hours numbered 1 to 24). Defaults to 0.
+    """
+    days = numpy.asarray(read_dates, dtype="datetime64[s]") \
+        .astype("datetime64[D]")
+    if days.size == 0:
+        raise ValueError("Cannot build a heatmap without any readings")
+    with timer("build_heatmaps"):
+        columns = numpy.asarray(hours, dtype=numpy.intp) - hour_offset
+        readings = numpy.asarray(values, dtype=numpy.float64)
+
+        start_day = days.min()
+        end_day = days.max()
+        rows = (days - start_day).astype(numpy.intp)
+        num_days = int(rows.max()) + 1
+
+        heatmaps = numpy.zeros((readings.shape[1], num_days, HOURS_PER_DAY))
+        missing = numpy.ones((num_days, HOURS_PER_DAY), dtype=bool)
+        heatmaps[:, rows, columns] = readings.T
+        missing[rows, columns] = False
+    return heatmaps, missing, start_day.astype(object), end_day.astype(object)
+
+
+def color_scale(heatmaps, missing, percentiles=(0, 100)):
+    """
+    Returns a (vmin, vmax) color scale shared by a stack of heatmaps, taken
+    from percentiles of the hours that have readings.
+
+    Arguments:
+    heatmaps -- numpy array of shape (days, 24) or (columns, days, 24).
+    missing -- Boolean (days, 24) mask of hours without a reading.
+    percentiles -- (Optional) (low, high) percentiles in the range 0 to 100.
+                   Defaults to the minimum and maximum.
+    """
+    observed = heatmaps[..., ~missing]
+    vmin, vmax = numpy.percentile(observed, percentiles)
+    return float(vmin), float(vmax)
+
+
+def heatmap_from_queryset(queryset, date_field, hour_field, value_field,
+                          hour_offset=0):
+    """
+    Builds a heatmap from a Django QuerySet, fetching only the three needed
+    columns as flat tuples rather than materializing model instances. Returns
+    the same tuple as build_heatmap or None if the QuerySet is empty.
+
+    Arguments:
+    queryset -- QuerySet of timeseries rows (eg. TransformerLoad).
+    date_field -- Name of the date or datetime field used for heatmap rows.
+    hour_field -- Name of the integer hour field used for heatmap columns.
+    value_field -- Name of the numeric field holding the reading.
+    hour_offset -- (Optional) See build_heatmap. Defaults to 0.
+    """
+    rows = list(queryset.order_by().values_list(date_field,
+                                                hour_field,
+                                                value_field))
+    if not rows:
+        return None
+    read_dates, hours, values = zip(*rows)
+    return build_heatmap(read_dates, hours, values, hour_offset)
@@ -0,0 +1,220 @@
+"""
+Persisted day x hour heatmaps that grow as new readings arrive.
+
+A HeatmapStore keeps one heatmap as four files: <name>.heatmap (float64
+days x 24), <name>.observed (bool days x 24), <name>.json holding the first
+day, the number of days, the allocated capacity and the high-water mark (the
+timestamp of the newest reading included) and <name>.pyramid.npz holding its
+week and month levels (see pyramid.build_pyramid). The arrays are numpy
+memmaps whose capacity doubles whenever a new day does not fit, so the files
+are extended rather than rewritten and appending a day of readings touches
+one day of the heatmap and the last week and month of its pyramid.
+Scattering a reading twice stores the same value, so readings may safely be
+fetched again from an earlier mark.
+
+@author: r24mille
+"""
+import json
+import os
+
+import numpy
+
+from ldc_analysis.heatmap import HOURS_PER_DAY
+from ldc_analysis.pyramid import build_pyramid, update_pyramid
+
+
+HEATMAP_DIR = os.environ.get("LDC_HEATMAP_DIR", "./cache/heatmaps/")
+
+# Days allocated for a new heatmap, doubled when exceeded
+MIN_CAPACITY = 32
+
+
+def to_seconds(timestamps):
+    """
+    Returns int64 seconds since 1970-01-01 of datetime.datetime objects,
+    MySQL DATETIME strings or datetime64 values.
+    """
+    return numpy.asarray(timestamps, dtype="datetime64[s]") \
+        .astype(numpy.int64)
+
+
+def seconds_text(seconds):
+    """Returns seconds since 1970-01-01 in MySQL DATETIME format."""
+    return str(numpy.datetime64(int(seconds), "s")).replace("T", " ")
+
+
+class HeatmapStore(object):
+    """
+    One persisted, growing heatmap, see the module documentation.
+    """
+
+    def __init__(self, directory, name):
+        """
+        Opens the heatmap name under directory, or an empty one if it has
+        not been written yet.
+
+        Arguments:
+        directory -- Directory holding the heatmap files.
+        name -- Name of the heatmap, eg. a TransformerID.
+        """
+        self.path = os.path.join(directory, name)
+        self.start_day = None
+        self.num_days = 0
+        self.capacity = 0
+        self.high_water = None
+        self._newest = None
+        self._first_changed = None
+        self._values = None
+        self._observed = None
+        if os.path.exists(self.path + ".json"):
+            with open(self.path + ".json") as meta_file:
+                meta = json.load(meta_file)
+            self.start_day = numpy.datetime64(meta["start_day"], "D")
+            self.num_days = meta["num_days"]
+            self.capacity = meta["capacity"]
+            self.high_water = meta["high_water"]
+            self._map("r+")
+
+    def _map(self, mode):
+        """Maps the heatmap files at the current capacity."""
+        shape = (self.capacity, HOURS_PER_DAY)
+        self._values = numpy.memmap(self.path + ".heatmap", numpy.float64,
+                                    mode, shape=shape)
+        self._observed = numpy.memmap(self.path + ".observed", numpy.bool_,
+                                      mode, shape=shape)
+
+    def _reserve(self, num_days):
+        """
+        Grows the files to hold at least num_days days, doubling the
+        capacity. Extended files read as zeros, ie. unobserved hours.
+        """
+        if num_days <= self.capacity:
+            return
+        capacity = max(num_days, 2 * self.capacity, MIN_CAPACITY)
+        if self._values is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+        else:
+            self._values.flush()
+            self._observed.flush()
+            self._values = self._observed = None
+        for suffix, itemsize in ((".heatmap", 8), (".observed", 1)):
+            with open(self.path + suffix, "ab") as data_file:
+                data_file.truncate(capacity * HOURS_PER_DAY * itemsize)
+        self.capacity = capacity
+        self._map("r+")
+
+    @property
+    def heatmap(self):
+        """days x 24 view of the heatmap, hours without a reading are zero."""
+        if self._values is None:
+            return numpy.zeros((0, HOURS_PER_DAY))
+        return self._values[:self.num_days]
+
+    @property
+    def missing(self):
+        """Boolean days x 24 mask of hours without a reading."""
+        if self._observed is None:
+            return numpy.zeros((0, HOURS_PER_DAY), dtype=bool)
+        return ~self._observed[:self.num_days]
+
+    @property
+    def end_day(self):
+        """datetime64[D] of the last day, None while empty."""
+        if self.start_day is None:
+            return None
+        return self.start_day + (self.num_days - 1)
+
+    def append(self, days, hours, values, seconds):
+        """
+        Scatters the readings newer than the saved high-water mark into the
+        heatmap, growing the day axis as needed. The mark only advances on
+        save, so the readings may arrive in any order. Returns True if any
+        reading was added.
+
+        Arguments:
+        days -- datetime64[D] array of the heatmap row of each reading.
+        hours -- Integer array of the column (0 to 23) of each reading.
+        values -- float64 array of readings.
+        seconds -- int64 array of reading timestamps, see to_seconds.
+        """
+        newer = numpy.ones(len(seconds), dtype=bool) \
+            if self.high_water is None else seconds > self.high_water
+        if not newer.any():
+            return False
+        days, hours = days[newer], hours[newer]
+        values, seconds = values[newer], seconds[newer]
+
+        if self.start_day is None:
+            self.start_day = days.min()
+        elif days.min() < self.start_day:
+            raise ValueError("Readings before the first day of " + self.path +
+                             ", the heatmap must be rebuilt")
+        rows = (days - self.start_day).astype(numpy.intp)
+        num_days = max(self.num_days, int(rows.max()) + 1)
+        self._reserve(num_days)
+        self._values[rows, hours] = values
+        self._observed[rows, hours] = True
+        self.num_days = num_days
+        first = int(rows.min())
+        if self._first_changed is None or first < self._first_changed:
+            self._first_changed = first
+        newest = int(seconds.max())
+        if self._newest is None or newest > self._newest:
+            self._newest = newest
+        return True
+
+    def pyramid(self):
+        """
+        Returns the pyramid dictionary saved with the heatmap, see
+        pyramid.build_pyramid.
+        """
+        if self._values is None:
+            return build_pyramid(self.heatmap, self.missing,
+                                 numpy.datetime64("1970-01-01"))
+        with numpy.load(self.path + ".pyramid.npz") as arrays:
+            return dict(arrays)
+
+    def save(self):
+        """
+        Flushes the arrays, rewrites the pyramid from the bins holding the
+        first day appended since the last save (see pyramid.update_pyramid)
+        and then atomically replaces the metadata with the newest reading
+        appended as high-water mark.
+        """
+        if self._values is None:
+            return
+        if self._newest is not None:
+            self.high_water = self._newest
+            self._newest = None
+        self._values.flush()
+        self._observed.flush()
+        if self._first_changed is not None or \
+                not os.path.exists(self.path + ".pyramid.npz"):
+            previous = None
+            if os.path.exists(self.path + ".pyramid.npz"):
+                previous = self.pyramid()
+            pyramid = update_pyramid(previous, self.heatmap, self.missing,
+                                     self.start_day, self._first_changed or 0)
+            with open(self.path + ".pyramid.npz.tmp", "wb") as pyramid_file:
+                numpy.savez(pyramid_file, **pyramid)
+            os.replace(self.path + ".pyramid.npz.tmp",
+                       self.path + ".pyramid.npz")
+            self._first_changed = None
+        meta = {"start_day": str(self.start_day), "num_days": self.num_days,
+                "capacity": self.capacity, "high_water": self.high_water}
+        with open(self.path + ".json.tmp", "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+
+def oldest_mark(stores):
+    """
+    Returns the MySQL DATETIME text of the oldest high-water mark of stores,
+    or None if any store is empty (every reading must then be read).
+    """
+    marks = [store.high_water for store in stores]
+    if not marks or None in marks:
+        return None
+    return seconds_text(min(marks))
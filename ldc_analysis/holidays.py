@@ -0,0 +1,78 @@
+"""
+Calendar of weekdays and statutory holidays used to select business-day
+readings with plain range predicates.
+
+@author: r24mille
+"""
+import datetime
+
+
+# Statutory holidays excluded from weekday analyses
+HOLIDAYS = frozenset([datetime.date(2011, 5, 23),
+                      datetime.date(2011, 7, 1),
+                      datetime.date(2011, 9, 5),
+                      datetime.date(2011, 10, 10),
+                      datetime.date(2012, 5, 21),
+                      datetime.date(2012, 7, 1),
+                      datetime.date(2012, 9, 3),
+                      datetime.date(2012, 10, 8)])
+
+
+def parse_datetime(value):
+    """
+    Returns a datetime.datetime for a MySQL DATETIME or DATE string, a
+    datetime.date or a datetime.datetime.
+
+    Arguments:
+    value -- A string formatted "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD", or a
+             date or datetime object.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    value = str(value)
+    if len(value) == 10:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+def is_business_day(day, holidays=HOLIDAYS):
+    """
+    Returns True for Monday to Friday dates that are not holidays.
+
+    Arguments:
+    day -- A datetime.date.
+    holidays -- (Optional) Set of datetime.date holidays. Defaults to
+                HOLIDAYS.
+    """
+    return day.weekday() < 5 and day not in holidays
+
+
+def business_day_ranges(start_datetime, end_datetime, holidays=HOLIDAYS):
+    """
+    Returns a list of half-open (start, end) datetime.datetime tuples, one
+    per run of consecutive business days between the dates of
+    start_datetime and end_datetime (inclusive). Each tuple starts at
+    midnight of the run's first day and ends at midnight after its last day.
+
+    Arguments:
+    start_datetime -- Timeseries starting point, see parse_datetime.
+    end_datetime -- Timeseries ending point, see parse_datetime.
+    holidays -- (Optional) Set of datetime.date holidays. Defaults to
+                HOLIDAYS.
+    """
+    one_day = datetime.timedelta(days=1)
+    day = parse_datetime(start_datetime).date()
+    end_day = parse_datetime(end_datetime).date()
+    ranges = []
+    run_start = None
+    while day <= end_day + one_day:
+        if day <= end_day and is_business_day(day, holidays):
+            if run_start is None:
+                run_start = day
+        elif run_start is not None:
+            ranges.append((parse_datetime(run_start), parse_datetime(day)))
+            run_start = None
+        day += one_day
+    return ranges
@@ -0,0 +1,59 @@
+"""
+Base class and option parsing shared by the analysis management commands.
+
+@author: r24mille
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from ldc_analysis.holidays import parse_datetime
+
+
+def parse_date(value, option):
+    """
+    Returns the datetime.date of a date option, None if it was not given.
+    Raises CommandError for a value that is not a MySQL DATE.
+
+    Arguments:
+    value -- Option value formatted "YYYY-MM-DD", or None.
+    option -- Name of the option used in the error message, eg. "--start".
+    """
+    if value is None:
+        return None
+    try:
+        return parse_datetime(value).date()
+    except ValueError:
+        raise CommandError(option + " must be a date formatted YYYY-MM-DD, "
+                           "not " + value)
+
+
+def parse_range(value, option):
+    """
+    Returns the (first, last) integers of a "FIRST-LAST" option, None if it
+    was not given. Raises CommandError for any other value.
+
+    Arguments:
+    value -- Option value formatted "FIRST-LAST", or None.
+    option -- Name of the option used in the error message.
+    """
+    if value is None:
+        return None
+    try:
+        first, last = (int(v) for v in value.split("-"))
+    except ValueError:
+        raise CommandError(option + " must be formatted FIRST-LAST, not " +
+                           value)
+    if last <= first:
+        raise CommandError(option + " must end after it starts")
+    return first, last
+
+
+class AnalysisCommand(BaseCommand):
+    """
+    Command reading the unmanaged legacy tables. Models are not validated
+    before running, they mirror tables as introspected rather than what
+    Django would create, and validating them would only slow the start.
+    """
+    # Django 1.6
+    requires_model_validation = False
+    # Django 1.7 and later
+    requires_system_checks = False
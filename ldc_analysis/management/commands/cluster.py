@@ -0,0 +1,72 @@
+"""
+Clusters daily load profiles of smart meters with mini-batch k-means.
+
+    python manage.py cluster --clusters 8 --start 2011-05-01 \
+        --end 2011-10-31 --output ./figures/clusters/
+
+@author: r24mille
+"""
+import os
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from ldc_analysis.clustering import NORMALIZATIONS, cluster_profiles, \
+    plot_centroids, write_clusters
+from ldc_analysis.management.base import AnalysisCommand, parse_date, \
+    parse_range
+
+
+class Command(AnalysisCommand):
+    help = "Writes centroids.csv, meter_clusters.csv and centroids.png of " \
+        "the clusters of normalized daily load profiles."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--clusters", type="int", default=8,
+                    help="Number of clusters. Defaults to 8."),
+        make_option("--start", default="2011-05-01",
+                    help="First ReadDate. Defaults to 2011-05-01."),
+        make_option("--end", default="2011-10-31",
+                    help="Last ReadDate. Defaults to 2011-10-31."),
+        make_option("--meters", default=None,
+                    help="FIRST-LAST MeterID range, LAST is exclusive. "
+                         "Defaults to every meter."),
+        make_option("--phase", type="int", default=1,
+                    help="Meters.Phase of the meters, 0 for every meter. "
+                         "Defaults to 1."),
+        make_option("--normalize", default="sum", choices=NORMALIZATIONS,
+                    help="Divide each day by its total (sum) or peak (max). "
+                         "Defaults to sum."),
+        make_option("--batch-size", type="int", default=4096,
+                    dest="batch_size",
+                    help="Profiles per mini-batch. Defaults to 4096."),
+        make_option("--passes", type="int", default=1,
+                    help="Training passes over the readings. Defaults to 1."),
+        make_option("--seed", type="int", default=0,
+                    help="Seed of the initial centroids. Defaults to 0."),
+        make_option("--output", default="./figures/clusters/",
+                    help="Directory of the results. Defaults to "
+                         "./figures/clusters/."),
+    )
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options["start"], "--start")
+        end_date = parse_date(options["end"], "--end")
+        if end_date < start_date:
+            raise CommandError("--end is before --start")
+        try:
+            result = cluster_profiles(
+                start_date, end_date, clusters=options["clusters"],
+                meter_range=parse_range(options["meters"], "--meters"),
+                phase=options["phase"] or None,
+                normalize=options["normalize"],
+                batch_size=options["batch_size"], passes=options["passes"],
+                seed=options["seed"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        write_clusters(options["output"], result)
+        plot_centroids(os.path.join(options["output"], "centroids.png"),
+                       result)
+        self.stdout.write("clustered " + str(int(result["profiles"])) +
+                          " profiles of " + str(len(result["meter_ids"])) +
+                          " meters, dropped " + str(int(result["dropped"])) +
+                          " days")
@@ -0,0 +1,113 @@
+"""
+Renders transformer, zonal or feeder heatmaps to ./figures/.
+
+    python manage.py heatmap transformer --area A1-TEC --phase 1
+    python manage.py heatmap zone --start 2011-05-01 --end 2011-10-31
+    python manage.py heatmap feeder --processes 4
+
+@author: r24mille
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+from django.db.models.fields import FieldDoesNotExist
+
+from ldc_analysis import feeders
+from ldc_analysis.management.base import AnalysisCommand, parse_date
+from ldc_analysis.models import Transformer
+from ldc_analysis.render import render_heatmaps
+from transformer_demand import run as transformer_run
+from zonal_demand import run as zonal_run
+from zonal_demand.heatmaps import TOTAL_COLUMNS, ZONE_COLUMNS, \
+    stored_zonal_heatmaps, update_zonal_heatmaps, zonal_heatmaps
+
+
+KINDS = ("transformer", "zone", "feeder")
+
+# Days of feeder heatmaps when no dates are given, summer 2011
+FEEDER_START = "2011-05-01"
+FEEDER_END = "2011-10-31"
+
+
+class Command(AnalysisCommand):
+    args = "<" + "|".join(KINDS) + ">"
+    help = "Renders heatmaps of TransformerLoads, ZonalDemand or feeders."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--area", default="A1-TEC",
+                    help="AreaTown of the transformers. Defaults to A1-TEC."),
+        make_option("--phase", default="1",
+                    help="Phases of the transformers. Defaults to 1."),
+        make_option("--start", default=None,
+                    help="First day (inclusive), YYYY-MM-DD. Defaults to "
+                         "the first reading."),
+        make_option("--end", default=None,
+                    help="Last day (inclusive), YYYY-MM-DD. Defaults to the "
+                         "last reading."),
+        make_option("--columns", default=None,
+                    help="Comma-separated ZonalDemand columns. Defaults to "
+                         "the totals and the ten zones."),
+        make_option("--update", action="store_true", default=False,
+                    help="Only read rows newer than the persisted heatmaps "
+                         "(transformer and zone)."),
+        make_option("--max-rows", type="int", default=None, dest="max_rows",
+                    help="With --update, draw transformer heatmaps from the "
+                         "coarsest pyramid level with at least this many "
+                         "rows."),
+        make_option("--processes", type="int", default=None,
+                    help="Number of rendering processes. Defaults to the "
+                         "number of CPUs."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in KINDS:
+            raise CommandError("Expected one of " + ", ".join(KINDS))
+        start_date = parse_date(options["start"], "--start")
+        end_date = parse_date(options["end"], "--end")
+        if options["update"] and (start_date or end_date):
+            raise CommandError("--update reads every new row, --start and "
+                               "--end cannot be given")
+
+        if args[0] == "transformer":
+            jobs = self.transformer_jobs(options, start_date, end_date)
+        elif args[0] == "zone":
+            jobs = self.zone_jobs(options, start_date, end_date)
+        else:
+            jobs = self.feeder_jobs(start_date, end_date)
+        rendered = render_heatmaps(jobs, processes=options["processes"])
+        self.stdout.write("rendered " + str(len(rendered)) + " figures")
+
+    def transformer_jobs(self, options, start_date, end_date):
+        transformers = Transformer.objects.using("ldc").filter(
+            Phases=options["phase"], Enabled=True, AreaTown=options["area"])
+        if options["update"]:
+            return transformer_run.update_jobs(transformers,
+                                               options["phase"],
+                                               options["area"],
+                                               max_rows=options["max_rows"])
+        return transformer_run.heatmap_jobs(transformers, options["phase"],
+                                            options["area"], start_date,
+                                            end_date)
+
+    def zone_jobs(self, options, start_date, end_date):
+        columns = TOTAL_COLUMNS + ZONE_COLUMNS
+        if options["columns"]:
+            columns = options["columns"].split(",")
+        try:
+            if options["update"]:
+                if not update_zonal_heatmaps(columns):
+                    return []
+                heatmaps = stored_zonal_heatmaps(columns)
+            else:
+                heatmaps = zonal_heatmaps(columns, start_date, end_date)
+        except FieldDoesNotExist as e:
+            raise CommandError("Unknown ZonalDemand column: " + str(e))
+        return zonal_run.heatmap_jobs(columns, *heatmaps)
+
+    def feeder_jobs(self, start_date, end_date):
+        tree = feeders.FeederTree.load()
+        heatmaps, missing_hours, start_date, end_date = \
+            feeders.transformer_feeder_heatmaps(tree,
+                                                start_date or FEEDER_START,
+                                                end_date or FEEDER_END)
+        return feeders.heatmap_jobs(tree, heatmaps, start_date, end_date,
+                                    "MW")
@@ -0,0 +1,28 @@
+"""
+Summarizes new aggregate readings into the quantized TOU readings table.
+
+    python manage.py quantize --location 13
+
+@author: r24mille
+"""
+from optparse import make_option
+
+from ldc_analysis.management.base import AnalysisCommand
+from ldc_analysis.quantize import build_quantized_readings
+
+
+class Command(AnalysisCommand):
+    help = "Adds readings since the last build to the quantized TOU table."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--location", type="int", default=13,
+                    help="weathertables.location of the temperatures. "
+                         "Defaults to 13, Windsor."),
+        make_option("--rebuild", action="store_true", default=False,
+                    help="Discard the built rows and summarize every "
+                         "reading."),
+    )
+
+    def handle(self, *args, **options):
+        added = build_quantized_readings(options["location"],
+                                         rebuild=options["rebuild"])
+        self.stdout.write("readings added " + str(added))
@@ -0,0 +1,126 @@
+"""
+Plots pre-TOU against post-TOU demand to ./figures/.
+
+    python manage.py tou_compare quantized --periods 1,5 --processes 4
+    python manage.py tou_compare stream --location 13 \
+        --pre-start 2011-05-01 --pre-end 2011-10-31 \
+        --post-start 2012-05-01 --post-end 2012-10-31
+
+The quantized comparison reads the table written by the quantize command,
+the stream comparison summarizes the aggregate readings of both date ranges.
+
+@author: r24mille
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from ldc_analysis.aggregate import plot_tou_summary_comparison, \
+    quantize_by_periods, quantized_intervals, render_quantized_comparisons, \
+    stream_partition_by_temperature, summary_intervals
+from ldc_analysis.management.base import AnalysisCommand, parse_date
+from ldc_analysis.tou import SUMMER_PERIOD_TITLES
+from ldc_analysis.weather import METHODS
+
+
+MODES = ("quantized", "stream")
+
+
+class Command(AnalysisCommand):
+    args = "[" + "|".join(MODES) + "]"
+    help = "Plots pre-TOU and post-TOU demand side by side per temperature."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--periods", default=None,
+                    help="Comma-separated TOU period ids (quantized). "
+                         "Defaults to the summer periods."),
+        make_option("--location", type="int", default=13,
+                    help="weathertables.location of the temperatures "
+                         "(stream). Defaults to 13, Windsor."),
+        make_option("--pre-start", default="2011-05-01", dest="pre_start",
+                    help="First pre-TOU day (stream). Defaults to "
+                         "2011-05-01."),
+        make_option("--pre-end", default="2011-10-31", dest="pre_end",
+                    help="Last pre-TOU day (stream). Defaults to "
+                         "2011-10-31."),
+        make_option("--post-start", default="2012-05-01", dest="post_start",
+                    help="First post-TOU day (stream). Defaults to "
+                         "2012-05-01."),
+        make_option("--post-end", default="2012-10-31", dest="post_end",
+                    help="Last post-TOU day (stream). Defaults to "
+                         "2012-10-31."),
+        make_option("--method", default="exact", choices=METHODS,
+                    help="How readings are matched to observations "
+                         "(stream), see WeatherStore.align. Defaults to "
+                         "exact."),
+        make_option("--tolerance", type="float", default=None,
+                    help="Largest distance in seconds to a matched "
+                         "observation (stream). Defaults to no limit."),
+        make_option("--confidence", type="float", default=0.95,
+                    help="Coverage of the error bars, 0 for one standard "
+                         "deviation. Defaults to 0.95."),
+        make_option("--processes", type="int", default=None,
+                    help="Number of plotting processes (quantized). "
+                         "Defaults to the number of CPUs."),
+    )
+
+    def handle(self, *args, **options):
+        mode = args[0] if args else MODES[0]
+        if len(args) > 1 or mode not in MODES:
+            raise CommandError("Expected one of " + ", ".join(MODES))
+        if not 0 <= options["confidence"] < 1:
+            raise CommandError("--confidence must be in [0, 1)")
+        if mode == "quantized":
+            self.quantized(options)
+        else:
+            self.stream(options)
+
+    def quantized(self, options):
+        period_ids = sorted(SUMMER_PERIOD_TITLES)
+        if options["periods"]:
+            try:
+                period_ids = [int(p) for p in options["periods"].split(",")]
+            except ValueError:
+                raise CommandError("--periods must be comma-separated ids")
+        confidence = options["confidence"]
+        quantized = quantize_by_periods(period_ids)
+        jobs = []
+        for period_id in period_ids:
+            if not quantized[period_id][0]:
+                continue
+            intervals = None
+            if confidence:
+                intervals = quantized_intervals(*quantized[period_id],
+                                                confidence=confidence)
+            title = SUMMER_PERIOD_TITLES.get(period_id,
+                                             "TOU Period " + str(period_id))
+            jobs.append((title,) + quantized[period_id] + (None, intervals))
+        rendered = render_quantized_comparisons(
+            jobs, processes=options["processes"])
+        self.stdout.write("rendered " + str(len(rendered)) + " figures")
+
+    def stream(self, options):
+        summaries = []
+        for prefix in ("pre", "post"):
+            start = parse_date(options[prefix + "_start"],
+                               "--" + prefix + "-start")
+            end = parse_date(options[prefix + "_end"], "--" + prefix + "-end")
+            if end < start:
+                raise CommandError("--" + prefix + "-end is before --" +
+                                   prefix + "-start")
+            summary = stream_partition_by_temperature(
+                options["location"], str(start) + " 00:00:00",
+                str(end) + " 23:59:59", method=options["method"],
+                tolerance=options["tolerance"])
+            if not len(summary["temperatures"]):
+                raise CommandError("No " + prefix + "-TOU readings between " +
+                                   str(start) + " and " + str(end))
+            summaries.append(summary)
+        intervals = [None, None]
+        if options["confidence"]:
+            intervals = [summary_intervals(s, options["confidence"])
+                         for s in summaries]
+        plot_tou_summary_comparison(summaries[0], summaries[1], *intervals)
+        temps = list(summaries[0]["temperatures"]) + \
+            list(summaries[1]["temperatures"])
+        self.stdout.write("plotted " + str(max(temps) - min(temps)) +
+                          " figures")
@@ -0,0 +1,293 @@
+"""
+Opt-in timing of database queries, heatmap construction and figure saving.
+
+Setting the LDC_PROFILE environment variable to a report path (.json or
+.csv) enables the profiler. Every cursor of the ldc and zonal connections is
+then wrapped to record a fingerprint of each query with its execute time,
+fetch time and number of rows, and timer() blocks record named durations.
+At exit the records are aggregated into the report and the slowest
+LDC_PROFILE_TOP (default 10) entries are printed to stderr. When disabled
+no cursor is wrapped and timer() returns a shared no-op context manager.
+
+Django 1.6 has no connection.execute_wrapper, and an execute wrapper cannot
+see fetches anyway, so cursors are wrapped through make_debug_cursor, which
+every Django version calls when the debug cursor is forced on.
+
+@author: r24mille
+"""
+import atexit
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from django.db.backends.signals import connection_created
+try:
+    from django.db.backends.utils import CursorWrapper
+except ImportError:
+    from django.db.backends.util import CursorWrapper
+
+
+# Query literals and placeholder lists collapsed by fingerprint
+_IN_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """
+    Returns (key, normalized) for a SQL statement, where normalized has
+    literals replaced by ? and placeholder lists collapsed, and key is a
+    short digest of normalized.
+
+    Arguments:
+    sql -- SQL statement text.
+    """
+    normalized = _SPACE.sub(" ", sql).strip()
+    normalized = _STRING.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _IN_LIST.sub("(...)", normalized)
+    key = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+    return key, normalized
+
+
+class _NullTimer(object):
+    """No-op context manager returned by timer() while disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    """Context manager appending a named duration to a profiler."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.records.append(
+            ["timer", self.name, self.name,
+             time.perf_counter() - self.start, 0.0, 0])
+        return False
+
+
+class ProfiledCursor(object):
+    """
+    Cursor proxy recording the execute time of each statement and the time
+    spent fetching its rows.
+    """
+
+    def __init__(self, cursor, profiler, alias):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.alias = alias
+        self.record = None
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, method, sql, params):
+        key, normalized = fingerprint(sql)
+        self.record = ["query", self.alias + ":" + key, normalized, 0.0, 0.0,
+                       0]
+        self.profiler.records.append(self.record)
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            self.record[3] = time.perf_counter() - start
+
+    def execute(self, sql, params=None):
+        return self._execute(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._execute(self.cursor.executemany, sql, param_list)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        rows = method(*args)
+        if self.record is not None:
+            self.record[4] += time.perf_counter() - start
+            self.record[5] += len(rows)
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(self.cursor.fetchmany, 1)
+        return row[0] if row else None
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(self.cursor.fetchmany)
+        return self._fetch(self.cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class Profiler(object):
+    """
+    Collects query and timer records. Records are appended to a plain list,
+    which is safe from the threads scanning shards concurrently.
+    """
+
+    def __init__(self, aliases=("ldc", "zonal")):
+        """
+        Arguments:
+        aliases -- (Optional) Django database aliases whose cursors are
+                   profiled. Defaults to ("ldc", "zonal").
+        """
+        self.aliases = aliases
+        self.enabled = False
+        self.report_path = None
+        self.top = 10
+        self.records = []
+
+    def enable(self, report_path=None, top=10):
+        """
+        Starts profiling connections opened from now on and timer() blocks.
+
+        Arguments:
+        report_path -- (Optional) .json or .csv path written at exit. Defaults
+                       to no report file, only the top-N summary.
+        top -- (Optional) Number of entries in the summary printed at exit.
+               Defaults to 10.
+        """
+        if not self.enabled:
+            connection_created.connect(self._instrument)
+            atexit.register(self.finish)
+        self.enabled = True
+        self.report_path = report_path
+        self.top = top
+
+    def timer(self, name):
+        """
+        Returns a context manager recording the duration of its block under
+        name, eg. with PROFILER.timer("savefig"): ...
+
+        Arguments:
+        name -- Name of the timed operation.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def _instrument(self, sender, connection, **kwargs):
+        """connection_created receiver wrapping the connection's cursors."""
+        if connection.alias not in self.aliases:
+            return
+        profiler = self
+
+        def make_cursor(cursor):
+            return ProfiledCursor(CursorWrapper(cursor, connection),
+                                  profiler, connection.alias)
+
+        connection.make_debug_cursor = make_cursor
+        # use_debug_cursor before Django 1.8, force_debug_cursor after
+        connection.use_debug_cursor = True
+        connection.force_debug_cursor = True
+
+    def drain(self):
+        """Returns and clears the records, eg. to return them from workers."""
+        records = self.records
+        self.records = []
+        return records
+
+    def extend(self, records):
+        """Adds records drained from another process."""
+        self.records.extend(records)
+
+    def summary(self):
+        """
+        Returns a list of dictionaries, one per query fingerprint or timer
+        name, with the number of calls, total, execute, fetch and maximum
+        seconds and rows, sorted by descending total time.
+        """
+        entries = {}
+        for kind, key, text, duration, fetch, rows in self.records:
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = {"kind": kind, "key": key,
+                                        "text": text, "calls": 0,
+                                        "total_s": 0.0, "execute_s": 0.0,
+                                        "fetch_s": 0.0, "max_s": 0.0,
+                                        "rows": 0}
+            entry["calls"] += 1
+            entry["total_s"] += duration + fetch
+            entry["execute_s"] += duration
+            entry["fetch_s"] += fetch
+            entry["max_s"] = max(entry["max_s"], duration + fetch)
+            entry["rows"] += rows
+        return sorted(entries.values(), key=lambda e: -e["total_s"])
+
+    def write_report(self, path):
+        """
+        Writes the summary to path as CSV if it ends in .csv, JSON otherwise.
+        """
+        summary = self.summary()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", newline="") as report:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(report, ["kind", "key", "calls",
+                                                 "total_s", "execute_s",
+                                                 "fetch_s", "max_s", "rows",
+                                                 "text"])
+                writer.writeheader()
+                writer.writerows(summary)
+            else:
+                json.dump(summary, report, indent=2)
+
+    def print_summary(self, stream=sys.stderr):
+        """Prints the top entries of the summary."""
+        print("%-6s %-26s %7s %10s %10s %10s  %s" %
+              ("kind", "key", "calls", "total (s)", "fetch (s)", "rows",
+               "text"), file=stream)
+        for entry in self.summary()[:self.top]:
+            print("%-6s %-26s %7d %10.3f %10.3f %10d  %s" %
+                  (entry["kind"], entry["key"][:26], entry["calls"],
+                   entry["total_s"], entry["fetch_s"], entry["rows"],
+                   entry["text"][:60]), file=stream)
+
+    def finish(self):
+        """Writes the report and prints the summary, registered at exit."""
+        if not self.records:
+            return
+        if self.report_path:
+            self.write_report(self.report_path)
+        self.print_summary()
+
+
+PROFILER = Profiler()
+if os.environ.get("LDC_PROFILE"):
+    PROFILER.enable(os.environ["LDC_PROFILE"],
+                    int(os.environ.get("LDC_PROFILE_TOP", 10)))
+
+
+def timer(name):
+    """Shortcut for PROFILER.timer(name)."""
+    return PROFILER.timer(name)
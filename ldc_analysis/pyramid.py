@@ -0,0 +1,154 @@
+"""
+Multi-resolution levels of day x hour heatmaps.
+
+A pyramid holds week x hour and month x hour reductions (mean, max and min
+of the observed hours) of a base day x hour heatmap. Weeks are consecutive
+7-day bins from the first day, months are calendar months, each level
+recording the base row offset of every bin. pyramid_heatmap picks the
+coarsest level that still has a row per requested pixel, so a multi-year
+heatmap is drawn from a few hundred rows instead of one per day.
+
+@author: r24mille
+"""
+import numpy
+
+from ldc_analysis.heatmap import HOURS_PER_DAY
+
+
+LEVELS = ("day", "week", "month")
+STATISTICS = ("mean", "max", "min")
+DAYS_PER_WEEK = 7
+
+
+def bin_offsets(start_date, num_days, level):
+    """
+    Returns the intp array of the first base row of every bin of a level.
+
+    Arguments:
+    start_date -- datetime.date or datetime64 of the first base row.
+    num_days -- Number of base rows.
+    level -- One of LEVELS.
+    """
+    if level == "day":
+        return numpy.arange(num_days)
+    if level == "week":
+        return numpy.arange(0, num_days, DAYS_PER_WEEK)
+    if level == "month":
+        days = numpy.datetime64(start_date, "D") + numpy.arange(num_days)
+        months = days.astype("datetime64[M]")
+        starts = numpy.ones(num_days, dtype=bool)
+        starts[1:] = months[1:] != months[:-1]
+        return numpy.flatnonzero(starts)
+    raise ValueError("Unknown pyramid level " + str(level))
+
+
+def _reduce_bins(heatmap, observed, offsets):
+    """
+    Returns the (mean, max, min) bins x 24 reductions of the observed hours
+    of heatmap rows starting at offsets, zero for bins without any.
+    """
+    if len(offsets) == 0:
+        empty = numpy.zeros((0, HOURS_PER_DAY))
+        return empty, empty, empty
+    counts = numpy.add.reduceat(observed, offsets, axis=0)
+    sums = numpy.add.reduceat(numpy.where(observed, heatmap, 0.0),
+                              offsets, axis=0)
+    maxima = numpy.maximum.reduceat(
+        numpy.where(observed, heatmap, -numpy.inf), offsets, axis=0)
+    minima = numpy.minimum.reduceat(
+        numpy.where(observed, heatmap, numpy.inf), offsets, axis=0)
+    empty = counts == 0
+    means = sums / numpy.maximum(counts, 1)
+    for values in (means, maxima, minima):
+        values[empty] = 0.0
+    return means, maxima, minima
+
+
+def build_pyramid(heatmap, missing, start_date):
+    """
+    Returns a dictionary of arrays with, for the week and month levels,
+    "<level>_offsets" (see bin_offsets) and "<level>_<statistic>" bins x 24
+    reductions over the observed hours of each bin. Bins without an observed
+    hour are zero, as missing hours of the base heatmap.
+
+    Arguments:
+    heatmap -- days x 24 numpy array.
+    missing -- Boolean days x 24 mask of hours without a reading.
+    start_date -- datetime.date or datetime64 of the first row.
+    """
+    return update_pyramid(None, heatmap, missing, start_date, 0)
+
+
+def update_pyramid(pyramid, heatmap, missing, start_date, first_row):
+    """
+    Returns the pyramid of heatmap as build_pyramid, keeping the bins of a
+    previous pyramid that end before first_row and reducing only the rows
+    from the start of the bin holding first_row.
+
+    Arguments:
+    pyramid -- Dictionary returned by build_pyramid for an earlier version
+               of heatmap with the same first day, or None.
+    heatmap -- days x 24 numpy array, eg. a memmap.
+    missing -- Boolean days x 24 mask of hours without a reading.
+    start_date -- datetime.date or datetime64 of the first row.
+    first_row -- First row of heatmap changed since pyramid was built.
+    """
+    updated = {}
+    for level in LEVELS[1:]:
+        offsets = bin_offsets(start_date, len(heatmap), level)
+        kept = 0
+        if pyramid is not None:
+            kept = numpy.searchsorted(offsets, first_row, side="right") - 1
+            kept = max(0, min(kept, len(pyramid[level + "_offsets"])))
+        start = offsets[kept] if kept < len(offsets) else len(heatmap)
+        reduced = _reduce_bins(
+            numpy.asarray(heatmap[start:], dtype=numpy.float64),
+            ~numpy.asarray(missing[start:], dtype=bool),
+            offsets[kept:] - start)
+        updated[level + "_offsets"] = offsets
+        for statistic, values in zip(STATISTICS, reduced):
+            if kept:
+                values = numpy.concatenate(
+                    (pyramid[level + "_" + statistic][:kept], values))
+            updated[level + "_" + statistic] = values
+    return updated
+
+
+def choose_level(pyramid, pixels):
+    """
+    Returns the coarsest level with at least pixels rows, "day" if none.
+
+    Arguments:
+    pyramid -- Dictionary returned by build_pyramid.
+    pixels -- Height in pixels of the drawn heatmap.
+    """
+    for level in reversed(LEVELS[1:]):
+        if len(pyramid[level + "_offsets"]) >= pixels:
+            return level
+    return "day"
+
+
+def pyramid_heatmap(pyramid, heatmap, pixels, statistic="mean"):
+    """
+    Returns (level, rows, offsets) where rows is the heatmap of the coarsest
+    level with a row per pixel, see choose_level, and offsets the first
+    base row of each of its bins. Weeks may end early and months differ in
+    length, so drawing the rows evenly distorts the date axis, see
+    render.render_heatmap. The base heatmap is returned as is with offsets
+    None at the day level, it spans the same days at every level.
+
+    Arguments:
+    pyramid -- Dictionary returned by build_pyramid.
+    heatmap -- The days x 24 base heatmap of the pyramid.
+    pixels -- Height in pixels of the drawn heatmap, None for the day level.
+    statistic -- (Optional) One of STATISTICS. Defaults to "mean".
+    """
+    if statistic not in STATISTICS:
+        raise ValueError("Unknown pyramid statistic " + str(statistic))
+    if pixels is None:
+        return "day", heatmap, None
+    level = choose_level(pyramid, pixels)
+    if level == "day":
+        return level, heatmap, None
+    return (level, pyramid[level + "_" + statistic],
+            pyramid[level + "_offsets"])
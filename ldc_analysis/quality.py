@@ -0,0 +1,152 @@
+"""
+In-memory interval index of meter data quality flags.
+
+QualityFlagIndex holds the applicability intervals of
+meter_data_quality_flag, merged per meter and sorted by (MeterID, start day)
+into two int64 key arrays. A batch of (MeterID, day) readings is tested
+against every interval with one numpy.searchsorted, so readings are masked
+only inside the flagged days rather than dropping a meter for a whole
+window with a join on every scan.
+
+@author: r24mille
+"""
+from django.db import connections
+import numpy
+
+from ldc_analysis.cache import cached_result
+
+
+QUALITY_FLAG_SOURCES = [("meter_data_quality_flag",
+                         "max(meter_data_quality_flag_id)")]
+
+# Days are counted from 0001-01-01 (datetime.date.toordinal() - 1), every
+# day fits below DAY_SPAN, so MeterID * DAY_SPAN + day orders intervals by
+# meter then day
+EPOCH_ORDINAL = 719163
+DAY_SPAN = 2 ** 22
+FIRST_DAY = numpy.datetime64("0001-01-01")
+LAST_DAY = numpy.datetime64("9999-12-31")
+
+
+def _day_numbers(days):
+    """Returns the day number of datetime64 values, see DAY_SPAN."""
+    days = numpy.asarray(days, dtype="datetime64[D]")
+    return days.astype(numpy.int64) + (EPOCH_ORDINAL - 1)
+
+
+class QualityFlagIndex(object):
+    """
+    Sorted, non-overlapping (MeterID, start day, end day) intervals of
+    flagged readings. Both ends of an interval are inclusive.
+    """
+
+    def __init__(self, key_starts, key_ends):
+        """
+        Arguments:
+        key_starts -- Sorted int64 array of MeterID * DAY_SPAN + first day.
+        key_ends -- int64 array of MeterID * DAY_SPAN + last day.
+        """
+        self.key_starts = key_starts
+        self.key_ends = key_ends
+
+    @classmethod
+    def from_intervals(cls, meter_ids, start_dates, end_dates):
+        """
+        Returns an index of (meter, start, end) intervals in any order,
+        merging intervals of a meter that overlap or touch. Missing (NaT)
+        starts and ends are treated as open-ended.
+
+        Arguments:
+        meter_ids -- array_like of MeterIDs.
+        start_dates -- array_like of applicability start dates.
+        end_dates -- array_like of applicability end dates (inclusive).
+        """
+        meter_ids = numpy.asarray(meter_ids, dtype=numpy.int64)
+        starts = numpy.asarray(start_dates, dtype="datetime64[D]")
+        ends = numpy.asarray(end_dates, dtype="datetime64[D]")
+        starts = numpy.where(numpy.isnat(starts), FIRST_DAY, starts)
+        ends = numpy.where(numpy.isnat(ends), LAST_DAY, ends)
+        key_starts = meter_ids * DAY_SPAN + _day_numbers(starts)
+        key_ends = meter_ids * DAY_SPAN + _day_numbers(ends)
+        order = numpy.argsort(key_starts, kind="mergesort")
+        key_starts, key_ends = key_starts[order], key_ends[order]
+        if len(key_starts) == 0:
+            return cls(key_starts, key_ends)
+
+        # A new interval begins after the furthest end seen so far (plus
+        # one day). Ends never cross into the next meter's key range.
+        reach = numpy.maximum.accumulate(key_ends)
+        first = numpy.ones(len(key_starts), dtype=bool)
+        first[1:] = key_starts[1:] > reach[:-1] + 1
+        begins = numpy.flatnonzero(first)
+        return cls(key_starts[begins],
+                   numpy.maximum.reduceat(key_ends, begins))
+
+    @classmethod
+    def load(cls, connection_name="ldc"):
+        """
+        Returns the index of every row of meter_data_quality_flag. The
+        merged intervals are cached until a flag is added.
+
+        Arguments:
+        connection_name -- (Optional) Django database alias. Defaults to
+                           "ldc".
+        """
+        def compute():
+            cursor = connections[connection_name].cursor()
+            cursor.execute("select MeterID, applicability_start_date, "
+                           "applicability_end_date "
+                           "from meter_data_quality_flag")
+            rows = cursor.fetchall()
+            if not rows:
+                return {"key_starts": numpy.zeros(0, dtype=numpy.int64),
+                        "key_ends": numpy.zeros(0, dtype=numpy.int64)}
+            meter_ids, starts, ends = zip(*rows)
+            index = cls.from_intervals(
+                meter_ids,
+                numpy.array([str(d) if d else None for d in starts],
+                            dtype="datetime64[D]"),
+                numpy.array([str(d) if d else None for d in ends],
+                            dtype="datetime64[D]"))
+            return {"key_starts": index.key_starts,
+                    "key_ends": index.key_ends}
+
+        arrays = cached_result("quality_flag_index", (),
+                               QUALITY_FLAG_SOURCES, compute,
+                               connection_name)
+        return cls(arrays["key_starts"], arrays["key_ends"])
+
+    def __len__(self):
+        return len(self.key_starts)
+
+    def flagged(self, meter_ids, days):
+        """
+        Returns a boolean array that is True for every reading falling in a
+        flagged interval of its meter.
+
+        Arguments:
+        meter_ids -- array_like of MeterIDs, one per reading.
+        days -- datetime64 (or date-like) array of reading days.
+        """
+        keys = numpy.asarray(meter_ids, dtype=numpy.int64) * DAY_SPAN + \
+            _day_numbers(days)
+        if len(self.key_starts) == 0:
+            return numpy.zeros(keys.shape, dtype=bool)
+        i = numpy.searchsorted(self.key_starts, keys, side="right") - 1
+        return (i >= 0) & (keys <= self.key_ends[numpy.maximum(i, 0)])
+
+    def meters_flagged_between(self, start_date, end_date):
+        """
+        Returns the sorted MeterIDs with a flagged interval overlapping the
+        days from start_date to end_date (inclusive).
+
+        Arguments:
+        start_date -- First day, a datetime64 or date-like value.
+        end_date -- Last day.
+        """
+        first = _day_numbers(numpy.datetime64(str(start_date)[:10], "D"))
+        last = _day_numbers(numpy.datetime64(str(end_date)[:10], "D"))
+        meters = self.key_starts // DAY_SPAN
+        overlapping = (self.key_starts - meters * DAY_SPAN <= last) & \
+            (self.key_ends - meters * DAY_SPAN >= first)
+        return numpy.unique(meters[overlapping])
@@ -0,0 +1,238 @@
+"""
+Incremental builder of the quantized TOU readings table read by
+aggregate.quantize_by_period.
+
+Each row of essex_annotated.r24mille_quantized_res_readings summarizes the
+average household readings of one (rounded temperature, TOU period, TOU
+billing active) cell. The table has no location column, so it is built
+from the temperatures of a single location. A high-water mark of the last
+aggregate reading included is kept with that location, so appending a month
+of readings only reads that month and merges its statistics into the
+existing rows. The mark never passes the newest weather observation, so
+readings waiting for their temperature are summarized by a later build.
+
+@author: r24mille
+"""
+import os
+
+from django.db import DatabaseError, connections, transaction
+import numpy
+
+from ldc_analysis.heatmap_store import seconds_text
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.query import SelectQuery
+from ldc_analysis.running_stats import RunningStats
+from ldc_analysis.tou import SUMMER_WEEKDAY_PERIODS, TOU_BILLING_START, \
+    classify_periods, date_keys
+from ldc_analysis.weather import MAX_TEMPERATURE, MIN_TEMPERATURE, \
+    check_temperatures, epoch_seconds_sql, round_temperatures, weather_store
+
+
+QUANTIZED_TABLE = "essex_annotated.r24mille_quantized_res_readings"
+STATE_TABLE = "essex_annotated.r24mille_quantized_res_readings_state"
+PERIOD_IDS = sorted(set(SUMMER_WEEKDAY_PERIODS.tolist()))
+GRID_SHAPE = (MAX_TEMPERATURE - MIN_TEMPERATURE + 1,
+              max(PERIOD_IDS) + 1,
+              2)
+
+
+def _create_state_table(cursor):
+    """Creates STATE_TABLE unless it exists."""
+    cursor.execute("create table if not exists " + STATE_TABLE + " ("
+                   "location_id int not null primary key, "
+                   "built_through datetime not null)")
+
+
+def _state_rows(cursor):
+    """Returns the (location_id, built_through) rows of STATE_TABLE."""
+    cursor.execute("select location_id, built_through from " + STATE_TABLE)
+    return cursor.fetchall()
+
+
+def _read_watermark(cursor, location_id):
+    """
+    Returns the datetime of the last aggregate reading summarized, or None
+    if nothing has been built yet. Raises ValueError if the table was built
+    for another location (or several), it must then be rebuilt.
+    """
+    rows = _state_rows(cursor)
+    if not rows:
+        return None
+    if len(rows) > 1 or rows[0][0] != location_id:
+        raise ValueError("The quantized table was built for location " +
+                         ", ".join(str(row[0]) for row in rows) +
+                         ", rebuild it for location " + str(location_id))
+    return parse_datetime(rows[0][1])
+
+
+def quantized_state(connection_name="ldc"):
+    """
+    Returns the (location_id, datetime) of the last aggregate reading
+    summarized by build_quantized_readings, or None if it has not built the
+    table. Only reads the database, so views can call it on every request.
+
+    Arguments:
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    """
+    try:
+        # The savepoint keeps an enclosing transaction usable on error
+        with transaction.atomic(using=connection_name):
+            rows = _state_rows(connections[connection_name].cursor())
+    except DatabaseError:
+        # STATE_TABLE is created by the first build
+        return None
+    if len(rows) != 1:
+        return None
+    return rows[0][0], parse_datetime(rows[0][1])
+
+
+def _weather_through(cursor, location_id):
+    """
+    Returns the datetime of the newest aggregate reading that is not newer
+    than the newest weather observation of location_id, None if there is
+    none.
+    """
+    seconds, _ = weather_store([location_id]).observations(location_id)
+    if not len(seconds):
+        return None
+    cursor.execute("select max(aggregate_reading_datetime_standard) "
+                   "from r24mille_aggregate_res_readings "
+                   "where aggregate_reading_datetime_standard <= %s",
+                   [seconds_text(seconds[-1])])
+    through = cursor.fetchone()[0]
+    return None if through is None else parse_datetime(through)
+
+
+def _load_summary(cursor):
+    """
+    Returns a RunningStats grid holding the rows of the quantized table for
+    the TOU periods built by this module.
+    """
+    stats = RunningStats(GRID_SHAPE)
+    query = SelectQuery(["rounded_temp", "tou_period_id", "tou_billing_active",
+                         "sample_mean", "sample_variance",
+                         "number_of_readings"],
+                        QUANTIZED_TABLE)
+    query.where_in("tou_period_id", PERIOD_IDS)
+    rows = numpy.array(query.execute(cursor).fetchall(),
+                       dtype=numpy.float64).reshape(-1, 6)
+    if rows.size:
+        cells = (rows[:, 0].astype(numpy.intp) - MIN_TEMPERATURE,
+                 rows[:, 1].astype(numpy.intp),
+                 rows[:, 2].astype(numpy.intp))
+        count = numpy.zeros(GRID_SHAPE, dtype=numpy.int64)
+        mean = numpy.zeros(GRID_SHAPE)
+        m2 = numpy.zeros(GRID_SHAPE)
+        count[cells] = rows[:, 5]
+        mean[cells] = rows[:, 3]
+        m2[cells] = rows[:, 4] * numpy.maximum(rows[:, 5] - 1, 0)
+        stats.merge(count, mean, m2)
+    return stats
+
+
+def _summarize_readings(location_id, after, through, chunk_size):
+    """
+    Returns a RunningStats grid of the average household readings after
+    (exclusive, None for all) and through (inclusive) two datetimes.
+    """
+    reading_datetime = "arr.aggregate_reading_datetime_standard"
+    query = SelectQuery(["year(" + reading_datetime + ") * 10000 + " +
+                         "month(" + reading_datetime + ") * 100 + " +
+                         "dayofmonth(" + reading_datetime + ")",
+                         "weekday(" + reading_datetime + ")",
+                         "hour(" + reading_datetime + ")",
+                         "arr.aggregate_reading / arr.number_of_meters",
+                         epoch_seconds_sql(reading_datetime)],
+                        "r24mille_aggregate_res_readings arr")
+    if after is not None:
+        query.where(reading_datetime + " > %s", after)
+    query.where(reading_datetime + " <= %s", through)
+
+    store = weather_store([location_id])
+    billing_start = date_keys([TOU_BILLING_START])[0]
+    stats = RunningStats(GRID_SHAPE)
+    for chunk in query.stream_chunks(connections["ldc"], chunk_size):
+        day_keys = chunk[:, 0].astype(numpy.int64)
+        periods = classify_periods(day_keys, chunk[:, 1], chunk[:, 2])
+        temps = store.align(location_id, chunk[:, 4])
+        kept = (periods > 0) & ~numpy.isnan(temps)
+        temps = round_temperatures(temps[kept])
+        check_temperatures(temps)
+        billing = (day_keys[kept] >= billing_start).astype(numpy.intp)
+        stats.update((temps - MIN_TEMPERATURE, periods[kept], billing),
+                     chunk[kept, 3])
+    return stats
+
+
+def build_quantized_readings(location_id, rebuild=False, chunk_size=100000):
+    """
+    Summarizes aggregate readings added since the last build into the
+    quantized TOU readings table and returns the number of readings added.
+    Existing rows are combined with the new readings using the parallel
+    variance formula, only rows of cells that received readings are
+    rewritten.
+
+    Arguments:
+    location_id -- The weathertables.location to use for hourly temperature
+                   measurements.
+    rebuild -- (Optional) Discard the rows of the built TOU periods and the
+               high-water mark, then summarize every reading. Implied by
+               the first build, whose table may hold rows that were not
+               summarized by this module. Defaults to False.
+    chunk_size -- (Optional) Number of readings fetched per round trip.
+                  Defaults to 100000.
+    """
+    cursor = connections["ldc"].cursor()
+    _create_state_table(cursor)
+    if rebuild:
+        built_through = None
+    else:
+        built_through = _read_watermark(cursor, location_id)
+        rebuild = built_through is None
+    through = _weather_through(cursor, location_id)
+    if through is None or (built_through is not None and
+                           through <= built_through):
+        return 0
+
+    added = _summarize_readings(location_id, built_through, through,
+                                chunk_size)
+    if rebuild:
+        summary = RunningStats(GRID_SHAPE)
+    else:
+        summary = _load_summary(cursor)
+    summary.merge(added.count, added.mean, added.m2)
+
+    changed = numpy.nonzero(added.count)
+    keys = [(int(t) + MIN_TEMPERATURE, int(p), int(b))
+            for t, p, b in zip(*changed)]
+    rows = [key + (float(mean), float(variance), int(count))
+            for key, mean, variance, count in zip(keys,
+                                                  summary.mean[changed],
+                                                  summary.variance(1)[changed],
+                                                  summary.count[changed])]
+    with transaction.atomic(using="ldc"):
+        if rebuild:
+            cursor.execute("delete from " + QUANTIZED_TABLE + " "
+                           "where tou_period_id in (" +
+                           ", ".join(["%s"] * len(PERIOD_IDS)) + ")",
+                           PERIOD_IDS)
+            cursor.execute("delete from " + STATE_TABLE)
+        else:
+            cursor.executemany("delete from " + QUANTIZED_TABLE + " "
+                               "where rounded_temp = %s "
+                               "and tou_period_id = %s "
+                               "and tou_billing_active = %s", keys)
+        cursor.executemany("insert into " + QUANTIZED_TABLE + " "
+                           "(rounded_temp, tou_period_id, tou_billing_active, "
+                           "sample_mean, sample_variance, number_of_readings) "
+                           "values (%s, %s, %s, %s, %s, %s)", rows)
+        cursor.execute("replace into " + STATE_TABLE + " "
+                       "(location_id, built_through) values (%s, %s)",
+                       [location_id, through])
+    return int(added.count.sum())
+
+
+if __name__ == '__main__':
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
+    windsor_location_id = 13
+    print("readings added", build_quantized_readings(windsor_location_id))
@@ -0,0 +1,176 @@
+"""
+Builder of parameterized SQL SELECT statements for raw cursor queries.
+
+@author: r24mille
+"""
+import numpy
+
+from ldc_analysis.profiling import timer
+
+
+# MySQL TO_DAYS() of 1970-01-01, to convert to_days() columns to days
+TO_DAYS_EPOCH = 719528
+
+
+def to_days(day):
+    """
+    Returns the MySQL TO_DAYS() of the date of a datetime.date or
+    datetime.datetime.
+    """
+    return int(numpy.datetime64(day, "D").astype(numpy.int64)) + TO_DAYS_EPOCH
+
+
+def to_days_dates(values):
+    """
+    Returns a datetime64[D] array of MySQL TO_DAYS() values, eg. a
+    to_days(ReadDate) column fetched as float64.
+    """
+    return (numpy.asarray(values).astype(numpy.int64) -
+            TO_DAYS_EPOCH).astype("datetime64[D]")
+
+
+class SelectQuery(object):
+    """
+    Accumulates the clauses of a SELECT statement together with their bound
+    parameters. Values are never concatenated into the SQL, so the statement
+    text stays identical between calls and predicates on indexed columns are
+    left as plain comparisons.
+    """
+
+    def __init__(self, columns, table, column_params=(), alias=None):
+        """
+        Arguments:
+        columns -- List of select expressions.
+        table -- Table expression of the FROM clause, including any alias, 
+                 or a SelectQuery to select from as a derived table.
+        column_params -- (Optional) Parameters of placeholders in columns.
+        alias -- (Optional) Alias of a derived table, required when table 
+                 is a SelectQuery.
+        """
+        self.columns = list(columns)
+        self.table = table
+        self.column_params = list(column_params)
+        self.alias = alias
+        self.joins = []
+        self.conditions = []
+        self.group_by = []
+        self.order_by = []
+
+    def join(self, clause, *params):
+        """
+        Adds a JOIN clause (eg. "left join t on t.id = x.id and t.y = %s").
+        """
+        self.joins.append((clause, params))
+        return self
+
+    def where(self, condition, *params):
+        """Adds a condition to the WHERE clause, combined with "and"."""
+        self.conditions.append((condition, params))
+        return self
+
+    def where_in(self, column, values):
+        """Adds a "column in (...)" condition with one parameter per value."""
+        values = list(values)
+        if not values:
+            return self.where("1 = 0")
+        placeholders = ", ".join(["%s"] * len(values))
+        return self.where(column + " in (" + placeholders + ")", *values)
+
+    def where_ranges(self, column, ranges):
+        """
+        Adds a condition matching any of the half-open (start, end) ranges
+        of column, which range-optimizes on an index of column.
+        """
+        ranges = list(ranges)
+        if not ranges:
+            return self.where("1 = 0")
+        condition = " or ".join(["(" + column + " >= %s and " +
+                                 column + " < %s)"] * len(ranges))
+        params = [value for bounds in ranges for value in bounds]
+        return self.where("(" + condition + ")", *params)
+
+    def group(self, *columns):
+        """Adds columns to the GROUP BY clause."""
+        self.group_by.extend(columns)
+        return self
+
+    def order(self, *columns):
+        """Adds columns (eg. "rounded_temp asc") to the ORDER BY clause."""
+        self.order_by.extend(columns)
+        return self
+
+    def sql(self):
+        """Returns a (sql, params) tuple ready for cursor.execute."""
+        sql = "select " + ", ".join(self.columns) + " from "
+        params = list(self.column_params)
+        if isinstance(self.table, SelectQuery):
+            table_sql, table_params = self.table.sql()
+            sql += "(" + table_sql + ") " + self.alias
+            params.extend(table_params)
+        else:
+            sql += self.table
+        for clause, clause_params in self.joins:
+            sql += " " + clause
+            params.extend(clause_params)
+        if self.conditions:
+            sql += " where " + " and ".join(c for c, _ in self.conditions)
+            for _, condition_params in self.conditions:
+                params.extend(condition_params)
+        if self.group_by:
+            sql += " group by " + ", ".join(self.group_by)
+        if self.order_by:
+            sql += " order by " + ", ".join(self.order_by)
+        return sql, params
+
+    def execute(self, cursor):
+        """Executes the query on cursor and returns the cursor."""
+        sql, params = self.sql()
+        cursor.execute(sql, params)
+        return cursor
+
+    def iter_chunks(self, cursor, chunk_size=100000):
+        """
+        Executes the query on cursor and yields its rows as 2D float64 numpy
+        arrays of at most chunk_size rows each (NULLs become NaN).
+        """
+        self.execute(cursor)
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            with timer("iter_chunks.convert"):
+                chunk = numpy.array(rows, dtype=numpy.float64)
+            yield chunk
+            rows = cursor.fetchmany(chunk_size)
+
+    def stream_chunks(self, connection, chunk_size=100000):
+        """
+        As iter_chunks, on a streaming_cursor of a Django connection that is
+        closed once the rows are read or the generator is discarded.
+        """
+        cursor = streaming_cursor(connection)
+        try:
+            for chunk in self.iter_chunks(cursor, chunk_size):
+                yield chunk
+        finally:
+            cursor.close()
+
+
+def streaming_cursor(connection):
+    """
+    Returns a cursor of a Django connection that fetches rows from the server
+    as they are read. The default MySQLdb cursor copies the whole result
+    into memory on execute, so fetchmany alone does not bound the memory of
+    a scan. Other backends already fetch lazily and get a plain cursor. No
+    other statement may run on the connection until every row of a MySQL
+    streaming cursor is read or the cursor is closed.
+
+    Arguments:
+    connection -- Django database connection (eg. connections["ldc"]).
+    """
+    if connection.vendor != "mysql":
+        return connection.cursor()
+    from django.db.backends.mysql.base import CursorWrapper
+    import MySQLdb.cursors
+
+    connection.ensure_connection()
+    return connection.make_cursor(
+        CursorWrapper(connection.connection.cursor(MySQLdb.cursors.SSCursor)))
@@ -0,0 +1,236 @@
+"""
+Headless, multi-process rendering of heatmap figures to PNG files.
+
+Figures are rendered by a pool of worker processes using matplotlib's Agg
+backend. matplotlib is only imported once a figure is drawn, and scripts that
+plot in-process select Agg themselves when there is no display (see
+import_pyplot), so batch jobs need no X server. A SHA-1 digest of each
+figure's inputs is written beside the PNG so that figures whose data has not
+changed are skipped on the next run.
+
+@author: r24mille
+"""
+import collections
+import hashlib
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+from ldc_analysis.profiling import PROFILER, timer
+
+
+DIGEST_SUFFIX = ".sha1"
+
+
+def select_backend():
+    """
+    Selects matplotlib's non-interactive Agg backend when no display is
+    available, ie. DISPLAY and WAYLAND_DISPLAY are unset on an X11 platform
+    and no backend was chosen with MPLBACKEND. Has no effect once pyplot is
+    imported.
+    """
+    if "matplotlib.pyplot" in sys.modules or os.environ.get("MPLBACKEND"):
+        return
+    if sys.platform in ("darwin", "win32", "cygwin"):
+        return
+    if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"):
+        return
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def import_pyplot():
+    """
+    Returns matplotlib.pyplot, imported on first use after select_backend so
+    that analyses which never plot do not load matplotlib.
+    """
+    select_backend()
+    from matplotlib import pyplot
+    return pyplot
+
+
+def heatmap_digest(heatmap, start_date, end_date, title, vmin=None,
+                   vmax=None, offsets=None):
+    """
+    Returns a hex SHA-1 digest of everything that affects a rendered
+    heatmap figure.
+
+    Arguments:
+    heatmap -- n x 24 numpy array of readings.
+    start_date -- datetime.date of the first heatmap row.
+    end_date -- datetime.date of the last heatmap row.
+    title -- Title of plot.
+    vmin -- (Optional) Lower bound of the color scale.
+    vmax -- (Optional) Upper bound of the color scale.
+    offsets -- (Optional) First day of each row, see render_heatmap.
+    """
+    digest = hashlib.sha1(heatmap.tobytes())
+    digest.update(str(heatmap.shape).encode("utf-8"))
+    digest.update(repr((str(start_date), str(end_date), title, vmin, vmax))
+                  .encode("utf-8"))
+    if offsets is not None:
+        digest.update(numpy.asarray(offsets, dtype=numpy.int64).tobytes())
+    return digest.hexdigest()
+
+
+def is_current(filename, digest):
+    """
+    Returns True if filename exists and was rendered from inputs matching
+    digest.
+
+    Arguments:
+    filename -- Path of the PNG file.
+    digest -- Hex digest returned by heatmap_digest.
+    """
+    if not os.path.exists(filename):
+        return False
+    try:
+        with open(filename + DIGEST_SUFFIX) as digest_file:
+            return digest_file.read().strip() == digest
+    except IOError:
+        return False
+
+
+def render_heatmap(filename, heatmap, start_date, end_date, title, vmin=None,
+                   vmax=None, offsets=None):
+    """
+    Draws a day x hour heatmap and saves it to filename. Must be called in a
+    process where the Agg backend has been selected (see render_heatmaps).
+
+    Arguments:
+    filename -- Path of the PNG file to write, or a binary file object.
+    heatmap -- n x 24 numpy array of readings.
+    start_date -- datetime.date of the first heatmap row.
+    end_date -- datetime.date of the last heatmap row.
+    title -- Title of plot.
+    vmin -- (Optional) Lower bound of the color scale.
+    vmax -- (Optional) Upper bound of the color scale.
+    offsets -- (Optional) Day of start_date..end_date each row starts on,
+               for rows of a pyramid level (see pyramid.pyramid_heatmap).
+               Defaults to one day per row.
+    """
+    import matplotlib.dates
+    import matplotlib.pyplot as plt
+
+    start_datenum = matplotlib.dates.date2num(start_date)
+    end_datenum = matplotlib.dates.date2num(end_date)
+    fig = plt.figure()
+    ax = plt.subplot()
+    plt.subplots_adjust(left=0.2, bottom=None, right=1, top=None,
+                        wspace=None, hspace=None)
+    if offsets is None:
+        im = ax.imshow(heatmap, interpolation='none', aspect='auto',
+                       extent=(0, 24, start_datenum, end_datenum),
+                       origin='lower', vmin=vmin, vmax=vmax)
+    else:
+        # Weeks and months are drawn as tall as the days they span
+        num_days = (end_date - start_date).days + 1
+        edges = start_datenum + numpy.append(offsets, num_days)
+        im = ax.pcolormesh(numpy.arange(25), edges, heatmap, vmin=vmin,
+                           vmax=vmax)
+        ax.set_ylim(edges[0], edges[-1])
+    ax.yaxis_date()
+    ax.set_title(title)
+    ax.set_xlabel("Hour of Day")
+    ax.set_ylabel("Day of Year")
+    ax.xaxis.set_ticks(range(0, 24, 2))
+    cb = fig.colorbar(im)
+    cb.set_label("Kilowatt-hours (kWh)")
+    with timer("savefig"):
+        plt.savefig(filename, dpi=100, format="png")
+    plt.close(fig)
+
+
+def _init_worker():
+    """
+    Selects the non-interactive Agg backend in a pool worker and discards
+    profiler records inherited from the parent process.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    PROFILER.drain()
+
+
+def _render_job(job):
+    """
+    Renders one job tuple in a pool worker and records its digest. Returns
+    the filename and the worker's profiler records.
+    """
+    (digest, filename, heatmap, start_date, end_date, title, vmin, vmax,
+     offsets) = job
+    with timer("render_heatmap"):
+        render_heatmap(filename, heatmap, start_date, end_date, title, vmin,
+                       vmax, offsets)
+    with open(filename + DIGEST_SUFFIX, "w") as digest_file:
+        digest_file.write(digest)
+    return filename, PROFILER.drain()
+
+
+def bounded_imap(pool, func, jobs, processes=None):
+    """
+    Yields func(job) for each job run in pool, in the order of jobs, keeping
+    at most two jobs per worker process submitted at once. Unlike
+    Pool.imap_unordered, whose task thread drains jobs as fast as it can, a
+    job is only taken from jobs once an earlier one has finished.
+
+    Arguments:
+    pool -- multiprocessing.Pool running the jobs.
+    func -- Function of one job, called in a worker.
+    jobs -- Iterable of jobs.
+    processes -- (Optional) Number of worker processes of pool. Defaults to
+                 the number of CPUs.
+    """
+    limit = 2 * (processes or multiprocessing.cpu_count())
+    pending = collections.deque()
+    for job in jobs:
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (job,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def render_heatmaps(jobs, processes=None, force=False):
+    """
+    Renders heatmap figures concurrently in a pool of worker processes and
+    returns the list of filenames that were (re)written. Jobs are taken from
+    the iterable as workers become free (see bounded_imap), so a generator
+    of heatmaps is never fully held in memory.
+
+    Arguments:
+    jobs -- Iterable of (filename, heatmap, start_date, end_date, title) or
+            (filename, heatmap, start_date, end_date, title, vmin, vmax)
+            tuples. An eighth item gives the row offsets of render_heatmap.
+    processes -- (Optional) Number of worker processes. Defaults to the
+                 number of CPUs.
+    force -- (Optional) Render every figure even if its digest is unchanged.
+             Defaults to False.
+    """
+    def pending_jobs():
+        for job in jobs:
+            filename, heatmap, start_date, end_date, title = job[:5]
+            vmin, vmax = job[5:7] if len(job) > 5 else (None, None)
+            offsets = job[7] if len(job) > 7 else None
+            digest = heatmap_digest(heatmap, start_date, end_date, title,
+                                    vmin, vmax, offsets)
+            if not force and is_current(filename, digest):
+                continue
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            yield (digest, filename, heatmap, start_date, end_date, title,
+                   vmin, vmax, offsets)
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    rendered = []
+    try:
+        for filename, records in bounded_imap(pool, _render_job,
+                                              pending_jobs(), processes):
+            PROFILER.extend(records)
+            rendered.append(filename)
+    finally:
+        pool.close()
+        pool.join()
+    return rendered
@@ -0,0 +1,93 @@
+"""
+Constant-memory running statistics over a dense grid of cells.
+
+@author: r24mille
+"""
+import numpy
+
+
+class RunningStats(object):
+    """
+    Running count, mean, M2 (sum of squared deviations from the mean) and
+    maximum for every cell of a dense numpy grid. Chunks of values are folded
+    in with the parallel form of Welford's algorithm, so memory depends only
+    on the grid shape and never on the number of values seen.
+    """
+
+    def __init__(self, shape):
+        """
+        Arguments:
+        shape -- Shape of the grid of cells (eg. (temperatures, 24)).
+        """
+        self.count = numpy.zeros(shape, dtype=numpy.int64)
+        self.mean = numpy.zeros(shape)
+        self.m2 = numpy.zeros(shape)
+        self.maximum = numpy.full(shape, -numpy.inf)
+
+    def update(self, indices, values):
+        """
+        Folds a chunk of values into the running statistics.
+
+        Arguments:
+        indices -- Tuple of integer index arrays, one per grid dimension,
+                   giving the cell of each value.
+        values -- 1D array_like of values.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        shape = self.count.shape
+        size = self.count.size
+        cells = numpy.ravel_multi_index(indices, shape)
+
+        count = numpy.bincount(cells, minlength=size)
+        sums = numpy.bincount(cells, weights=values, minlength=size)
+        mean = numpy.zeros(size)
+        present = count > 0
+        mean[present] = sums[present] / count[present]
+        deviations = values - mean[cells]
+        m2 = numpy.bincount(cells, weights=deviations * deviations,
+                            minlength=size)
+        numpy.maximum.at(self.maximum.reshape(-1), cells, values)
+
+        self.merge(count.reshape(shape), mean.reshape(shape),
+                   m2.reshape(shape))
+
+    def merge(self, count, mean, m2):
+        """
+        Combines per-cell statistics of another partition of the data into
+        the running statistics (Chan et al. parallel variance).
+
+        Arguments:
+        count -- Array of per-cell counts.
+        mean -- Array of per-cell means.
+        m2 -- Array of per-cell sums of squared deviations from the mean.
+        """
+        total = self.count + count
+        delta = mean - self.mean
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            weight = numpy.where(total > 0, count / total, 0.0)
+        self.mean += delta * weight
+        self.m2 += m2 + delta * delta * self.count * weight
+        self.count = total
+
+    def variance(self, ddof=0):
+        """
+        Returns the per-cell variance, zero where there are not enough
+        values.
+
+        Arguments:
+        ddof -- (Optional) Delta degrees of freedom. Defaults to 0, the
+                population variance used by numpy.var.
+        """
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            variance = self.m2 / (self.count - ddof)
+        variance[self.count <= ddof] = 0.0
+        return variance
+
+    def std(self, ddof=0):
+        """
+        Returns the per-cell standard deviation, see variance.
+
+        Arguments:
+        ddof -- (Optional) Delta degrees of freedom. Defaults to 0.
+        """
+        return numpy.sqrt(self.variance(ddof))
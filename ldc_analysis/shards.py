@@ -0,0 +1,60 @@
+"""
+Concurrent scans of a key range split into shards, each shard on its own
+database connection.
+
+@author: r24mille
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import connections
+
+
+def shard_ranges(first, last, shard_size):
+    """
+    Returns a list of half-open (start, end) ranges of at most shard_size
+    covering first (inclusive) to last (exclusive).
+
+    Arguments:
+    first -- Start of the range (eg. a MeterID or a datetime.date).
+    last -- End of the range, exclusive.
+    shard_size -- Width of each shard (eg. an int or a datetime.timedelta).
+    """
+    shards = []
+    start = first
+    while start < last:
+        end = min(start + shard_size, last)
+        shards.append((start, end))
+        start = end
+    return shards
+
+
+def scan_shards(shards, scan, merge, workers=4, connection_names=("ldc",)):
+    """
+    Runs scan(shard) for every shard concurrently in a pool of threads and
+    folds the partial results together with merge(result, partial) as the
+    shards complete. Django opens a separate connection per thread, each is
+    closed when its shard is done. Returns None if there are no shards.
+
+    Arguments:
+    shards -- List of shards, eg. from shard_ranges.
+    scan -- Callable returning the partial result (counts, histograms,
+            sketches) of one shard.
+    merge -- Callable combining two partial results into one.
+    workers -- (Optional) Number of shards scanned at once. Defaults to 4.
+    connection_names -- (Optional) Django database aliases used by scan.
+                        Defaults to ("ldc",).
+    """
+    def run(shard):
+        try:
+            return scan(shard)
+        finally:
+            for name in connection_names:
+                connections[name].close()
+
+    result = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, shard) for shard in shards]
+        for future in as_completed(futures):
+            partial = future.result()
+            result = partial if result is None else merge(result, partial)
+    return result
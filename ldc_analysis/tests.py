@@ -0,0 +1,612 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.db import DatabaseError, connections
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase
+import numpy
+
+from benchmarks.testcases import SyntheticDatabaseTestCase
+from ldc_analysis.aggregate import quantize_by_period, quantized_intervals
+from ldc_analysis.bootstrap import bootstrap_intervals, group_samples
+from ldc_analysis.cache import ResultCache
+from ldc_analysis.clustering import cluster_profiles, daily_profiles
+from ldc_analysis.feeders import FeederTree, _feeder_heatmaps
+from ldc_analysis.heatmap import build_heatmap, build_heatmaps
+from ldc_analysis.heatmap_store import HeatmapStore, to_seconds
+from ldc_analysis.holidays import business_day_ranges, parse_datetime
+from ldc_analysis.pyramid import build_pyramid, pyramid_heatmap, \
+    update_pyramid
+from ldc_analysis.quality import QualityFlagIndex
+from ldc_analysis.quantize import QUANTIZED_TABLE, STATE_TABLE, \
+    build_quantized_readings, quantized_state
+from ldc_analysis.query import TO_DAYS_EPOCH, SelectQuery, to_days, \
+    to_days_dates
+from ldc_analysis.running_stats import RunningStats
+from ldc_analysis.tou import SUMMER_ON_PEAK
+from ldc_analysis.views import IMAGE_CACHE, tou_period_comparison
+from ldc_analysis.weather import WeatherStore, weather_store
+from transformer_demand.views import transformer_heatmap
+
+
+class BuildHeatmapTest(SimpleTestCase):
+
+    def test_scatters_readings_by_day_and_hour(self):
+        dates = [datetime.date(2011, 5, 3), datetime.date(2011, 5, 1),
+                 datetime.datetime(2011, 5, 3, 12)]
+        heatmap, missing, start_date, end_date = build_heatmap(
+            dates, [1, 24, 13], [1.5, 2, 3], hour_offset=1)
+        self.assertEqual(heatmap.shape, (3, 24))
+        self.assertEqual(start_date, datetime.date(2011, 5, 1))
+        self.assertEqual(end_date, datetime.date(2011, 5, 3))
+        self.assertEqual(heatmap[2, 0], 1.5)
+        self.assertEqual(heatmap[0, 23], 2.0)
+        self.assertEqual(heatmap[2, 12], 3.0)
+        self.assertEqual(heatmap.sum(), 6.5)
+        self.assertEqual((~missing).sum(), 3)
+        self.assertTrue(missing[1].all())
+
+    def test_stacks_value_columns(self):
+        days = numpy.array(["2012-01-01", "2012-01-02"],
+                           dtype="datetime64[D]")
+        heatmaps, missing, _, _ = build_heatmaps(days, [0, 5],
+                                                 [[1, 10], [2, 20]])
+        self.assertEqual(heatmaps.shape, (2, 2, 24))
+        self.assertEqual(heatmaps[1, 1, 5], 20.0)
+        self.assertEqual(heatmaps[0, 0, 0], 1.0)
+
+    def test_rejects_no_readings(self):
+        with self.assertRaises(ValueError):
+            build_heatmaps([], [], numpy.zeros((0, 1)))
+
+
+class RunningStatsTest(SimpleTestCase):
+
+    def test_merge_matches_numpy(self):
+        rng = numpy.random.RandomState(0)
+        values = rng.normal(5, 2, 1000)
+        cells = rng.randint(0, 3, 1000)
+        stats = RunningStats((3,))
+        other = RunningStats((3,))
+        stats.update((cells[:400],), values[:400])
+        other.update((cells[400:],), values[400:])
+        stats.merge(other.count, other.mean, other.m2)
+        for cell in range(3):
+            expected = values[cells == cell]
+            self.assertEqual(stats.count[cell], len(expected))
+            self.assertAlmostEqual(stats.mean[cell], expected.mean())
+            self.assertAlmostEqual(stats.variance(1)[cell],
+                                   expected.var(ddof=1))
+
+    def test_merge_into_empty_cells(self):
+        stats = RunningStats((2,))
+        stats.merge(numpy.array([0, 2]), numpy.array([0.0, 3.0]),
+                    numpy.array([0.0, 2.0]))
+        numpy.testing.assert_array_equal(stats.count, [0, 2])
+        numpy.testing.assert_array_equal(stats.mean, [0.0, 3.0])
+        numpy.testing.assert_array_equal(stats.variance(1), [0.0, 2.0])
+
+
+class BusinessDayRangesTest(SimpleTestCase):
+
+    def test_skips_weekends_and_holidays(self):
+        # 2011-05-23 is Victoria Day, the 21st and 22nd a weekend
+        ranges = business_day_ranges("2011-05-20 08:00:00", "2011-05-31")
+        self.assertEqual(ranges, [
+            (datetime.datetime(2011, 5, 20), datetime.datetime(2011, 5, 21)),
+            (datetime.datetime(2011, 5, 24), datetime.datetime(2011, 5, 28)),
+            (datetime.datetime(2011, 5, 30), datetime.datetime(2011, 6, 1))])
+
+    def test_no_business_days(self):
+        self.assertEqual(business_day_ranges("2011-05-21", "2011-05-23"), [])
+        self.assertEqual(business_day_ranges("2011-05-24", "2011-05-20"), [])
+
+    def test_parses_dates_and_datetimes(self):
+        expected = datetime.datetime(2011, 5, 20)
+        self.assertEqual(parse_datetime("2011-05-20"), expected)
+        self.assertEqual(parse_datetime(datetime.date(2011, 5, 20)),
+                         expected)
+        self.assertEqual(parse_datetime("2011-05-20 00:00:00"), expected)
+
+
+class SelectQueryTest(SimpleTestCase):
+
+    def test_binds_parameters_in_clause_order(self):
+        query = SelectQuery(["m.MeterID", "round(t.temp, %s)"],
+                            "Meters m", column_params=[1])
+        query.join("join T t on t.id = m.id and t.kind = %s", "a")
+        query.where("m.Phase = %s", 1).where_in("m.Feeder", ["F1", "F2"])
+        query.group("m.MeterID").order("m.MeterID asc")
+        sql, params = query.sql()
+        self.assertEqual(sql, "select m.MeterID, round(t.temp, %s) "
+                              "from Meters m "
+                              "join T t on t.id = m.id and t.kind = %s "
+                              "where m.Phase = %s and m.Feeder in (%s, %s) "
+                              "group by m.MeterID order by m.MeterID asc")
+        self.assertEqual(params, [1, "a", 1, "F1", "F2"])
+
+    def test_empty_in_and_ranges_match_nothing(self):
+        sql, params = SelectQuery(["x"], "T").where_in("x", []) \
+            .where_ranges("y", []).sql()
+        self.assertEqual(sql, "select x from T where 1 = 0 and 1 = 0")
+        self.assertEqual(params, [])
+
+    def test_where_ranges(self):
+        sql, params = SelectQuery(["x"], "T") \
+            .where_ranges("d", [(1, 2), (5, 8)]).sql()
+        self.assertEqual(sql, "select x from T where "
+                              "((d >= %s and d < %s) or (d >= %s and d < %s))")
+        self.assertEqual(params, [1, 2, 5, 8])
+
+    def test_derived_table(self):
+        inner = SelectQuery(["x"], "T").where("x > %s", 3)
+        sql, params = SelectQuery(["count(*)"], inner, alias="i") \
+            .where("i.x < %s", 9).sql()
+        self.assertEqual(sql, "select count(*) from (select x from T "
+                              "where x > %s) i where i.x < %s")
+        self.assertEqual(params, [3, 9])
+
+
+class StreamChunksTest(SyntheticDatabaseTestCase):
+
+    def test_chunks_match_fetchall(self):
+        query = SelectQuery(["MeterID", "to_days(ReadDate)", "Reading"],
+                            "SmartMeterReadings").order("MeterID",
+                                                        "read_datetime")
+        expected = numpy.array(query.execute(connections["ldc"].cursor())
+                               .fetchall(), dtype=numpy.float64)
+        chunks = list(query.stream_chunks(connections["ldc"], 100))
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertGreater(len(chunks), 1)
+        numpy.testing.assert_array_equal(numpy.concatenate(chunks), expected)
+
+    def test_closes_discarded_cursor(self):
+        query = SelectQuery(["Reading"], "SmartMeterReadings")
+        chunks = query.stream_chunks(connections["ldc"], 10)
+        next(chunks)
+        chunks.close()
+        cursor = connections["ldc"].cursor()
+        cursor.execute("select count(*) from SmartMeterReadings")
+        self.assertGreater(cursor.fetchone()[0], 10)
+
+
+class ResultCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        key = self.cache.make_key("rows", (1, 2), ("2012-01-01",))
+        self.assertNotEqual(key, self.cache.make_key("rows", (1, 3),
+                                                     ("2012-01-01",)))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {"rows": numpy.arange(6.0).reshape(2, 3)})
+        numpy.testing.assert_array_equal(self.cache.get(key)["rows"],
+                                         numpy.arange(6.0).reshape(2, 3))
+        self.cache.invalidate(key)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_evicts_least_recently_used(self):
+        arrays = {"rows": numpy.random.RandomState(0).rand(1000)}
+        self.cache.put("a", arrays)
+        size = os.path.getsize(self.cache._path("a"))
+        self.cache.max_bytes = size * 2
+        self.cache.put("b", arrays)
+        os.utime(self.cache._path("a"), (0, 0))
+        self.cache.get("b")
+        self.cache.put("c", arrays)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_corrupt_entry_is_a_miss(self):
+        self.cache.put("a", {"rows": numpy.arange(1000.0)})
+        path = self.cache._path("a")
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertFalse(os.path.exists(path))
+        with open(path, "wb") as f:
+            f.write(b"not a zip file")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertFalse(os.path.exists(path))
+
+
+class BuildQuantizedReadingsTest(SyntheticDatabaseTestCase):
+
+    def setUp(self):
+        connections["ldc"].cursor().execute("drop table if exists " +
+                                            STATE_TABLE)
+
+    def test_rebuild_on_fresh_database(self):
+        added = build_quantized_readings(13, rebuild=True, chunk_size=1000)
+        self.assertGreater(added, 0)
+        cursor = connections["ldc"].cursor()
+        cursor.execute("select sum(number_of_readings) from " +
+                       QUANTIZED_TABLE)
+        self.assertEqual(cursor.fetchone()[0], added)
+        location_id, built_through = quantized_state()
+        self.assertEqual(location_id, 13)
+        self.assertLessEqual(built_through, datetime.datetime(2012, 11, 1))
+
+    def test_second_build_adds_nothing(self):
+        first = build_quantized_readings(13)
+        self.assertGreater(first, 0)
+        self.assertEqual(build_quantized_readings(13), 0)
+        self.assertEqual(build_quantized_readings(13, rebuild=True), first)
+
+    def test_other_location_requires_rebuild(self):
+        build_quantized_readings(13)
+        with self.assertRaises(ValueError):
+            build_quantized_readings(14)
+        self.assertGreater(build_quantized_readings(14, rebuild=True), 0)
+        self.assertEqual(quantized_state()[0], 14)
+
+
+class ToDaysTest(SimpleTestCase):
+
+    def test_matches_mysql_to_days(self):
+        # MySQL: select to_days('1970-01-01'), to_days('2011-05-01 13:00')
+        self.assertEqual(to_days(datetime.date(1970, 1, 1)), 719528)
+        self.assertEqual(to_days(datetime.datetime(2011, 5, 1, 13)), 734623)
+        numpy.testing.assert_array_equal(
+            to_days_dates([719528.0, 734623.0]),
+            numpy.array(["1970-01-01", "2011-05-01"], dtype="datetime64[D]"))
+
+
+class ViewsTest(SyntheticDatabaseTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.image_directory = IMAGE_CACHE.directory
+        IMAGE_CACHE.directory = tempfile.mkdtemp(dir=self.directory)
+        connections["ldc"].cursor().execute("drop table if exists " +
+                                            STATE_TABLE)
+
+    def tearDown(self):
+        IMAGE_CACHE.directory = self.image_directory
+
+    def test_tou_period_comparison_before_build(self):
+        request = self.factory.get("/tou/period/3.png")
+        with self.assertRaises(Http404):
+            tou_period_comparison(request, str(SUMMER_ON_PEAK))
+        # Looking up the state does not create the state table
+        with self.assertRaises(DatabaseError):
+            connections["ldc"].cursor().execute("select * from " +
+                                                STATE_TABLE)
+        with self.assertRaises(Http404):
+            tou_period_comparison(request, "99")
+
+    def test_tou_period_comparison_revalidates(self):
+        build_quantized_readings(13)
+        response = tou_period_comparison(
+            self.factory.get("/tou/period/3.png"), str(SUMMER_ON_PEAK))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        response = tou_period_comparison(
+            self.factory.get("/tou/period/3.png",
+                             HTTP_IF_NONE_MATCH=response["ETag"]),
+            str(SUMMER_ON_PEAK))
+        self.assertEqual(response.status_code, 304)
+
+    def test_transformer_heatmap(self):
+        request = self.factory.get("/heatmap/transformer/T00000.png")
+        response = transformer_heatmap(request, "T00000")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        # A second request is served from the image cache
+        self.assertEqual(transformer_heatmap(request, "T00000").content,
+                         response.content)
+        response = transformer_heatmap(
+            self.factory.get("/heatmap/transformer/T00000.png?height=1"),
+            "T00000")
+        self.assertEqual(response.status_code, 200)
+        response = transformer_heatmap(
+            self.factory.get("/heatmap/transformer/T00000.png?height=x"),
+            "T00000")
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(Http404):
+            transformer_heatmap(request, "missing")
+
+
+class QualityFlagIndexTest(SimpleTestCase):
+
+    def test_merges_overlapping_intervals(self):
+        index = QualityFlagIndex.from_intervals(
+            [7, 7, 7, 3],
+            numpy.array(["2011-05-05", "2011-05-01", "2011-06-01",
+                         "2011-01-01"], dtype="datetime64[D]"),
+            numpy.array(["2011-05-10", "2011-05-04", "NaT", "2011-01-01"],
+                        dtype="datetime64[D]"))
+        self.assertEqual(len(index), 3)
+        days = numpy.array(["2011-05-01", "2011-05-10", "2011-05-11",
+                            "2020-01-01", "2011-01-01", "2011-01-02"],
+                           dtype="datetime64[D]")
+        numpy.testing.assert_array_equal(
+            index.flagged([7, 7, 7, 7, 3, 3], days),
+            [True, True, False, True, True, False])
+        numpy.testing.assert_array_equal(
+            index.meters_flagged_between("2011-01-01", "2011-02-01"), [3])
+
+    def test_empty_index_flags_nothing(self):
+        index = QualityFlagIndex.from_intervals([], [], [])
+        self.assertFalse(index.flagged([1], numpy.array(
+            ["2011-05-01"], dtype="datetime64[D]")).any())
+
+
+class FeederTreeTest(SimpleTestCase):
+
+    def test_rollup_sums_sub_trees(self):
+        # root -> a -> (b -> c, d), e has an unknown parent and is a root
+        tree = FeederTree(["root", "a", "b", "c", "d", "e"],
+                          [None, "root", "a", "b", "a", "x"])
+        index = dict(zip(tree.feeder_ids, range(len(tree))))
+        loads = {"root": 1, "a": 2, "b": 3, "c": 4, "d": 5, "e": 6}
+        totals = numpy.zeros((len(tree), 2, 24))
+        for feeder_id, load in loads.items():
+            totals[index[feeder_id]] = load
+        sums = tree.rollup(totals)
+        expected = {"root": 1 + 2 + 3 + 4 + 5, "a": 2 + 3 + 4 + 5,
+                    "b": 3 + 4, "c": 4, "d": 5, "e": 6}
+        for feeder_id, total in expected.items():
+            self.assertTrue((sums[index[feeder_id]] == total).all())
+            self.assertTrue((totals[index[feeder_id]] ==
+                             loads[feeder_id]).all())
+
+    def test_rejects_cycles(self):
+        with self.assertRaises(ValueError):
+            FeederTree(["a", "b"], ["b", "a"])
+
+    def test_feeder_heatmaps_sum_chunks(self):
+        tree = FeederTree(["root", "a"], [None, "root"])
+        index = dict(zip(tree.feeder_ids, range(len(tree))))
+        start = datetime.date(2011, 5, 1)
+        end = datetime.date(2011, 5, 2)
+        chunks = [(numpy.array([index["a"], index["root"], -1]),
+                   numpy.array([0, 1, 0]), numpy.array([5, 5, 5]),
+                   numpy.array([1.0, 2.0, 4.0])),
+                  (numpy.array([index["a"], index["a"]]),
+                   numpy.array([0, 2]), numpy.array([5, 5]),
+                   numpy.array([8.0, 16.0]))]
+        heatmaps, missing, _, _ = _feeder_heatmaps(tree, chunks, start, end)
+        self.assertEqual(heatmaps.shape, (2, 2, 24))
+        self.assertEqual(heatmaps[index["a"], 0, 5], 9.0)
+        self.assertEqual(heatmaps[index["root"], 0, 5], 9.0)
+        self.assertEqual(heatmaps[index["root"], 1, 5], 2.0)
+        self.assertEqual(heatmaps.sum(), 9.0 * 2 + 2.0)
+        self.assertEqual((~missing).sum(), 2)
+
+
+class WeatherStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.store = WeatherStore(numpy.array([13, 14]),
+                                  numpy.array([0, 3, 3]),
+                                  numpy.array([0, 3600, 7200]),
+                                  numpy.array([10.0, 12.0, 16.0]))
+
+    def test_exact(self):
+        numpy.testing.assert_array_equal(
+            self.store.align(13, [3600, 3601, 7200]),
+            [12.0, numpy.nan, 16.0])
+
+    def test_nearest_with_tolerance(self):
+        numpy.testing.assert_array_equal(
+            self.store.align(13, [1700, 1900, 9001], "nearest", 1800),
+            [10.0, 12.0, numpy.nan])
+
+    def test_linear(self):
+        numpy.testing.assert_array_equal(
+            self.store.align(13, [1800, 5400, 7201], "linear"),
+            [11.0, 14.0, numpy.nan])
+
+    def test_location_without_observations(self):
+        self.assertTrue(numpy.isnan(self.store.align(14, [0])).all())
+        with self.assertRaises(KeyError):
+            self.store.align(15, [0])
+
+
+class WeatherStoreLoadTest(SyntheticDatabaseTestCase):
+
+    def test_loads_every_location(self):
+        store = weather_store([14, 13])
+        self.assertIs(weather_store([13, 14]), store)
+        cursor = connections["ldc"].cursor()
+        for location_id in (13, 14):
+            cursor.execute("select count(*) from "
+                           "weathertables.wunderground_observation where "
+                           "location_id = %s and temp_metric is not null",
+                           [location_id])
+            seconds, temperatures = store.observations(location_id)
+            self.assertEqual(len(seconds), cursor.fetchone()[0])
+            self.assertTrue((numpy.diff(seconds) > 0).all())
+            numpy.testing.assert_array_equal(
+                store.align(location_id, seconds[:5]), temperatures[:5])
+
+
+class BootstrapIntervalsTest(SimpleTestCase):
+
+    def test_intervals_cover_the_mean(self):
+        rng = numpy.random.RandomState(0)
+        values, offsets = group_samples([rng.normal(10, 1, 200).tolist(), [],
+                                         [3.0] * 5, [1.0, 2.0, 3.0]])
+        intervals = bootstrap_intervals(values, offsets, resamples=200)
+        numpy.testing.assert_array_equal(intervals["count"], [200, 0, 5, 3])
+        self.assertTrue(numpy.isnan(intervals["mean"][1]))
+        self.assertEqual(intervals["lower"][2], 3.0)
+        self.assertEqual(intervals["upper"][2], 3.0)
+        sampled = intervals["count"] > 0
+        self.assertTrue((intervals["lower"][sampled] <=
+                         intervals["mean"][sampled]).all())
+        self.assertTrue((intervals["mean"][sampled] <=
+                         intervals["upper"][sampled]).all())
+        self.assertLess(intervals["upper"][0] - intervals["lower"][0], 0.5)
+
+    def test_blocks_do_not_change_the_seeded_result(self):
+        values, offsets = group_samples([[1.0, 5.0, 2.0], [4.0, 8.0]])
+        first = bootstrap_intervals(values, offsets, resamples=50, seed=3)
+        second = bootstrap_intervals(values, offsets, resamples=50, seed=3)
+        numpy.testing.assert_array_equal(first["lower"], second["lower"])
+        self.assertTrue((first["lower"] >= [1.0, 4.0]).all())
+        self.assertTrue((first["upper"] <= [5.0, 8.0]).all())
+
+
+class QuantizedIntervalsTest(SyntheticDatabaseTestCase):
+
+    def test_intervals_have_width(self):
+        build_quantized_readings(13, rebuild=True)
+        means, variance, counts = quantize_by_period(SUMMER_ON_PEAK)
+        self.assertTrue(means)
+        lower, upper = quantized_intervals(means, variance, counts)
+        sampled = numpy.array([counts[t] for t in means]) > 1
+        self.assertTrue(sampled.any())
+        self.assertTrue((upper - lower)[sampled].min() > 0)
+
+
+class HeatmapStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def append(self, store, day, hour, value, seconds):
+        return store.append(numpy.array([day], dtype="datetime64[D]"),
+                            numpy.array([hour]), numpy.array([value]),
+                            numpy.array([seconds]))
+
+    def test_append_and_reopen(self):
+        store = HeatmapStore(self.directory, "T1")
+        self.assertTrue(self.append(store, "2012-01-01", 3, 1.0, 100))
+        self.assertTrue(self.append(store, "2012-03-01", 4, 2.0, 200))
+        store.save()
+        store = HeatmapStore(self.directory, "T1")
+        self.assertEqual(store.num_days, 61)
+        self.assertEqual(store.high_water, 200)
+        self.assertEqual(store.heatmap[0, 3], 1.0)
+        self.assertEqual(store.heatmap[60, 4], 2.0)
+        self.assertEqual((~store.missing).sum(), 2)
+        self.assertFalse(self.append(store, "2012-03-01", 5, 3.0, 200))
+        with self.assertRaises(ValueError):
+            self.append(store, "2011-12-31", 0, 1.0, 300)
+
+    def test_append_out_of_order(self):
+        store = HeatmapStore(self.directory, "T1")
+        self.append(store, "2012-01-01", 3, 2.0, 200)
+        self.assertTrue(self.append(store, "2012-01-01", 1, 1.0, 100))
+        store.save()
+        store = HeatmapStore(self.directory, "T1")
+        self.assertEqual(store.high_water, 200)
+        numpy.testing.assert_array_equal(store.heatmap[0, :4],
+                                         [0.0, 1.0, 0.0, 2.0])
+
+    def test_saved_pyramid_matches_rebuild(self):
+        store = HeatmapStore(self.directory, "T1")
+        rng = numpy.random.RandomState(0)
+        start = numpy.datetime64("2011-01-20")
+        # The last append rewrites days already in the saved pyramid
+        for i, first_day in enumerate((0, 20, 45, 44)):
+            days = start + numpy.arange(first_day, first_day + 10)
+            store.append(days, rng.randint(0, 24, 10), rng.rand(10),
+                         to_seconds(start) + 1000 * i + numpy.arange(10))
+            store.save()
+            pyramid = HeatmapStore(self.directory, "T1").pyramid()
+            expected = build_pyramid(store.heatmap, store.missing, start)
+            for key in expected:
+                numpy.testing.assert_allclose(pyramid[key], expected[key])
+
+
+class PyramidTest(SimpleTestCase):
+
+    def test_week_and_month_bins(self):
+        heatmap = numpy.arange(40 * 24, dtype=float).reshape(40, 24)
+        missing = numpy.zeros((40, 24), dtype=bool)
+        missing[35:] = True
+        pyramid = build_pyramid(heatmap, missing, "2011-01-25")
+        numpy.testing.assert_array_equal(pyramid["week_offsets"],
+                                         [0, 7, 14, 21, 28, 35])
+        numpy.testing.assert_array_equal(pyramid["month_offsets"], [0, 7, 35])
+        numpy.testing.assert_array_equal(pyramid["week_max"][4],
+                                         heatmap[34])
+        numpy.testing.assert_array_equal(pyramid["week_mean"][5], 0.0)
+        numpy.testing.assert_array_equal(pyramid["month_min"][1], heatmap[7])
+        numpy.testing.assert_array_equal(pyramid["month_mean"][0],
+                                         heatmap[:7].mean(axis=0))
+
+    def test_update_reuses_earlier_bins(self):
+        rng = numpy.random.RandomState(1)
+        heatmap = rng.rand(70, 24)
+        missing = rng.rand(70, 24) < 0.2
+        previous = build_pyramid(heatmap[:50], missing[:50], "2011-03-10")
+        heatmap[48:] += 1
+        updated = update_pyramid(previous, heatmap, missing, "2011-03-10",
+                                 48)
+        expected = build_pyramid(heatmap, missing, "2011-03-10")
+        for key in expected:
+            numpy.testing.assert_allclose(updated[key], expected[key])
+
+    def test_pyramid_heatmap_levels(self):
+        heatmap = numpy.ones((400, 24))
+        pyramid = build_pyramid(heatmap, heatmap == 0, "2011-01-01")
+        level, rows, offsets = pyramid_heatmap(pyramid, heatmap, 12)
+        self.assertEqual(level, "month")
+        self.assertEqual(len(rows), len(offsets))
+        level, rows, offsets = pyramid_heatmap(pyramid, heatmap, 100)
+        self.assertEqual((level, len(rows)), ("day", 400))
+        self.assertIsNone(offsets)
+
+
+class DailyProfilesTest(SimpleTestCase):
+
+    def rows(self, meter_id, day, values):
+        return numpy.column_stack((numpy.full(len(values), meter_id),
+                                   numpy.full(len(values), day),
+                                   numpy.arange(len(values)), values))
+
+    def test_keeps_complete_days(self):
+        day = TO_DAYS_EPOCH + 15000
+        rows = numpy.concatenate((self.rows(1, day, numpy.ones(24)),
+                                  self.rows(1, day + 1, numpy.ones(23)),
+                                  self.rows(2, day, numpy.arange(24.0)),
+                                  self.rows(3, day, numpy.zeros(24))))
+        meter_ids, days, profiles, dropped = daily_profiles(rows)
+        numpy.testing.assert_array_equal(meter_ids, [1, 2])
+        self.assertEqual(days[0], numpy.datetime64(15000, "D"))
+        self.assertEqual(dropped, 2)
+        numpy.testing.assert_allclose(profiles.sum(axis=1), 1.0)
+        meter_ids, days, profiles, dropped = daily_profiles(rows, "max")
+        self.assertEqual(profiles[1].max(), 1.0)
+
+    def test_drops_flagged_days(self):
+        day = TO_DAYS_EPOCH + 15000
+        flags = QualityFlagIndex.from_intervals(
+            [1], [numpy.datetime64(15000, "D")],
+            [numpy.datetime64(15000, "D")])
+        rows = numpy.concatenate((self.rows(1, day, numpy.ones(24)),
+                                  self.rows(1, day + 1, numpy.ones(24))))
+        meter_ids, days, profiles, dropped = daily_profiles(rows, flags=flags)
+        numpy.testing.assert_array_equal(days, [numpy.datetime64(15001, "D")])
+        self.assertEqual(dropped, 1)
+
+
+class ClusterProfilesTest(SyntheticDatabaseTestCase):
+
+    def test_chunks_do_not_split_days(self):
+        flags = QualityFlagIndex.from_intervals([], [], [])
+        whole = cluster_profiles("2011-05-01", "2011-05-07", clusters=3,
+                                 batch_size=16, flags=flags)
+        chunked = cluster_profiles("2011-05-01", "2011-05-07", clusters=3,
+                                   batch_size=16, flags=flags, chunk_size=50)
+        self.assertGreater(int(whole["profiles"]), 3)
+        self.assertEqual(whole["sizes"].sum(), whole["profiles"])
+        self.assertEqual(whole["histograms"].sum(), whole["profiles"])
+        for key in whole:
+            numpy.testing.assert_allclose(chunked[key], whole[key])
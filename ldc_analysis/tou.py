@@ -0,0 +1,71 @@
+"""
+Ontario Time-of-Use (TOU) pricing periods used to classify hourly readings.
+
+@author: r24mille
+"""
+import datetime
+
+import numpy
+
+from ldc_analysis.holidays import HOLIDAYS
+
+
+# PKs of the r24mille_tou_period_codes table for summer (May - Oct) weekdays
+SUMMER_MORNING_OFF_PEAK = 1
+SUMMER_NIGHT_OFF_PEAK = 2
+SUMMER_ON_PEAK = 5
+SUMMER_MORNING_MID_PEAK = 8
+SUMMER_EVENING_MID_PEAK = 9
+
+# TOU period of each hour-of-day on a summer weekday
+SUMMER_WEEKDAY_PERIODS = numpy.array([SUMMER_MORNING_OFF_PEAK] * 7 +
+                                     [SUMMER_MORNING_MID_PEAK] * 4 +
+                                     [SUMMER_ON_PEAK] * 6 +
+                                     [SUMMER_EVENING_MID_PEAK] * 2 +
+                                     [SUMMER_NIGHT_OFF_PEAK] * 5)
+SUMMER_MONTHS = (5, 6, 7, 8, 9, 10)
+
+# Plot title of each summer TOU period
+SUMMER_PERIOD_TITLES = {SUMMER_MORNING_OFF_PEAK: "Summer Morning Off-Peak",
+                        SUMMER_MORNING_MID_PEAK: "Summer Morning Mid-Peak",
+                        SUMMER_ON_PEAK: "Summer On-Peak",
+                        SUMMER_EVENING_MID_PEAK: "Summer Evening Mid-Peak",
+                        SUMMER_NIGHT_OFF_PEAK: "Summer Night Off-Peak"}
+
+# Readings on or after this date were billed with TOU prices. Any date
+# between the pre-TOU (2011) and post-TOU (2012) summers classifies the
+# summer periods identically.
+TOU_BILLING_START = datetime.datetime(2011, 11, 1)
+
+
+def date_keys(dates):
+    """
+    Returns an integer YYYYMMDD key for each date.
+
+    Arguments:
+    dates -- Iterable of datetime.date objects.
+    """
+    return numpy.array([d.year * 10000 + d.month * 100 + d.day
+                        for d in dates], dtype=numpy.int64)
+
+
+HOLIDAY_KEYS = date_keys(HOLIDAYS)
+
+
+def classify_periods(day_keys, weekdays, hours):
+    """
+    Returns the TOU period id of each reading, 0 for readings outside the
+    defined periods (winter, weekends and holidays).
+
+    Arguments:
+    day_keys -- Integer YYYYMMDD date of each reading.
+    weekdays -- Day of week of each reading, 0 for Monday to 6 for Sunday.
+    hours -- Hour-of-day of each reading.
+    """
+    day_keys = numpy.asarray(day_keys, dtype=numpy.int64)
+    months = day_keys // 100 % 100
+    business_day = (numpy.asarray(weekdays) < 5) & \
+        ~numpy.isin(day_keys, HOLIDAY_KEYS)
+    summer = numpy.isin(months, SUMMER_MONTHS)
+    periods = SUMMER_WEEKDAY_PERIODS[numpy.asarray(hours, dtype=numpy.intp)]
+    return numpy.where(business_day & summer, periods, 0)
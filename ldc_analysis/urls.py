@@ -8,5 +8,13 @@ urlpatterns = patterns('',
     # url(r'^$', 'ldc_analysis.views.home', name='home'),
     # url(r'^blog/', include('blog.urls')),
 
+    url(r'^heatmap/transformer/(?P<transformer_id>[\w.-]+)\.png$',
+        'transformer_demand.views.transformer_heatmap',
+        name='transformer_heatmap'),
+    url(r'^heatmap/zone/(?P<zone>\w+)\.png$',
+        'zonal_demand.views.zone_heatmap', name='zone_heatmap'),
+    url(r'^tou/period/(?P<period_id>\d+)\.png$',
+        'ldc_analysis.views.tou_period_comparison',
+        name='tou_period_comparison'),
     url(r'^admin/', include(admin.site.urls)),
 )
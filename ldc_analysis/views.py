@@ -0,0 +1,199 @@
+"""
+On-demand PNG views of heatmaps and TOU comparisons.
+
+Each view looks up the latest timestamp of the data behind its image. That
+timestamp becomes the response's Last-Modified header and, together with the
+image's parameters, its ETag, so a dashboard that revalidates gets a 304
+without any heatmap being queried or drawn. Otherwise the arrays are read
+from RESULT_CACHE and the PNG from IMAGE_CACHE, both keyed by the same
+timestamp so new data yields new entries and stale ones age out of the
+size-bounded caches.
+
+@author: r24mille
+"""
+import calendar
+import io
+import os
+import threading
+
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+    HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+import numpy
+
+from ldc_analysis.aggregate import plot_quantized_comparison, \
+    quantize_by_period
+from ldc_analysis.cache import RESULT_CACHE, ResultCache
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.pyramid import STATISTICS, build_pyramid, pyramid_heatmap
+from ldc_analysis.quantize import quantized_state
+from ldc_analysis.render import render_heatmap, select_backend
+from ldc_analysis.tou import SUMMER_PERIOD_TITLES
+
+
+IMAGE_CACHE = ResultCache(os.environ.get("LDC_IMAGE_CACHE_DIR",
+                                         "./cache/images/"),
+                          max_bytes=256 * 1024 ** 2)
+
+# pyplot keeps global state, figures are drawn one at a time per process
+_PYPLOT_LOCK = threading.Lock()
+
+
+def latest_timestamp(connection_name, sql, params=()):
+    """
+    Returns the datetime.datetime selected by a single-value query (eg. a
+    max() of a timestamp column) or None if it is NULL.
+    """
+    cursor = connections[connection_name].cursor()
+    cursor.execute(sql, params)
+    value = cursor.fetchone()[0]
+    return None if value is None else parse_datetime(value)
+
+
+def cached_arrays(name, last_modified, compute):
+    """
+    Returns the dictionary of numpy arrays computed by compute(), reusing
+    the RESULT_CACHE entry of the same name and data timestamp.
+    """
+    key = RESULT_CACHE.make_key("view", name, str(last_modified))
+    arrays = RESULT_CACHE.get(key)
+    if arrays is None:
+        arrays = compute()
+        RESULT_CACHE.put(key, arrays)
+    return arrays
+
+
+def draw_png(draw):
+    """
+    Returns the PNG bytes saved by draw(file_object), holding the pyplot
+    lock while drawing. Selects the Agg backend first when the server has
+    no display, see render.select_backend.
+    """
+    buffer = io.BytesIO()
+    with _PYPLOT_LOCK:
+        select_backend()
+        draw(buffer)
+    return buffer.getvalue()
+
+
+def _not_modified(request, etag, last_modified):
+    """
+    Returns True if the request's If-None-Match or If-Modified-Since headers
+    show the client already holds this version of the image.
+    """
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE",
+                                                  ""))
+    return since is not None and last_modified <= since
+
+
+def png_response(request, name, last_modified, draw):
+    """
+    Returns an image/png HttpResponse, or a 304 if the client's copy is
+    current, with ETag and Last-Modified derived from the data timestamp.
+
+    Arguments:
+    request -- HttpRequest.
+    name -- Tuple identifying the image and its parameters.
+    last_modified -- datetime.datetime of the newest data in the image.
+    draw -- Callable returning the PNG bytes, only called on a cache miss.
+    """
+    key = IMAGE_CACHE.make_key(name, str(last_modified))
+    etag = quote_etag(key)
+    # Data timestamps are naive, they are sent as if they were UTC
+    modified = calendar.timegm(last_modified.timetuple())
+    if _not_modified(request, etag, modified):
+        response = HttpResponseNotModified()
+    else:
+        arrays = IMAGE_CACHE.get(key)
+        if arrays is None:
+            png = draw()
+            IMAGE_CACHE.put(key, {"png": numpy.frombuffer(png,
+                                                          dtype=numpy.uint8)})
+        else:
+            png = arrays["png"].tobytes()
+        response = HttpResponse(png, content_type="image/png")
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(modified)
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
+
+
+def heatmap_response(request, name, last_modified, compute, title):
+    """
+    Returns a png_response of a day x hour heatmap. The optional height
+    query parameter (pixels) draws the coarsest week or month level of the
+    heatmap's pyramid that still has a row per pixel, reduced by the stat
+    query parameter (mean, max or min, defaults to mean).
+
+    Arguments:
+    request -- HttpRequest.
+    name -- Tuple identifying the heatmap and its parameters.
+    last_modified -- datetime.datetime of the newest reading in the heatmap.
+    compute -- Callable returning the tuple of build_heatmap, only called if
+               the arrays are not cached.
+    title -- Title of plot.
+    """
+    try:
+        height = int(request.GET["height"]) if request.GET.get("height") \
+            else None
+    except ValueError:
+        height = 0
+    statistic = request.GET.get("stat", "mean")
+    if (height is not None and height <= 0) or statistic not in STATISTICS:
+        return HttpResponseBadRequest("height must be a positive number of "
+                                      "pixels and stat one of " +
+                                      ", ".join(STATISTICS))
+
+    def heatmap_arrays():
+        heatmap, missing, start_date, end_date = compute()
+        arrays = build_pyramid(heatmap, missing, start_date)
+        arrays.update({"heatmap": heatmap,
+                       "start_date": numpy.datetime64(start_date, "D"),
+                       "end_date": numpy.datetime64(end_date, "D")})
+        return arrays
+
+    def draw():
+        arrays = cached_arrays(("pyramid",) + name, last_modified,
+                               heatmap_arrays)
+        level, rows, offsets = pyramid_heatmap(arrays, arrays["heatmap"],
+                                               height, statistic)
+        return draw_png(lambda buffer: render_heatmap(
+            buffer, rows, arrays["start_date"].astype(object),
+            arrays["end_date"].astype(object), title, offsets=offsets))
+
+    return png_response(request, name + (height, statistic), last_modified,
+                        draw)
+
+
+def tou_period_comparison(request, period_id):
+    """
+    Serves the pre- and post-TOU comparison plot of one summer TOU period,
+    see aggregate.plot_quantized_comparison.
+    """
+    period_id = int(period_id)
+    if period_id not in SUMMER_PERIOD_TITLES:
+        raise Http404("Unknown TOU period " + str(period_id))
+    # The quantized table is only written with its high-water mark, the
+    # newest aggregate reading summarized
+    state = quantized_state()
+    if state is None:
+        raise Http404("The quantized readings have not been built")
+    location_id, last_modified = state
+    name = ("tou_period_comparison", period_id, location_id)
+
+    def draw():
+        means, variance, counts = quantize_by_period(period_id)
+        if not means:
+            raise Http404("No quantized readings for TOU period " +
+                          str(period_id))
+        return draw_png(lambda buffer: plot_quantized_comparison(
+            SUMMER_PERIOD_TITLES[period_id], means, variance, counts,
+            buffer))
+
+    return png_response(request, name, last_modified, draw)
@@ -0,0 +1,220 @@
+"""
+In-memory store of hourly weather observations.
+
+WeatherStore loads weathertables.wunderground_observation for one or more
+locations with a single query, sorted by location and time, into flat numpy
+arrays of epoch seconds and temperatures with an offset per location. Demand
+timestamps are aligned to a location's observations with numpy.searchsorted,
+by exact timestamp (as the former SQL join), nearest observation or linear
+interpolation. The arrays are cached with cached_result until an observation
+is added, and kept per process, so the cross-database join no longer runs on
+every analysis query.
+
+@author: r24mille
+"""
+import threading
+
+from django.db import connections
+import numpy
+
+from ldc_analysis.cache import cached_result, source_stamp
+from ldc_analysis.query import TO_DAYS_EPOCH
+
+
+# Range of rounded outdoor temperatures (Celsius) held by streaming summaries
+MIN_TEMPERATURE = -60
+MAX_TEMPERATURE = 60
+
+WEATHER_SOURCES = [("weathertables.wunderground_observation",
+                    "max(observation_datetime_standard)")]
+
+SECONDS_PER_DAY = 86400
+METHODS = ("exact", "nearest", "linear")
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def epoch_seconds_sql(column):
+    """
+    Returns a SQL expression of a DATETIME column as seconds since
+    1970-01-01, independent of the session time zone.
+    """
+    return ("(to_days(" + column + ") - " + str(TO_DAYS_EPOCH) + ") * " +
+            str(SECONDS_PER_DAY) + " + time_to_sec(" + column + ")")
+
+
+def round_temperatures(temperatures):
+    """
+    Returns temperatures rounded half away from zero like MySQL ROUND(), as
+    an intp array. NaN must be removed beforehand.
+    """
+    temperatures = numpy.asarray(temperatures, dtype=numpy.float64)
+    return (numpy.sign(temperatures) *
+            numpy.floor(numpy.abs(temperatures) + 0.5)).astype(numpy.intp)
+
+
+def check_temperatures(temperatures):
+    """
+    Raises ValueError if a rounded temperature is outside of
+    MIN_TEMPERATURE to MAX_TEMPERATURE.
+    """
+    if temperatures.size and (temperatures.min() < MIN_TEMPERATURE or
+                              temperatures.max() > MAX_TEMPERATURE):
+        raise ValueError("Temperature outside of " + str(MIN_TEMPERATURE) +
+                         " to " + str(MAX_TEMPERATURE) + " Celsius")
+
+
+class WeatherStore(object):
+    """
+    Observations of several locations, sorted by location then time. The
+    observations of locations[i] span offsets[i]:offsets[i + 1] of seconds
+    and temperatures. Observations without a temperature are left out.
+    """
+
+    def __init__(self, locations, offsets, seconds, temperatures):
+        """
+        Arguments:
+        locations -- Sorted int64 array of location_ids.
+        offsets -- intp array of len(locations) + 1 offsets.
+        seconds -- int64 array of observation times, seconds since
+                   1970-01-01.
+        temperatures -- float64 array of temp_metric.
+        """
+        self.locations = locations
+        self.offsets = offsets
+        self.seconds = seconds
+        self.temperatures = temperatures
+
+    @classmethod
+    def load(cls, location_ids, connection_name="ldc"):
+        """
+        Returns the store of every observation of location_ids, computed
+        with one query and cached until an observation is added.
+
+        Arguments:
+        location_ids -- Iterable of weathertables.location ids.
+        connection_name -- (Optional) Django database alias. Defaults to
+                           "ldc".
+        """
+        locations = sorted(set(int(l) for l in location_ids))
+
+        def compute():
+            cursor = connections[connection_name].cursor()
+            cursor.execute("select location_id, " +
+                           epoch_seconds_sql("observation_datetime_standard") +
+                           ", temp_metric "
+                           "from weathertables.wunderground_observation "
+                           "where temp_metric is not null and location_id "
+                           "in (" + ", ".join(["%s"] * len(locations)) + ") "
+                           "order by location_id, "
+                           "observation_datetime_standard", locations)
+            rows = numpy.array(cursor.fetchall(),
+                               dtype=numpy.float64).reshape(-1, 3)
+            bounds = numpy.append(locations, numpy.iinfo(numpy.int64).max)
+            return {"locations": numpy.array(locations, dtype=numpy.int64),
+                    "offsets": numpy.searchsorted(
+                        rows[:, 0].astype(numpy.int64), bounds),
+                    "seconds": rows[:, 1].astype(numpy.int64),
+                    "temperatures": rows[:, 2]}
+
+        if not locations:
+            raise ValueError("No location_ids given")
+        arrays = cached_result("weather_store", tuple(locations),
+                               WEATHER_SOURCES, compute, connection_name)
+        return cls(arrays["locations"], arrays["offsets"], arrays["seconds"],
+                   arrays["temperatures"])
+
+    def observations(self, location_id):
+        """
+        Returns the (seconds, temperatures) arrays of a location.
+
+        Arguments:
+        location_id -- weathertables.location id held by the store.
+        """
+        i = numpy.searchsorted(self.locations, location_id)
+        if i == len(self.locations) or self.locations[i] != location_id:
+            raise KeyError("Location " + str(location_id) + " is not loaded")
+        span = slice(self.offsets[i], self.offsets[i + 1])
+        return self.seconds[span], self.temperatures[span]
+
+    def align(self, location_id, seconds, method="exact", tolerance=None):
+        """
+        Returns the float64 temperature of location_id at each timestamp,
+        NaN where none matches.
+
+        Arguments:
+        location_id -- weathertables.location id held by the store.
+        seconds -- array_like of timestamps, seconds since 1970-01-01 (see
+                   epoch_seconds_sql).
+        method -- (Optional) "exact" for an observation at the same second,
+                  "nearest" for the closest observation or "linear" to
+                  interpolate between the surrounding observations. Defaults
+                  to "exact".
+        tolerance -- (Optional) Largest distance in seconds to the matched
+                     observation ("nearest") or to either surrounding
+                     observation ("linear"). Defaults to no limit.
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown method " + str(method))
+        times, temperatures = self.observations(location_id)
+        seconds = numpy.asarray(seconds, dtype=numpy.float64)
+        aligned = numpy.full(seconds.shape, numpy.nan)
+        if len(times) == 0:
+            return aligned
+
+        right = numpy.searchsorted(times, seconds, side="left")
+        after = numpy.minimum(right, len(times) - 1)
+        before = numpy.maximum(right - 1, 0)
+        if method == "exact":
+            matched = times[after] == seconds
+            aligned[matched] = temperatures[after[matched]]
+            return aligned
+
+        before_distance = numpy.abs(seconds - times[before])
+        after_distance = numpy.abs(times[after] - seconds)
+        if method == "nearest":
+            nearest = numpy.where(after_distance < before_distance, after,
+                                  before)
+            distance = numpy.minimum(before_distance, after_distance)
+            aligned = temperatures[nearest]
+        else:
+            inside = (seconds >= times[0]) & (seconds <= times[-1])
+            aligned[inside] = numpy.interp(seconds[inside], times,
+                                           temperatures)
+            distance = numpy.where(times[after] == seconds, 0.0,
+                                   numpy.maximum(before_distance,
+                                                 after_distance))
+        if tolerance is not None:
+            aligned[distance > tolerance] = numpy.nan
+        return aligned
+
+
+def weather_store(location_ids, connection_name="ldc"):
+    """
+    Returns a WeatherStore of location_ids kept in memory for the calls of
+    this process, reloaded when an observation is added.
+
+    Arguments:
+    location_ids -- Iterable of weathertables.location ids.
+    connection_name -- (Optional) Django database alias. Defaults to "ldc".
+    """
+    key = (connection_name, tuple(sorted(set(int(l) for l in location_ids))))
+    stamp = source_stamp(WEATHER_SOURCES, connection_name)
+    with _STORES_LOCK:
+        cached = _STORES.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    store = WeatherStore.load(key[1], connection_name)
+    with _STORES_LOCK:
+        _STORES[key] = (stamp, store)
+    return store
+
+
+def clear_weather_stores():
+    """
+    Drops the WeatherStores kept in memory by weather_store, so the next call
+    loads them again.
+    """
+    with _STORES_LOCK:
+        _STORES.clear()
@@ -0,0 +1,146 @@
+"""
+Bulk loading of TransformerLoad timeseries for many transformers at once.
+
+@author: r24mille
+"""
+import itertools
+import os
+
+import numpy
+
+from ldc_analysis.heatmap import build_heatmap
+from ldc_analysis.heatmap_store import HEATMAP_DIR, HeatmapStore, \
+    oldest_mark, to_seconds
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.models import TransformerLoad
+from ldc_analysis.profiling import timer
+
+
+def group_offsets(keys):
+    """
+    Returns the boundary offsets of runs of equal values in a sorted array.
+    Group i spans keys[offsets[i]:offsets[i + 1]].
+
+    Arguments:
+    keys -- Sorted 1D numpy array of group keys.
+    """
+    boundaries = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return numpy.concatenate(([0], boundaries, [len(keys)]))
+
+
+def iter_transformer_heatmaps(transformers, chunk_size=100000,
+                              start_date=None, end_date=None):
+    """
+    Generator yielding (TransformerID, heatmap) tuples, where heatmap is the
+    tuple returned by build_heatmap, for every transformer that has
+    TransformerLoad rows. All loads are fetched in a single query ordered by
+    TransformerID and streamed in chunks, so only about chunk_size rows are
+    held in memory at a time. Transformers without loads are not yielded.
+
+    Arguments:
+    transformers -- QuerySet of Transformer objects to load.
+    chunk_size -- (Optional) Number of rows converted to arrays per chunk.
+                  Defaults to 100000.
+    start_date -- (Optional) First ReadDate (inclusive), see
+                  holidays.parse_datetime. Defaults to the first load.
+    end_date -- (Optional) Last ReadDate (inclusive). Defaults to the last
+                load.
+    """
+    loads = TransformerLoad.objects.using("ldc") \
+        .filter(Transformer__in=transformers)
+    if start_date is not None:
+        loads = loads.filter(ReadDate__gte=parse_datetime(start_date).date())
+    if end_date is not None:
+        loads = loads.filter(ReadDate__lte=parse_datetime(end_date).date())
+    loads = loads.order_by("Transformer") \
+        .values_list("Transformer", "ReadDate", "Interval", "LoadMW")
+    rows = loads.iterator()
+
+    pending = []
+    exhausted = False
+    while not exhausted:
+        fetched = list(itertools.islice(rows, chunk_size))
+        exhausted = len(fetched) < chunk_size
+        chunk = pending + fetched
+        if not chunk:
+            break
+
+        with timer("transformer_loads.convert"):
+            transformer_ids, read_dates, hours, values = zip(*chunk)
+            transformer_ids = numpy.array(transformer_ids)
+            read_dates = numpy.array(read_dates, dtype="datetime64[D]")
+            hours = numpy.array(hours, dtype=numpy.intp)
+            values = numpy.array(values, dtype=numpy.float64)
+        offsets = group_offsets(transformer_ids)
+
+        # The last group may continue in the next chunk, hold it back
+        complete = len(offsets) - 1 if exhausted else len(offsets) - 2
+        for i in range(complete):
+            start, end = offsets[i], offsets[i + 1]
+            yield (str(transformer_ids[start]),
+                   build_heatmap(read_dates[start:end],
+                                 hours[start:end],
+                                 values[start:end]))
+        pending = chunk[offsets[complete]:]
+
+
+def update_transformer_heatmaps(transformers, directory=None,
+                                chunk_size=100000):
+    """
+    Appends the TransformerLoad rows newer than each transformer's persisted
+    heatmap (see heatmap_store.HeatmapStore) and returns a list of
+    (TransformerID, HeatmapStore) tuples of the heatmaps that changed,
+    sorted by TransformerID. A single query reads the loads
+    after the oldest high-water mark, a transformer without a persisted
+    heatmap is built from its first load.
+
+    Arguments:
+    transformers -- QuerySet of Transformer objects to update.
+    directory -- (Optional) Directory of the heatmap files. Defaults to
+                 <HEATMAP_DIR>/transformers/.
+    chunk_size -- (Optional) Number of rows converted to arrays per chunk.
+                  Defaults to 100000.
+    """
+    if directory is None:
+        directory = os.path.join(HEATMAP_DIR, "transformers")
+    stores = dict((str(transformer_id), HeatmapStore(directory,
+                                                     str(transformer_id)))
+                  for transformer_id in transformers.values_list(
+                      "TransformerID", flat=True))
+    loads = TransformerLoad.objects.using("ldc") \
+        .filter(Transformer__in=transformers)
+    mark = oldest_mark(stores.values())
+    if mark is not None:
+        loads = loads.filter(reading_datetime_standard__gt=mark)
+    rows = loads.order_by("Transformer", "reading_datetime_standard") \
+        .values_list("Transformer", "ReadDate", "Interval", "LoadMW",
+                     "reading_datetime_standard").iterator()
+
+    changed = set()
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        with timer("transformer_loads.convert"):
+            transformer_ids, read_dates, hours, values, timestamps = \
+                zip(*chunk)
+            transformer_ids = numpy.array(transformer_ids)
+            read_dates = numpy.array(read_dates, dtype="datetime64[D]")
+            hours = numpy.array(hours, dtype=numpy.intp)
+            values = numpy.array(values, dtype=numpy.float64)
+            seconds = to_seconds(timestamps)
+        # A transformer split between chunks is simply appended twice
+        offsets = group_offsets(transformer_ids)
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            transformer_id = str(transformer_ids[start])
+            if stores[transformer_id].append(read_dates[start:end],
+                                             hours[start:end],
+                                             values[start:end],
+                                             seconds[start:end]):
+                changed.add(transformer_id)
+
+    for transformer_id in changed:
+        stores[transformer_id].save()
+    return [(transformer_id, stores[transformer_id])
+            for transformer_id in sorted(changed)]
+
@@ -0,0 +1,50 @@
+"""
+Ranks transformers by how often their loads exceed their KVA ratings.
+
+    python manage.py utilization --area A1-TEC --threshold 1.0
+
+@author: r24mille
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from ldc_analysis.management.base import AnalysisCommand
+from ldc_analysis.models import Transformer
+from transformer_demand.utilization import utilization_scan, write_report
+
+
+class Command(AnalysisCommand):
+    help = "Writes a CSV report of transformer utilization to " \
+        "./figures/utilization/<area>.csv."
+    option_list = AnalysisCommand.option_list + (
+        make_option("--area", default="A1-TEC",
+                    help="AreaTown of the transformers. Defaults to A1-TEC."),
+        make_option("--threshold", type="float", default=1.0,
+                    help="Utilization counted as an overload. Defaults to "
+                         "1.0."),
+        make_option("--window", type="int", default=4,
+                    help="Hours per block. Defaults to 4."),
+        make_option("--power-factor", type="float", default=1.0,
+                    dest="power_factor",
+                    help="Ratio of real to apparent power. Defaults to 1.0."),
+        make_option("--output", default=None,
+                    help="Path of the CSV report. Defaults to "
+                         "./figures/utilization/<area>.csv."),
+    )
+
+    def handle(self, *args, **options):
+        if not 1 <= options["window"] <= 24:
+            raise CommandError("--window must be 1 to 24 hours")
+        if not 0 < options["power_factor"] <= 1:
+            raise CommandError("--power-factor must be in (0, 1]")
+        transformers = Transformer.objects.using("ldc").filter(
+            Enabled=True, AreaTown=options["area"])
+        scan = utilization_scan(transformers, threshold=options["threshold"],
+                                window=options["window"],
+                                power_factor=options["power_factor"])
+        path = options["output"] or \
+            "./figures/utilization/" + options["area"] + ".csv"
+        write_report(path, scan)
+        self.stdout.write("ranked " + str(len(scan["transformer_ids"])) +
+                          " transformers to " + path)
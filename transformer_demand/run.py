@@ -1,60 +1,73 @@
 #!/usr/bin/env python
 import os
+import sys
 
-import matplotlib
+import numpy
 
 from ldc_analysis.models import Transformer
-import matplotlib.pyplot as plt
-import numpy as np
+from ldc_analysis.pyramid import pyramid_heatmap
+from ldc_analysis.render import render_heatmaps
+from transformer_demand.loads import iter_transformer_heatmaps, \
+    update_transformer_heatmaps
+
+
+def heatmap_jobs(transformers, phaseStr, areaStr, start_date=None,
+                 end_date=None):
+    """
+    Generator of render_heatmaps jobs, one per transformer with
+    TransformerLoad items between the optional dates, written to
+    ./figures/<phase>-phase/<area>/.
+    """
+    figure_dir = "./figures/" + phaseStr + "-phase/" + areaStr + "/"
+    for transformer_id, heatmap in iter_transformer_heatmaps(
+            transformers, start_date=start_date, end_date=end_date):
+        load_heatmap, missing_hours, start_date, end_date = heatmap
+        yield (figure_dir + transformer_id + ".png", load_heatmap,
+               start_date, end_date, "Transformer ID: " + transformer_id)
+
+
+def update_jobs(transformers, phaseStr, areaStr, directory=None,
+                max_rows=None):
+    """
+    Returns render_heatmaps jobs of only the transformers whose persisted
+    heatmap received new TransformerLoad rows, see
+    update_transformer_heatmaps. With max_rows, heatmaps are drawn from the
+    coarsest pyramid level still having max_rows rows.
+    """
+    figure_dir = "./figures/" + phaseStr + "-phase/" + areaStr + "/"
+    jobs = []
+    for transformer_id, store in update_transformer_heatmaps(transformers,
+                                                             directory):
+        heatmap, offsets = store.heatmap, None
+        if max_rows is not None:
+            level, heatmap, offsets = pyramid_heatmap(store.pyramid(),
+                                                      heatmap, max_rows)
+        jobs.append((figure_dir + transformer_id + ".png",
+                     numpy.array(heatmap), store.start_day.astype(object),
+                     store.end_day.astype(object),
+                     "Transformer ID: " + transformer_id, None, None,
+                     offsets))
+    return jobs
 
 
 if __name__ == "__main__":
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
-    
+
+    # Number of rendering processes, defaults to the number of CPUs. With
+    # --update only loads newer than the persisted heatmaps are read.
+    update = "--update" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--update"]
+    processes = int(args[0]) if args else None
+
     # Get timeseries of TransformerLoad associated with a Transformer
     phaseStr = "1"
     areaStr = "A1-TEC"
     transformers = Transformer.objects.using('ldc').filter(Phases=phaseStr, Enabled=True, AreaTown=areaStr)
-    
-    fignum = 1
-    for transformer in transformers:
-        demands = transformer.transformerload_set.all()
-        
-        # Transformer must have TransformerLoad items
-        if len(demands) > 0:
-            # Find the length of the results to know first and last index, then get the number of days
-            num_loads = len(demands)
-            start_date = demands[0].ReadDate
-            end_date = demands[num_loads - 1].ReadDate
-            num_days = (end_date - start_date).days
-        
-            # Create an n x 24 matrix to hold each hour's values and zeros for hours without value
-            load_heatmap = np.zeros(((num_days + 1), 24))
-            
-            # Loop over all TransformerLoad rows returned and populate them into the proper array slot
-            for zonalDemand in demands:
-                d = (zonalDemand.ReadDate - start_date).days
-                load_heatmap[d][zonalDemand.Interval] = zonalDemand.LoadMW
-            
-            # Plot the timeseries matrix as a heatmap
-            start_datenum = matplotlib.dates.date2num(start_date)
-            end_datenum = matplotlib.dates.date2num(end_date)
-            fig = plt.figure(fignum)
-            ax = plt.subplot()
-            plt.subplots_adjust(left=0.2, bottom=None, right=1, top=None,
-                wspace=None, hspace=None)
-            im = ax.imshow(load_heatmap, interpolation='none', aspect='auto', extent=(0, 24, start_datenum, end_datenum), origin='lower')
-            ax.yaxis_date()
-            ax.set_title("Transformer ID: " + transformer.TransformerID)
-            ax.set_xlabel("Hour of Day")
-            ax.set_ylabel("Day of Year")
-            ax.xaxis.set_ticks(range(0, 24, 2))
-            cb = fig.colorbar(im)
-            cb.set_label("Kilowatt-hours (kWh)")
-            plt.savefig("./figures/" + phaseStr + "-phase/" + areaStr + "/" + transformer.TransformerID + ".png", dpi=100)
-            plt.close(fignum)
-            
-            # Increase fignum
-            fignum = fignum + 1
-    
-    plt.show()
+
+    # Plot each timeseries matrix as a heatmap, skipping unchanged figures
+    if update:
+        jobs = update_jobs(transformers, phaseStr, areaStr)
+    else:
+        jobs = heatmap_jobs(transformers, phaseStr, areaStr)
+    rendered = render_heatmaps(jobs, processes=processes)
+    print("rendered", len(rendered), "figures")
@@ -1,3 +1,66 @@
-from django.test import TestCase
+import collections
 
-# Create your tests here.
+from django.test import SimpleTestCase
+import numpy
+
+from benchmarks.testcases import SyntheticDatabaseTestCase
+from ldc_analysis.models import Transformer, TransformerLoad
+from transformer_demand.utilization import utilization_scan, window_means
+
+
+class WindowMeansTest(SimpleTestCase):
+
+    def test_means_of_consecutive_hours(self):
+        hourly = numpy.array([[1.0, 2.0, 3.0, 4.0],
+                              [1.0, numpy.nan, 3.0, 5.0]])
+        numpy.testing.assert_array_equal(
+            window_means(hourly, 2),
+            [[1.5, 2.5, 3.5], [numpy.nan, numpy.nan, 4.0]])
+        numpy.testing.assert_array_equal(window_means(hourly, 4),
+                                         [[2.5], [numpy.nan]])
+
+    def test_window_longer_than_the_day(self):
+        self.assertEqual(window_means(numpy.ones((3, 2)), 4).shape, (3, 0))
+
+
+class UtilizationScanTest(SyntheticDatabaseTestCase):
+
+    def expected(self, threshold, window):
+        """Returns per-transformer statistics computed row by row."""
+        kva = dict(Transformer.objects.using("ldc")
+                   .values_list("TransformerID", "KVA"))
+        daily = collections.defaultdict(dict)
+        for transformer_id, read_date, interval, load in \
+                TransformerLoad.objects.using("ldc").values_list(
+                    "Transformer", "ReadDate", "Interval", "LoadMW"):
+            daily[transformer_id, read_date][interval] = \
+                load * 1000.0 / kva[transformer_id]
+        stats = collections.defaultdict(lambda: [0, 0, 0, 0, -1.0])
+        for (transformer_id, _), ratios in daily.items():
+            stat = stats[transformer_id]
+            stat[0] += len(ratios)
+            stat[1] += sum(ratio > threshold for ratio in ratios.values())
+            stat[2] += 1
+            blocks = [sum(ratios[hour + i] for i in range(window)) / window
+                      for hour in range(24 - window + 1)
+                      if all(hour + i in ratios for i in range(window))]
+            stat[3] += bool(blocks) and max(blocks) > threshold
+            stat[4] = max(stat[4], max(ratios.values()))
+        return stats
+
+    def test_matches_row_by_row_scan(self):
+        transformers = Transformer.objects.using("ldc").all()
+        expected = self.expected(0.8, 4)
+        for chunk_size in (50, 100000):
+            result = utilization_scan(transformers, threshold=0.8, window=4,
+                                      chunk_size=chunk_size)
+            self.assertEqual(len(result["transformer_ids"]), len(expected))
+            for i, transformer_id in enumerate(result["transformer_ids"]):
+                hours, exceeded_hours, days, exceeded_days, peak = \
+                    expected[transformer_id]
+                self.assertEqual(result["hours"][i], hours)
+                self.assertEqual(result["exceeded_hours"][i], exceeded_hours)
+                self.assertEqual(result["days"][i], days)
+                self.assertEqual(result["exceeded_days"][i], exceeded_days)
+                self.assertAlmostEqual(result["peak_utilization"][i], peak)
+            self.assertTrue((numpy.diff(result["exceeded_days"]) <= 0).all())
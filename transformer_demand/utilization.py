@@ -0,0 +1,212 @@
+"""
+Fleet-wide utilization of transformers against their KVA ratings.
+
+TransformerLoads is streamed once, ordered by transformer and day. Each row
+finds its rating with a numpy.searchsorted into the sorted TransformerIDs of
+the fleet, so a chunk of loads becomes utilization ratios in one array
+operation. Rows are then laid out as one 24-hour row per (transformer, day)
+and the mean of every window of consecutive hours comes from the difference
+of cumulative sums, giving the worst block of each day without a Python loop
+over days or transformers.
+
+@author: r24mille
+"""
+import csv
+import itertools
+import os
+import sys
+
+import numpy
+
+from ldc_analysis.heatmap import HOURS_PER_DAY
+from ldc_analysis.models import Transformer, TransformerLoad
+from ldc_analysis.profiling import timer
+from transformer_demand.loads import group_offsets
+
+
+# Days are numbered from 1970-01-01, every day fits below DAY_SPAN, so
+# transformer index * DAY_SPAN + day orders rows by transformer then day
+DAY_SPAN = 2 ** 22
+
+REPORT_COLUMNS = ["transformer_id", "kva", "exceeded_days",
+                  "exceeded_hours", "days", "hours", "peak_utilization",
+                  "peak_block_utilization"]
+
+
+def window_means(hourly, window):
+    """
+    Returns the mean of every run of window consecutive columns of a 2D
+    array, NaN for runs including a NaN. The result has
+    hourly.shape[1] - window + 1 columns.
+
+    Arguments:
+    hourly -- 2D numpy array, eg. one row of 24 hourly values per day.
+    window -- Number of consecutive columns averaged.
+    """
+    present = ~numpy.isnan(hourly)
+    sums = numpy.zeros((hourly.shape[0], hourly.shape[1] + 1))
+    numpy.cumsum(numpy.where(present, hourly, 0.0), axis=1, out=sums[:, 1:])
+    counts = numpy.zeros(sums.shape, dtype=numpy.intp)
+    numpy.cumsum(present, axis=1, out=counts[:, 1:])
+    means = (sums[:, window:] - sums[:, :-window]) / window
+    means[counts[:, window:] - counts[:, :-window] < window] = numpy.nan
+    return means
+
+
+def _row_max(values):
+    """Returns the maximum of each row, NaN for rows of only NaN."""
+    if values.shape[1] == 0:
+        return numpy.full(values.shape[0], numpy.nan)
+    filled = numpy.where(numpy.isnan(values), -numpy.inf, values)
+    maxima = filled.max(axis=1)
+    maxima[numpy.isinf(maxima)] = numpy.nan
+    return maxima
+
+
+def utilization_scan(transformers, threshold=1.0, window=4, power_factor=1.0,
+                     chunk_size=100000):
+    """
+    Returns a dictionary of arrays, one entry per transformer with a
+    positive KVA rating, ranked by descending exceeded_days, exceeded_hours
+    and then peak_utilization:
+
+    transformer_ids -- TransformerID.
+    kva -- KVA rating.
+    hours, days -- Number of hourly loads and of days with a load.
+    exceeded_hours -- Hours whose utilization is above threshold.
+    exceeded_days -- Days whose worst window-hour block is above threshold.
+    peak_utilization -- Highest hourly utilization (NaN without loads).
+    peak_block_utilization -- Highest window-hour mean utilization (NaN if
+                              no day has window consecutive hours).
+
+    Utilization is the hourly LoadMW in kVA, at power_factor, divided by the
+    rating.
+
+    Arguments:
+    transformers -- QuerySet of Transformer objects to scan.
+    threshold -- (Optional) Utilization counted as an overload. Defaults to
+                 1.0.
+    window -- (Optional) Hours per block. Defaults to 4.
+    power_factor -- (Optional) Ratio of real to apparent power. Defaults to
+                    1.0.
+    chunk_size -- (Optional) Number of rows converted to arrays per chunk.
+                  Defaults to 100000.
+    """
+    ratings = sorted((str(t), k) for t, k in transformers
+                     .values_list("TransformerID", "KVA") if k and k > 0)
+    transformer_ids = numpy.array([t for t, _ in ratings], dtype=str)
+    kva = numpy.array([k for _, k in ratings], dtype=numpy.float64)
+    count = len(transformer_ids)
+    hours = numpy.zeros(count, dtype=numpy.int64)
+    exceeded_hours = numpy.zeros(count, dtype=numpy.int64)
+    days = numpy.zeros(count, dtype=numpy.int64)
+    exceeded_days = numpy.zeros(count, dtype=numpy.int64)
+    peaks = numpy.full(count, -numpy.inf)
+    block_peaks = numpy.full(count, -numpy.inf)
+
+    loads = TransformerLoad.objects.using("ldc") \
+        .filter(Transformer__in=transformers) \
+        .order_by("Transformer", "ReadDate") \
+        .values_list("Transformer", "ReadDate", "Interval", "LoadMW")
+    rows = loads.iterator()
+
+    pending = []
+    exhausted = count == 0
+    while not exhausted:
+        fetched = list(itertools.islice(rows, chunk_size))
+        exhausted = len(fetched) < chunk_size
+        chunk = pending + fetched
+        if not chunk:
+            break
+
+        with timer("transformer_utilization.convert"):
+            chunk_ids, read_dates, intervals, values = zip(*chunk)
+            chunk_ids = numpy.array(chunk_ids, dtype=str)
+            read_dates = numpy.array(read_dates, dtype="datetime64[D]")
+            intervals = numpy.array(intervals, dtype=numpy.intp)
+            values = numpy.array(values, dtype=numpy.float64)
+
+        # Rating lookup, rows of unrated transformers are dropped
+        index = numpy.minimum(numpy.searchsorted(transformer_ids, chunk_ids),
+                              max(count - 1, 0))
+        rated = transformer_ids[index] == chunk_ids
+        keys = index * DAY_SPAN + read_dates.astype(numpy.int64)
+        offsets = group_offsets(keys)
+
+        # The last (transformer, day) may continue in the next chunk
+        complete = len(offsets) - 1 if exhausted else len(offsets) - 2
+        end = offsets[complete]
+        pending = chunk[end:]
+        index, rated = index[:end], rated[:end]
+        intervals, values = intervals[:end], values[:end]
+        kept = rated & (intervals >= 0) & (intervals < HOURS_PER_DAY) & \
+            ~numpy.isnan(values)
+        groups = numpy.repeat(numpy.arange(complete),
+                              numpy.diff(offsets[:complete + 1]))[kept]
+        index, intervals = index[kept], intervals[kept]
+        ratios = values[kept] * 1000.0 / power_factor / kva[index]
+
+        hours += numpy.bincount(index, minlength=count)
+        exceeded_hours += numpy.bincount(index[ratios > threshold],
+                                         minlength=count)
+        numpy.maximum.at(peaks, index, ratios)
+
+        # One 24-hour row of utilization per (transformer, day)
+        daily = numpy.full((complete, HOURS_PER_DAY), numpy.nan)
+        daily[groups, intervals] = ratios
+        observed = numpy.zeros(complete, dtype=bool)
+        observed[groups] = True
+        day_index = numpy.zeros(complete, dtype=numpy.intp)
+        day_index[groups] = index
+        daily, day_index = daily[observed], day_index[observed]
+        worst = _row_max(window_means(daily, window))
+        days += numpy.bincount(day_index, minlength=count)
+        exceeded_days += numpy.bincount(day_index[worst > threshold],
+                                        minlength=count)
+        blocked = ~numpy.isnan(worst)
+        numpy.maximum.at(block_peaks, day_index[blocked], worst[blocked])
+
+    order = numpy.lexsort((-peaks, -exceeded_hours, -exceeded_days))
+    peaks[numpy.isinf(peaks)] = numpy.nan
+    block_peaks[numpy.isinf(block_peaks)] = numpy.nan
+    return {"transformer_ids": transformer_ids[order], "kva": kva[order],
+            "hours": hours[order], "exceeded_hours": exceeded_hours[order],
+            "days": days[order], "exceeded_days": exceeded_days[order],
+            "peak_utilization": peaks[order],
+            "peak_block_utilization": block_peaks[order]}
+
+
+def write_report(path, scan):
+    """
+    Writes the ranked result of utilization_scan to a CSV file.
+
+    Arguments:
+    path -- Path of the CSV file.
+    scan -- Dictionary returned by utilization_scan.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    columns = ["transformer_ids"] + REPORT_COLUMNS[1:]
+    with open(path, "w", newline="") as report:
+        writer = csv.writer(report)
+        writer.writerow(REPORT_COLUMNS)
+        writer.writerows(zip(*[scan[column].tolist()
+                               for column in columns]))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
+
+    # Area to scan and the overload threshold, eg. A1-TEC 1.0
+    areaStr = sys.argv[1] if len(sys.argv) > 1 else "A1-TEC"
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    transformers = Transformer.objects.using("ldc").filter(Enabled=True,
+                                                           AreaTown=areaStr)
+    scan = utilization_scan(transformers, threshold=threshold)
+    write_report("./figures/utilization/" + areaStr + ".csv", scan)
+    for i in range(min(10, len(scan["transformer_ids"]))):
+        print(scan["transformer_ids"][i], scan["kva"][i],
+              scan["exceeded_days"][i], scan["exceeded_hours"][i],
+              round(scan["peak_utilization"][i], 3))
@@ -1,3 +1,26 @@
-from django.shortcuts import render
+from django.http import Http404
 
-# Create your views here.
+from ldc_analysis.heatmap import heatmap_from_queryset
+from ldc_analysis.models import TransformerLoad
+from ldc_analysis.views import heatmap_response, latest_timestamp
+
+
+def transformer_heatmap(request, transformer_id):
+    """
+    Serves the day x hour TransformerLoad heatmap of one transformer as a
+    cached PNG, see ldc_analysis.views.png_response.
+    """
+    last_modified = latest_timestamp(
+        "ldc", "select max(reading_datetime_standard) from TransformerLoads "
+        "where TransformerID = %s", [transformer_id])
+    if last_modified is None:
+        raise Http404("No TransformerLoad rows for " + transformer_id)
+
+    def compute():
+        loads = TransformerLoad.objects.using("ldc") \
+            .filter(Transformer=transformer_id)
+        return heatmap_from_queryset(loads, "ReadDate", "Interval", "LoadMW")
+
+    return heatmap_response(request, ("transformer_heatmap", transformer_id),
+                            last_modified, compute,
+                            "Transformer ID: " + transformer_id)
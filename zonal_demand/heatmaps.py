@@ -0,0 +1,145 @@
+"""
+Single-pass day x hour heatmaps of every ZonalDemand zone.
+
+@author: r24mille
+"""
+import datetime
+import os
+
+from django.db import connections
+import numpy
+
+from ldc_analysis.heatmap import HOURS_PER_DAY, build_heatmaps
+from ldc_analysis.heatmap_store import HEATMAP_DIR, HeatmapStore, oldest_mark
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.query import SelectQuery, to_days_dates
+from ldc_analysis.weather import epoch_seconds_sql
+from zonal_demand.models import ZonalDemand
+
+
+TOTAL_COLUMNS = ["total_ontario", "total_zones", "difference"]
+ZONE_COLUMNS = ["northwest", "northeast", "ottawa", "east", "toronto",
+                "essa", "bruce", "southwest", "niagara", "west"]
+
+
+def where_days(query, column, start_date, end_date):
+    """
+    Restricts a SelectQuery to the days from start_date to end_date
+    (inclusive) of a DATETIME column, either bound may be None.
+    """
+    if start_date is not None:
+        query.where(column + " >= %s", str(parse_datetime(start_date)))
+    if end_date is not None:
+        query.where(column + " < %s",
+                    str(parse_datetime(end_date) + datetime.timedelta(days=1)))
+
+
+def zonal_heatmaps(columns=TOTAL_COLUMNS + ZONE_COLUMNS, start_date=None,
+                   end_date=None, chunk_size=100000):
+    """
+    Selects every requested ZonalDemand column in one query, converted to
+    double by MySQL rather than to Python Decimals row by row, and scatters
+    them into a (column x day x hour) array. Returns the tuple returned by
+    build_heatmaps, heatmaps[i] is the heatmap of columns[i].
+
+    Arguments:
+    columns -- (Optional) List of ZonalDemand demand columns. Defaults to the
+               totals followed by the ten transmission zones.
+    start_date -- (Optional) First day (inclusive), see
+                  holidays.parse_datetime. Defaults to the first reading.
+    end_date -- (Optional) Last day (inclusive). Defaults to the last
+                reading.
+    chunk_size -- (Optional) Number of rows fetched per round trip.
+    """
+    for column in columns:
+        ZonalDemand._meta.get_field(column)
+    query = SelectQuery(["to_days(zd.demand_datetime_dst)", "zd.hour"] +
+                        ["zd." + column + " + 0e0" for column in columns],
+                        ZonalDemand._meta.db_table + " zd")
+    where_days(query, "zd.demand_datetime_dst", start_date, end_date)
+    chunks = list(query.stream_chunks(connections["zonal"],
+                                      chunk_size))
+    if not chunks:
+        raise ValueError("Cannot build a heatmap without any readings")
+    rows = numpy.concatenate(chunks)
+    days = to_days_dates(rows[:, 0])
+    return build_heatmaps(days, rows[:, 1], rows[:, 2:], hour_offset=1)
+
+
+def _zone_stores(columns, directory):
+    """Returns the list of HeatmapStores of columns."""
+    if directory is None:
+        directory = os.path.join(HEATMAP_DIR, "zonal")
+    for column in columns:
+        ZonalDemand._meta.get_field(column)
+    return [HeatmapStore(directory, column) for column in columns]
+
+
+def update_zonal_heatmaps(columns=TOTAL_COLUMNS + ZONE_COLUMNS, directory=None,
+                          chunk_size=100000):
+    """
+    Appends the ZonalDemand rows newer than each column's persisted heatmap
+    (see heatmap_store.HeatmapStore) with a single query after the oldest
+    high-water mark, and returns the list of columns whose heatmap changed.
+
+    Arguments:
+    columns -- (Optional) List of ZonalDemand demand columns. Defaults to the
+               totals followed by the ten transmission zones.
+    directory -- (Optional) Directory of the heatmap files. Defaults to
+                 <HEATMAP_DIR>/zonal/.
+    chunk_size -- (Optional) Number of rows fetched per round trip.
+    """
+    stores = _zone_stores(columns, directory)
+    # Days follow demand_datetime_dst like zonal_heatmaps, the mark follows
+    # demand_datetime_standard which does not repeat an hour in November
+    query = SelectQuery(["to_days(zd.demand_datetime_dst)", "zd.hour",
+                         epoch_seconds_sql("zd.demand_datetime_standard")] +
+                        ["zd." + column + " + 0e0" for column in columns],
+                        ZonalDemand._meta.db_table + " zd")
+    mark = oldest_mark(stores)
+    if mark is not None:
+        query.where("zd.demand_datetime_standard > %s", mark)
+    query.order("zd.demand_datetime_standard")
+
+    changed = set()
+    for rows in query.stream_chunks(connections["zonal"], chunk_size):
+        days = to_days_dates(rows[:, 0])
+        hours = rows[:, 1].astype(numpy.intp) - 1
+        seconds = rows[:, 2].astype(numpy.int64)
+        for i, store in enumerate(stores):
+            if store.append(days, hours, rows[:, 3 + i], seconds):
+                changed.add(columns[i])
+
+    for column, store in zip(columns, stores):
+        if column in changed:
+            store.save()
+    return [column for column in columns if column in changed]
+
+
+def stored_zonal_heatmaps(columns=TOTAL_COLUMNS + ZONE_COLUMNS,
+                          directory=None):
+    """
+    Returns the persisted heatmaps of columns as the tuple returned by
+    zonal_heatmaps, aligned on the days covered by any column.
+
+    Arguments:
+    columns -- (Optional) List of ZonalDemand demand columns. Defaults to the
+               totals followed by the ten transmission zones.
+    directory -- (Optional) Directory of the heatmap files. Defaults to
+                 <HEATMAP_DIR>/zonal/.
+    """
+    stores = _zone_stores(columns, directory)
+    if any(store.start_day is None for store in stores):
+        raise ValueError("Cannot build a heatmap without any readings")
+    start_day = min(store.start_day for store in stores)
+    end_day = max(store.end_day for store in stores)
+    num_days = int((end_day - start_day).astype(numpy.int64)) + 1
+    heatmaps = numpy.zeros((len(stores), num_days, HOURS_PER_DAY))
+    missing = numpy.ones((num_days, HOURS_PER_DAY), dtype=bool)
+    for i, store in enumerate(stores):
+        first = int((store.start_day - start_day).astype(numpy.int64))
+        rows = slice(first, first + store.num_days)
+        heatmaps[i, rows] = store.heatmap
+        missing[rows] &= store.missing
+    return heatmaps, missing, start_day.astype(object), end_day.astype(object)
+
@@ -1,47 +1,59 @@
 #!/usr/bin/env python
 import os
+import sys
 
-import matplotlib
-import numpy
+from ldc_analysis.heatmap import color_scale
+from ldc_analysis.render import render_heatmaps
+from zonal_demand.heatmaps import TOTAL_COLUMNS, ZONE_COLUMNS, \
+    stored_zonal_heatmaps, update_zonal_heatmaps, zonal_heatmaps
 
-import matplotlib.pyplot as plt
-from zonal_demand.models import ZonalDemand
+
+def heatmap_jobs(columns, heatmaps, missing_hours, start_date, end_date):
+    """
+    Returns the render_heatmaps jobs of the zonal_heatmaps of columns,
+    written to ./figures/zonal/. Provincial totals share one color scale and
+    the ten zones share another so that zones can be compared with each
+    other.
+    """
+    groups = [[columns.index(c) for c in ("total_ontario", "total_zones")
+               if c in columns],
+              [columns.index(c) for c in ZONE_COLUMNS if c in columns],
+              [columns.index(c) for c in ("difference",) if c in columns]]
+    scales = {}
+    for group in groups:
+        if group:
+            scale = color_scale(heatmaps[group], missing_hours)
+            for i in group:
+                scales[i] = scale
+
+    return [("./figures/zonal/" + column + ".png", heatmaps[i], start_date,
+             end_date, column.replace("_", " ").title() + " Demand") +
+            scales[i] for i, column in enumerate(columns)]
 
 
 if __name__ == "__main__":
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ldc_analysis.settings")
-    
-    # Get timeseries of TransformerLoad associated with a Transformer
-    demands = ZonalDemand.objects.using('zonal').all()
-
-    # Find the length of the results to know first and last index, then get the number of days
-    num_loads = len(demands)
-    start_date = demands[0].demand_datetime_dst
-    end_date = demands[num_loads - 1].demand_datetime_dst
-    num_days = (end_date - start_date).days
-
-    # Create an n x 24 matrix to hold each hour's values and zeros for hours without value
-    load_heatmap = numpy.zeros(((num_days + 1), 24))
-    
-    # Loop over all TransformerLoad rows returned and populate them into the proper array slot
-    for zonalDemand in demands:
-        d = (zonalDemand.demand_datetime_dst - start_date).days
-        load_heatmap[d][zonalDemand.hour - 1] = zonalDemand.total_ontario
-    
-    # Plot the timeseries matrix as a heatmap
-    start_datenum = matplotlib.dates.date2num(start_date)
-    end_datenum = matplotlib.dates.date2num(end_date)
-    fig = plt.figure()
-    ax = plt.subplot()
-    # plt.subplots_adjust(left=0.2, bottom=None, right=1, top=None, wspace=None, hspace=None)
-    im = ax.imshow(load_heatmap, interpolation='none', aspect='auto', extent=(0, 24, start_datenum, end_datenum), origin='lower', vmin=9000, vmax=27000)
-    ax.yaxis_date()
-    ax.set_title("Ontario Demand")
-    ax.set_xlabel("Hour of Day")
-    ax.set_ylabel("Day of Year")
-    ax.xaxis.set_ticks(range(0, 24, 2))
-    cb = fig.colorbar(im)
-    cb.set_label("Kilowatt-hours (kWh)")
-    # plt.savefig("./figures/ontario.png", dpi=100)
-    # plt.close()
-    plt.show()
+
+    # Number of rendering processes, defaults to the number of CPUs. With
+    # --update only rows newer than the persisted heatmaps are read.
+    update = "--update" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--update"]
+    processes = int(args[0]) if args else None
+
+    # Get timeseries of every ZonalDemand column in a single query
+    columns = TOTAL_COLUMNS + ZONE_COLUMNS
+    if update:
+        if not update_zonal_heatmaps(columns):
+            print("rendered 0 figures")
+            sys.exit(0)
+        heatmaps, missing_hours, start_date, end_date = \
+            stored_zonal_heatmaps(columns)
+    else:
+        heatmaps, missing_hours, start_date, end_date = \
+            zonal_heatmaps(columns)
+
+    # Plot each zone's timeseries matrix as a heatmap
+    jobs = heatmap_jobs(columns, heatmaps, missing_hours, start_date,
+                        end_date)
+    rendered = render_heatmaps(jobs, processes=processes)
+    print("rendered", len(rendered), "figures")
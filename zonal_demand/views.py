@@ -1,3 +1,42 @@
-from django.shortcuts import render
+from django.http import Http404, HttpResponseBadRequest
 
-# Create your views here.
+from ldc_analysis.holidays import parse_datetime
+from ldc_analysis.query import SelectQuery
+from ldc_analysis.views import heatmap_response, latest_timestamp
+from zonal_demand.heatmaps import TOTAL_COLUMNS, ZONE_COLUMNS, where_days, \
+    zonal_heatmaps
+from zonal_demand.models import ZonalDemand
+
+
+def zone_heatmap(request, zone):
+    """
+    Serves the day x hour heatmap of one ZonalDemand column as a cached PNG,
+    optionally limited to the days from the start to the end query parameter
+    (inclusive, YYYY-MM-DD). See heatmap_response for the height and stat
+    parameters.
+    """
+    if zone not in TOTAL_COLUMNS + ZONE_COLUMNS:
+        raise Http404("Unknown zone " + zone)
+    try:
+        start_date, end_date = [parse_datetime(request.GET[bound]).date()
+                                if request.GET.get(bound) else None
+                                for bound in ("start", "end")]
+    except ValueError:
+        return HttpResponseBadRequest("start and end must be YYYY-MM-DD")
+
+    query = SelectQuery(["max(zd.demand_datetime_dst)"],
+                        ZonalDemand._meta.db_table + " zd")
+    where_days(query, "zd.demand_datetime_dst", start_date, end_date)
+    last_modified = latest_timestamp("zonal", *query.sql())
+    if last_modified is None:
+        raise Http404("No ZonalDemand rows between the requested days")
+
+    def compute():
+        heatmaps, missing, first, last = zonal_heatmaps([zone], start_date,
+                                                        end_date)
+        return heatmaps[0], missing, first, last
+
+    return heatmap_response(request, ("zone_heatmap", zone, str(start_date),
+                                      str(end_date)),
+                            last_modified, compute,
+                            zone.replace("_", " ").title() + " Demand")